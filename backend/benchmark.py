@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Benchmark do pipeline de processamento de imagens
+Mede a latência por etapa (leitura, decodificação, inferência, alpha,
+composição e codificação) e o throughput do app ASGI em processo, com
+imagens sintéticas em várias resoluções e formatos. O resultado sai em JSON
+para comparar execuções ao longo do tempo.
+
+Uso:
+    python benchmark.py --sizes 640x480,1920x1080 --formats jpeg,png \
+        --iterations 20 --requests 100 --concurrency 8 --output resultado.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark do pipeline de processamento de imagens")
+    parser.add_argument("--sizes", default="640x480,1920x1080,4000x3000",
+                        help="Resoluções LxA separadas por vírgula")
+    parser.add_argument("--formats", default="jpeg,png",
+                        help="Formatos de entrada: jpeg, png")
+    parser.add_argument("--model", default=None,
+                        help="Modelo do rembg (padrão: REMBG_MODEL do serviço)")
+    parser.add_argument("--iterations", type=int, default=10,
+                        help="Repetições por imagem na medição por etapa")
+    parser.add_argument("--warmup", type=int, default=2,
+                        help="Repetições descartadas antes de medir")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="Requisições por imagem no teste de throughput (0 = pular)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Requisições simultâneas no teste de throughput")
+    parser.add_argument("--with-background", action="store_true",
+                        help="Compor sobre um fundo (saída JPEG)")
+    parser.add_argument("--background-fit", default="stretch",
+                        choices=("cover", "contain", "stretch"),
+                        help="Ajuste do fundo à foto")
+    parser.add_argument("--output-format", default="auto",
+                        help="Formato da saída: auto, png, jpeg, webp, avif")
+    parser.add_argument("--output-preset", default="balanced",
+                        choices=("fast", "balanced", "small"),
+                        help="Preset do codificador (CPU x tamanho)")
+    parser.add_argument("--with-cache", action="store_true",
+                        help="Manter os caches de resultado/máscara/fundo ligados")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-",
+                        help="Arquivo JSON de saída ('-' = stdout)")
+    return parser.parse_args()
+
+
+def synthetic_image(width, height, fmt, seed):
+    """Gera uma foto sintética: fundo em gradiente com ruído e um "objeto" central"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.empty((height, width, 3), dtype=np.float32)
+    pixels[..., 0] = 255 * x / max(width - 1, 1)
+    pixels[..., 1] = 255 * y / max(height - 1, 1)
+    pixels[..., 2] = 128
+    inside = ((x - width / 2) / (width * 0.3)) ** 2 + \
+        ((y - height / 2) / (height * 0.4)) ** 2 <= 1
+    pixels[inside] = rng.integers(0, 256, size=3)
+    pixels += rng.normal(0, 8, size=pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    with io.BytesIO() as out:
+        if fmt == "jpeg":
+            image.save(out, format="JPEG", quality=90)
+        else:
+            image.save(out, format="PNG")
+        return out.getvalue()
+
+
+def summarize(samples):
+    """Percentis em milissegundos"""
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "min_ms": round(float(values.min()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def bench_stages(main, data, fmt, model, background_bytes, background_fit,
+                 output_format, output_preset, use_cache, iterations, warmup):
+    """Executa as etapas do pipeline em sequência, cronometrando cada uma"""
+    from starlette.datastructures import Headers, UploadFile
+
+    output = main._negotiate_output(
+        None, output_format, output_preset, None, background_bytes)
+    timings = {}
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    background = None
+    background_digest = None
+    if background_bytes is not None:
+        background = main._load_image(Image.open(io.BytesIO(background_bytes)))
+        # Com o digest o fundo redimensionado fica no cache entre repetições
+        if use_cache:
+            background_digest = main._content_hash(background_bytes)
+
+    for i in range(warmup + iterations):
+        if i == warmup:
+            timings.clear()
+        file = UploadFile(
+            io.BytesIO(data), filename=f"bench.{fmt}",
+            headers=Headers({"content-type": CONTENT_TYPES[fmt]}))
+        upload = timed("read", main._validate_and_read_upload, file)
+        if upload.image.format == "JPEG":
+            model_input = timed(
+                "model_input", main._prepare_model_input_from_bytes, upload.data, model)
+            rgba = timed("decode", main._decode_to_rgba_array, upload.image)
+        else:
+            rgba = timed("decode", main._decode_to_rgba_array, upload.image)
+            model_input = timed("model_input", main._prepare_model_input, rgba, model)
+        mask = timed(
+            "inference", main._predict_masks_batch, model, model_input[np.newaxis])[0]
+        pixels = timed("alpha", main._remove_background_to_rgba, rgba, mask)
+        if background is not None:
+            pixels = timed(
+                "composite", main._composite_on_background, pixels, background,
+                background_fit, background_digest)
+        encoded = timed("encode", main._encode_image, pixels, output)
+
+    return {
+        "output_bytes": len(encoded),
+        **{stage: summarize(samples) for stage, samples in timings.items()},
+    }
+
+
+async def bench_throughput(main, images, model, background_bytes, background_fit,
+                           output_format, output_preset, requests, concurrency):
+    """Dispara requisições simultâneas contra o app ASGI, sem rede"""
+    import httpx
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        while not main._ready.is_set():
+            await asyncio.sleep(0.05)
+        async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench", timeout=None) as client:
+            for label, (data, fmt) in images.items():
+                semaphore = asyncio.Semaphore(concurrency)
+                latencies = []
+                statuses = {}
+
+                async def one():
+                    files = {"file": (f"bench.{fmt}", data, CONTENT_TYPES[fmt])}
+                    if background_bytes is not None:
+                        files["background"] = ("fundo.jpg", background_bytes, "image/jpeg")
+                    async with semaphore:
+                        start = time.perf_counter()
+                        response = await client.post(
+                            "/process-image", files=files,
+                            data={"remove_background": "true", "model": model,
+                                  "background_fit": background_fit,
+                                  "output_format": output_format,
+                                  "output_preset": output_preset})
+                        latencies.append(time.perf_counter() - start)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+                start = time.perf_counter()
+                await asyncio.gather(*(one() for _ in range(requests)))
+                elapsed = time.perf_counter() - start
+                results[label] = {
+                    "requests": requests,
+                    "concurrency": concurrency,
+                    "elapsed_s": round(elapsed, 3),
+                    "throughput_rps": round(requests / elapsed, 3),
+                    "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+                    "latency": summarize(latencies),
+                }
+        # Ainda com os workers vivos: o lifespan os encerra na saída
+        worker_peaks = worker_peak_rss(main)
+    return results, worker_peaks
+
+
+def worker_peak_rss(main):
+    # Pico de memória (VmHWM do /proc, Linux) de cada worker de inferência.
+    # RUSAGE_CHILDREN só conta filhos já encerrados e aguardados
+    peaks = {}
+    for worker in main._inference_pool.stats():
+        peak = None
+        if worker["pid"] is not None:
+            try:
+                with open(f"/proc/{worker['pid']}/status") as f:
+                    for line in f:
+                        if line.startswith("VmHWM:"):
+                            peak = int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                pass
+        peaks[str(worker["worker"])] = peak
+    return peaks
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    # Caches desligados por padrão: a mesma imagem repetida mediria só o cache
+    if not args.with_cache:
+        os.environ["CACHE_MAX_BYTES"] = "0"
+        os.environ["MASK_CACHE_MAX_BYTES"] = "0"
+        os.environ["BACKGROUND_CACHE_MAX_BYTES"] = "0"
+        os.environ["CACHE_DIR"] = ""
+    # Fila de jobs descartável, fora do diretório do serviço
+    os.environ.setdefault("JOBS_DIR", tempfile.mkdtemp(prefix="bench-jobs-"))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    model = args.model or main.DEFAULT_MODEL
+    sizes = [tuple(int(v) for v in size.lower().split("x"))
+             for size in args.sizes.split(",")]
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",")]
+
+    background_bytes = None
+    if args.with_background:
+        background_bytes = synthetic_image(1280, 960, "jpeg", args.seed + 1)
+
+    images = {}
+    for width, height in sizes:
+        for fmt in formats:
+            images[f"{width}x{height}.{fmt}"] = (
+                synthetic_image(width, height, fmt, args.seed), fmt)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {**vars(args), "model": model},
+        "stages": {},
+        "throughput": {},
+    }
+
+    print(f"Medindo etapas ({model})...", file=sys.stderr)
+    for label, (data, fmt) in images.items():
+        print(f"  {label}", file=sys.stderr)
+        report["stages"][label] = {
+            "input_bytes": len(data),
+            **bench_stages(main, data, fmt, model, background_bytes,
+                           args.background_fit, args.output_format,
+                           args.output_preset, args.with_cache,
+                           args.iterations, args.warmup),
+        }
+
+    # Workers de inferência só existem durante a medição de throughput
+    worker_peaks = None
+    if args.requests > 0:
+        print("Medindo throughput...", file=sys.stderr)
+        report["throughput"], worker_peaks = asyncio.run(bench_throughput(
+            main, images, model, background_bytes, args.background_fit,
+            args.output_format, args.output_preset, args.requests, args.concurrency))
+
+    # ru_maxrss em KB no Linux (bytes no macOS)
+    scale = 1 if sys.platform == "darwin" else 1024
+    report["peak_rss_bytes"] = {
+        "process": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "inference_workers": worker_peaks,
+    }
+    return report
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        report = run_benchmark(args)
+    except ImportError as e:
+        print(f"Erro: dependência não encontrada ({e.name}).")
+        print("Instale com: pip install -r requirements.txt httpx")
+        sys.exit(1)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Resultados salvos em: {args.output}", file=sys.stderr)
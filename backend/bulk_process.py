@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Remoção de fundo em massa, sem servidor web
+Percorre uma árvore de diretórios e processa cada JPG/PNG com as mesmas
+funções do serviço (main._process_image_sync), em um pool de processos que
+ocupa todos os núcleos. A saída espelha a árvore de entrada.
+
+Um estado em SQLite no diretório de saída guarda o hash do conteúdo de cada
+entrada já processada: arquivos sem mudança (ou com o mesmo conteúdo de outro
+já registrado com os mesmos parâmetros) não passam de novo pelo modelo, e uma
+execução interrompida continua de onde parou. O estado é gravado a cada
+poucas dezenas de resultados ou a cada segundo; cópias idênticas processadas
+ao mesmo tempo, antes desse registro, ainda podem passar as duas pelo modelo.
+
+Uso:
+    python bulk_process.py fotos/ recortes/ --model u2netp --workers 8 \
+        --output-format webp --background fundo.jpg --report resultado.json
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+STATE_FILENAME = ".bulk-state.sqlite3"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Registro frequente: os processos de trabalho só enxergam o que já foi
+# gravado, e uma queda perde no máximo esse intervalo
+COMMIT_EVERY = 32
+COMMIT_INTERVAL_SECONDS = 1.0
+
+# Estado do processo de trabalho (preenchido por init_worker)
+_worker = {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Remove o fundo de todas as imagens de um diretório, sem servidor")
+    parser.add_argument("input_dir", help="Diretório de entrada (percorrido recursivamente)")
+    parser.add_argument("output_dir", help="Diretório de saída (espelha a entrada)")
+    parser.add_argument("--model", default=None,
+                        help="Modelo do rembg (padrão: REMBG_MODEL do serviço)")
+    parser.add_argument("--background", default=None,
+                        help="Imagem de fundo para compor (padrão: recorte transparente)")
+    parser.add_argument("--background-fit", default=None,
+                        choices=("cover", "contain", "stretch"),
+                        help="Ajuste do fundo à foto (padrão: BACKGROUND_FIT do serviço)")
+    parser.add_argument("--output-format", default="auto",
+                        help="Formato da saída: auto (PNG, ou JPG com fundo), png, jpeg, webp, avif")
+    parser.add_argument("--output-preset", default=None,
+                        choices=("fast", "balanced", "small"),
+                        help="Preset do codificador (padrão: OUTPUT_PRESET do serviço)")
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processos de trabalho (padrão: número de CPUs)")
+    parser.add_argument("--threads-per-worker", type=int, default=1,
+                        help="Threads do onnxruntime em cada processo")
+    parser.add_argument("--chunksize", type=int, default=8,
+                        help="Imagens entregues a um processo de cada vez")
+    parser.add_argument("--force", action="store_true",
+                        help="Reprocessar mesmo o que já está em dia")
+    parser.add_argument("--progress-interval", type=float, default=5.0,
+                        help="Segundos entre as linhas de progresso")
+    parser.add_argument("--report", default="-",
+                        help="Arquivo JSON com o resumo ('-' = stdout)")
+    return parser.parse_args()
+
+
+def configure_environment(threads_per_worker, jobs_dir):
+    # Antes de importar main: sem caches de resultado (cada imagem é vista
+    # uma vez), fila de jobs descartável e threads do onnxruntime por processo
+    os.environ["CACHE_MAX_BYTES"] = "0"
+    os.environ["MASK_CACHE_MAX_BYTES"] = "0"
+    os.environ["CACHE_DIR"] = ""
+    os.environ["JOBS_DIR"] = jobs_dir
+    os.environ["ORT_INTRA_OP_THREADS"] = str(threads_per_worker)
+    os.environ["ORT_INTER_OP_THREADS"] = "1"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def open_state(output_dir):
+    conn = sqlite3.connect(os.path.join(output_dir, STATE_FILENAME))
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS processed (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            digest TEXT,
+            params TEXT NOT NULL,
+            output TEXT,
+            status TEXT NOT NULL,
+            detail TEXT,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS processed_digest ON processed (digest, params)")
+    conn.commit()
+    return conn
+
+
+def params_key(model, background_digest, background_fit, output_key):
+    # Outros parâmetros, outro resultado: o estado só vale para os mesmos
+    raw = "|".join((model, background_digest or "", background_fit, output_key))
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def output_paths(filenames, extension):
+    # Saída com a extensão do formato; foto.jpg e foto.png no mesmo
+    # diretório viram foto.jpg.png e foto.png.png em vez de colidir
+    stems = {}
+    for name in filenames:
+        stem = os.path.splitext(name)[0]
+        stems[stem] = stems.get(stem, 0) + 1
+    return {name: (os.path.splitext(name)[0] if stems[os.path.splitext(name)[0]] == 1
+                   else name) + extension
+            for name in filenames}
+
+
+def iter_tasks(input_dir, output_dir, extension, params, force, window, stats):
+    """Percorre a árvore em ordem e devolve só o que precisa de trabalho"""
+    # Roda na thread que alimenta o pool: conexão própria, só leitura
+    state = sqlite3.connect(
+        f"file:{os.path.join(output_dir, STATE_FILENAME)}?mode=ro", uri=True)
+    try:
+        for root, dirs, files in os.walk(input_dir):
+            dirs.sort()
+            images = sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+            for name, output_name in output_paths(images, extension).items():
+                path = os.path.relpath(os.path.join(root, name), input_dir)
+                output = os.path.relpath(os.path.join(root, output_name), input_dir)
+                stat = os.stat(os.path.join(input_dir, path))
+                if not force:
+                    # Caminho rápido: mesmo tamanho e mtime, sem ler o arquivo
+                    row = state.execute(
+                        "SELECT output FROM processed WHERE path = ? AND size = ? "
+                        "AND mtime_ns = ? AND params = ? AND status = 'done'",
+                        (path, stat.st_size, stat.st_mtime_ns, params)).fetchone()
+                    if row is not None and row[0] == output \
+                            and os.path.exists(os.path.join(output_dir, output)):
+                        stats["skipped"] += 1
+                        continue
+                # Limita as tarefas em voo: a árvore não vai inteira para a fila
+                window.acquire()
+                yield path, output, stat.st_size, stat.st_mtime_ns
+    finally:
+        state.close()
+
+
+def init_worker(input_dir, output_dir, model, background_path, background_fit,
+                output, params, force):
+    import main
+
+    background_bytes = None
+    if background_path:
+        with open(background_path, "rb") as f:
+            background_bytes = f.read()
+    main._get_session(model)  # carrega e aquece a sessão uma vez por processo
+    _worker.update(
+        main=main, input_dir=input_dir, output_dir=output_dir, model=model,
+        background=background_bytes, background_fit=background_fit,
+        output=main._OutputSpec(*output), params=params, force=force, state=None)
+
+
+def _find_done(digest):
+    # Mesmo conteúdo e parâmetros já processados (por este ou outro caminho)
+    if _worker["force"]:
+        return None
+    if _worker["state"] is None:
+        _worker["state"] = sqlite3.connect(
+            f"file:{os.path.join(_worker['output_dir'], STATE_FILENAME)}?mode=ro",
+            uri=True)
+    rows = _worker["state"].execute(
+        "SELECT output FROM processed WHERE digest = ? AND params = ? "
+        "AND status = 'done'", (digest, _worker["params"])).fetchall()
+    for (output,) in rows:
+        if os.path.exists(os.path.join(_worker["output_dir"], output)):
+            return output
+    return None
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def process_one(task):
+    """Processa uma imagem no processo de trabalho e grava a saída"""
+    path, output, size, mtime_ns = task
+    main = _worker["main"]
+    start = time.perf_counter()
+    result = {"path": path, "output": output, "size": size, "mtime_ns": mtime_ns,
+              "digest": None, "output_bytes": 0, "detail": None}
+    try:
+        with open(os.path.join(_worker["input_dir"], path), "rb") as f:
+            data = f.read()
+        result["digest"] = main._content_hash(data)
+        destination = os.path.join(_worker["output_dir"], output)
+        previous = _find_done(result["digest"])
+        if previous == output:
+            # Só o mtime mudou: a saída existente continua valendo
+            result["status"] = "unchanged"
+        elif previous is not None:
+            shutil.copyfile(os.path.join(_worker["output_dir"], previous), f"{destination}.tmp")
+            os.replace(f"{destination}.tmp", destination)
+            result["status"] = "duplicate"
+            result["output_bytes"] = os.path.getsize(destination)
+        else:
+            # Mesmas validações de cabeçalho do serviço (formato, megapixels)
+            if main._sniff_image_header(bytearray(data)) is None:
+                raise main._InvalidImageError("cabeçalho ilegível")
+            processed, _ = main._process_image_sync(
+                data, True, _worker["background"], _worker["model"],
+                _worker["background_fit"], _worker["output"])
+            _write_atomic(destination, processed)
+            result["status"] = "done"
+            result["output_bytes"] = len(processed)
+    except main.HTTPException as exc:
+        result["status"], result["detail"] = "failed", exc.detail
+    except main._InvalidImageError:
+        result["status"], result["detail"] = "failed", "Arquivo não é uma imagem válida."
+    except Exception as exc:
+        result["status"], result["detail"] = "failed", f"{type(exc).__name__}: {exc}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def record(state, params, result):
+    # Entrada repetida ou sem mudança também fica como concluída
+    status = "failed" if result["status"] == "failed" else "done"
+    state.execute(
+        "INSERT OR REPLACE INTO processed (path, size, mtime_ns, digest, params, "
+        "output, status, detail, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (result["path"], result["size"], result["mtime_ns"], result["digest"], params,
+         result["output"], status, result["detail"], time.time()))
+
+
+def run(args):
+    input_dir = os.path.abspath(args.input_dir)
+    output_dir = os.path.abspath(args.output_dir)
+    if not os.path.isdir(input_dir):
+        raise SystemExit(f"Erro: diretório de entrada não encontrado: {args.input_dir}")
+    if output_dir == input_dir or output_dir.startswith(input_dir + os.sep):
+        raise SystemExit("Erro: o diretório de saída não pode ficar dentro da entrada.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs_dir = tempfile.mkdtemp(prefix="bulk-jobs-")
+    configure_environment(args.threads_per_worker, jobs_dir)
+    import main
+
+    model = args.model or main.DEFAULT_MODEL
+    background_fit = args.background_fit or main.DEFAULT_BACKGROUND_FIT
+    preset = args.output_preset or main.DEFAULT_OUTPUT_PRESET
+    try:
+        main._parse_processing_options(
+            model, background_fit, args.output_format, preset, args.quality)
+    except main.HTTPException as exc:
+        raise SystemExit(f"Erro: {exc.detail}")
+    background_digest = None
+    if args.background:
+        with open(args.background, "rb") as f:
+            background_digest = main._content_hash(f.read())
+    output = main._negotiate_output(
+        None, args.output_format, preset, args.quality, background_digest)
+    params = params_key(model, background_digest, background_fit, output.key)
+    extension = main.OUTPUT_EXTENSIONS[output.format]
+    # Modelo baixado (se preciso) uma vez, antes dos processos disputarem o download
+    try:
+        main._create_session(model)
+    except Exception as exc:
+        raise SystemExit(f"Erro ao carregar o modelo {model}: {exc}")
+
+    state = open_state(output_dir)
+    stats = {"processed": 0, "unchanged": 0, "duplicates": 0, "skipped": 0,
+             "failed": 0, "input_bytes": 0, "output_bytes": 0}
+    image_seconds = 0.0
+    window_size = max(1, args.workers * args.chunksize * 4)
+    window = threading.Semaphore(window_size)
+    tasks = iter_tasks(input_dir, output_dir, extension, params, args.force, window, stats)
+    ctx = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    last_progress = last_commit = start
+    pending_commits = 0
+    interrupted = False
+    print(f"Processando {input_dir} -> {output_dir} ({model}, {args.workers} processos)...",
+          file=sys.stderr)
+    pool = ctx.Pool(
+        args.workers, initializer=init_worker,
+        initargs=(input_dir, output_dir, model, args.background, background_fit,
+                  tuple(output), params, args.force))
+    try:
+        for result in pool.imap_unordered(process_one, tasks, chunksize=args.chunksize):
+            window.release()
+            record(state, params, result)
+            pending_commits += 1
+            now = time.perf_counter()
+            if pending_commits >= COMMIT_EVERY or now - last_commit >= COMMIT_INTERVAL_SECONDS:
+                state.commit()
+                pending_commits = 0
+                last_commit = now
+            key = {"done": "processed", "duplicate": "duplicates"}.get(
+                result["status"], result["status"])
+            stats[key] += 1
+            stats["input_bytes"] += result["size"]
+            stats["output_bytes"] += result["output_bytes"]
+            image_seconds += result["seconds"]
+            if result["status"] == "failed":
+                print(f"  falha: {result['path']}: {result['detail']}", file=sys.stderr)
+            if now - last_progress >= args.progress_interval:
+                last_progress = now
+                print(f"  {stats['processed']} processadas "
+                      f"({stats['processed'] / (now - start):.1f}/s), "
+                      f"{stats['skipped'] + stats['unchanged'] + stats['duplicates']} "
+                      f"reaproveitadas, {stats['failed']} falhas", file=sys.stderr)
+        pool.close()
+    except KeyboardInterrupt:
+        # O que já foi gravado fica no estado; a próxima execução continua daqui
+        interrupted = True
+        # Destrava a thread que alimenta o pool para ela perceber o fim
+        window.release(window_size)
+        pool.terminate()
+    finally:
+        pool.join()
+        state.commit()
+        state.close()
+        shutil.rmtree(jobs_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    handled = stats["processed"] + stats["unchanged"] + stats["duplicates"] + stats["failed"]
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "input_dir": input_dir,
+        "output_dir": output_dir,
+        "parameters": {"model": model, "background": args.background,
+                       "background_fit": background_fit, "output_format": output.format,
+                       "output_preset": output.preset, "quality": output.quality,
+                       "workers": args.workers,
+                       "threads_per_worker": args.threads_per_worker},
+        "interrupted": interrupted,
+        "images": {name: stats[name] for name in
+                   ("processed", "unchanged", "duplicates", "skipped", "failed")},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ips": round(stats["processed"] / elapsed, 3) if elapsed else 0.0,
+        "input_mb_per_s": round(stats["input_bytes"] / elapsed / 1e6, 3) if elapsed else 0.0,
+        "mean_image_ms": round(image_seconds / handled * 1000, 3) if handled else None,
+        "input_bytes": stats["input_bytes"],
+        "output_bytes": stats["output_bytes"],
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        report = run(args)
+    except ImportError as e:
+        print(f"Erro: dependência não encontrada ({e.name}).")
+        print("Instale com: pip install -r requirements.txt")
+        sys.exit(1)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.report == "-":
+        print(output)
+    else:
+        with open(args.report, "w") as f:
+            f.write(output + "\n")
+        print(f"Resumo salvo em: {args.report}", file=sys.stderr)
+    sys.exit(1 if report["interrupted"] or report["images"]["failed"] else 0)
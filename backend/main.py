@@ -1,18 +1,1205 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, JSONResponse
-from PIL import Image
-from rembg import remove
+from fastapi.responses import Response, JSONResponse, StreamingResponse, FileResponse
+from starlette.websockets import WebSocketState
+from PIL import Image, ImageSequence
+from rembg.sessions import sessions_class
+from rembg.sessions.base import BaseSession
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import NamedTuple
+import numpy as np
+import onnxruntime as ort
+import bisect
+import hashlib
 import io
+import json
+import logging
+import os
 import asyncio
+import multiprocessing
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+
+try:
+    # Registra o AVIF no Pillow (nativo a partir do Pillow 11.2)
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+_logger = logging.getLogger(__name__)
 
 
 MAX_FILE_SIZE_BYTES = 10 * 1024 * 1024  # 10MB
 PROCESS_TIMEOUT_SECONDS = 30
 ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png"}
+ALLOWED_IMAGE_FORMATS = {"JPEG", "PNG"}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Prefixo analisado uma única vez atrás do cabeçalho (EXIF/ICC longos cabem)
+HEADER_SNIFF_BYTES = 256 * 1024
+# Foto + fundo + campos do formulário
+MAX_REQUEST_BODY_BYTES = 2 * MAX_FILE_SIZE_BYTES + 64 * 1024
+# Endpoint em lote (/process-images)
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "500"))
+MAX_BATCH_REQUEST_BYTES = int(
+    os.getenv("MAX_BATCH_REQUEST_BYTES", str(500 * 1024 * 1024)))
+BATCH_ENDPOINT_CONCURRENCY = int(os.getenv("BATCH_ENDPOINT_CONCURRENCY", "16"))
+BATCH_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Sequências de quadros (/process-sequence): GIF/PNG/WebP animado ou zip de quadros
+MAX_SEQUENCE_FRAMES = int(os.getenv("MAX_SEQUENCE_FRAMES", "1000"))
+MAX_SEQUENCE_REQUEST_BYTES = int(
+    os.getenv("MAX_SEQUENCE_REQUEST_BYTES", str(200 * 1024 * 1024)))
+ANIMATED_IMAGE_FORMATS = {"GIF", "PNG", "WEBP"}
+# Reuso temporal da máscara: quadro quase igual ao último quadro inferido
+# (diferença média 0..1 entre miniaturas em cinza) não passa pelo modelo
+TEMPORAL_REUSE_THRESHOLD = float(os.getenv("TEMPORAL_REUSE_THRESHOLD", "0.01"))
+# Quadros seguidos com máscara reaproveitada antes de uma nova inferência
+TEMPORAL_MAX_REUSE = int(os.getenv("TEMPORAL_MAX_REUSE", "15"))
+TEMPORAL_SIGNATURE_SIDE = 32
+# Modo ao vivo (WebSocket /ws/live): preview interativo quadro a quadro
+MAX_LIVE_CONNECTIONS = int(os.getenv("MAX_LIVE_CONNECTIONS", "8"))
+LIVE_IDLE_TIMEOUT_SECONDS = float(os.getenv("LIVE_IDLE_TIMEOUT_SECONDS", "60"))
+# Um JPEG de 10MB pode virar 50+ megapixels ao ser decodificado
+MAX_IMAGE_MEGAPIXELS = float(os.getenv("MAX_IMAGE_MEGAPIXELS", "50"))
+Image.MAX_IMAGE_PIXELS = int(MAX_IMAGE_MEGAPIXELS * 1_000_000)
+# Refinamento de bordas da máscara (guided filter) antes da ampliação final
+MASK_EDGE_REFINEMENT = os.getenv(
+    "MASK_EDGE_REFINEMENT", "false").lower() in ("1", "true", "yes")
+MASK_REFINE_MAX_SIDE = 2048
+MASK_REFINE_RADIUS = 8
+MASK_REFINE_EPS = 1e-3
+# Composição sobre o fundo: como o fundo ocupa o tamanho da foto
+BACKGROUND_FIT_MODES = ("cover", "contain", "stretch")
+DEFAULT_BACKGROUND_FIT = os.getenv("BACKGROUND_FIT", "stretch")
+BACKGROUND_CACHE_MAX_BYTES = int(
+    os.getenv("BACKGROUND_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Faixa de linhas por passada da mistura alpha (buffers de trabalho pequenos)
+BLEND_CHUNK_ROWS = 256
+# Modo máscara (result=mask): só o canal alpha, sem composição nem cor
+RESULT_MODES = ("image", "mask")
+MASK_ENCODINGS = ("png", "rle")
+# Alpha mínimo para o pixel contar na caixa do primeiro plano (ignora o
+# ruído da ampliação LANCZOS) e limiar de binarização do RLE
+MASK_BBOX_THRESHOLD = 8
+MASK_RLE_THRESHOLD = 128
+
+# Modelos de segmentação disponíveis (nome público -> nome da sessão no rembg)
+REMBG_MODELS = {
+    "u2net": "u2net",
+    "u2netp": "u2netp",
+    "isnet": "isnet-general-use",
+    "silueta": "silueta",
+}
+DEFAULT_MODEL = os.getenv("REMBG_MODEL", "u2net")
+# Modelos carregados e aquecidos na inicialização (separados por vírgula)
+PRELOAD_MODELS = [
+    m.strip() for m in os.getenv("REMBG_PRELOAD_MODELS", DEFAULT_MODEL).split(",")
+    if m.strip()
+]
+# 0 = deixa o onnxruntime decidir
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+WARMUP_IMAGE_SIZE = (64, 64)
+
+# Pré-processamento de cada modelo: (lado da entrada, média, desvio padrão)
+MODEL_INPUT_SPECS = {
+    "u2net": (320, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+    "u2netp": (320, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+    "isnet": (1024, (0.485, 0.456, 0.406), (1.0, 1.0, 1.0)),
+    "silueta": (320, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+}
+# Micro-batching: pedidos que chegam dentro da janela viram uma única inferência
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+# Processos de inferência dedicados e controle de admissão
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+MAX_PENDING_REQUESTS = int(os.getenv("MAX_PENDING_REQUESTS", "32"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+WORKER_RESTART_BACKOFF_SECONDS = 1
+
+# Cache de resultados/máscaras endereçado pelo conteúdo do upload
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+MASK_CACHE_MAX_BYTES = int(
+    os.getenv("MASK_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_DIR = os.getenv("CACHE_DIR", "")  # vazio = somente memória
+CACHE_DISK_MAX_BYTES = int(
+    os.getenv("CACHE_DISK_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+OUTPUT_MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+# Formato da saída: output_format explícito ou negociado pelo Accept
+Image.init()
+AVAILABLE_OUTPUT_FORMATS = [
+    fmt for fmt in OUTPUT_MEDIA_TYPES if fmt.upper() in Image.SAVE]
+OUTPUT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp", "avif": ".avif"}
+# Presets trocam CPU por bytes: fast codifica rápido, small gera arquivos menores
+OUTPUT_PRESETS = ("fast", "balanced", "small")
+DEFAULT_OUTPUT_PRESET = os.getenv("OUTPUT_PRESET", "balanced")
+OUTPUT_QUALITY = {
+    "jpeg": int(os.getenv("JPEG_QUALITY", "95")),
+    "webp": int(os.getenv("WEBP_QUALITY", "90")),
+    "avif": int(os.getenv("AVIF_QUALITY", "75")),
+}
+# Vazio = nível do preset (1 / 6 / 9)
+PNG_COMPRESS_LEVEL = os.getenv("PNG_COMPRESS_LEVEL", "")
+ENCODER_PRESETS = {
+    "png": {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "small": {"compress_level": 9, "optimize": True},
+    },
+    "jpeg": {
+        "fast": {"subsampling": 0},
+        "balanced": {"subsampling": 0, "optimize": True},
+        "small": {"subsampling": 2, "optimize": True, "progressive": True},
+    },
+    # WebP method 6 e AVIF speed < 6 custam segundos por megapixel (alpha com
+    # ruído fica ordens de grandeza mais lento) para ganhos de poucos por cento
+    "webp": {
+        "fast": {"method": 0},
+        "balanced": {"method": 4},
+        "small": {"method": 5},
+    },
+    "avif": {
+        "fast": {"speed": 10},
+        "balanced": {"speed": 8},
+        "small": {"speed": 6},
+    },
+}
+
+# Jobs assíncronos (/jobs): fila persistida em SQLite + arquivos em disco
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "1000"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+JOB_LONG_POLL_MAX_SECONDS = 30
+JOB_POLL_INTERVAL_SECONDS = 1
+JOB_PURGE_INTERVAL_SECONDS = 600
+
+
+# Métricas (/metrics) e cabeçalho Server-Timing opcional por requisição
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+# Threads do executor padrão (decodificação, pós-processamento, leitura)
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Sessões rembg/onnxruntime nomeadas, criadas uma única vez por processo
+_sessions: dict[str, BaseSession] = {}
+_sessions_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def _labels(*pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def _metric(name: str, kind: str, help_text: str, samples) -> list[str]:
+    # samples: lista de (labels, valor) no formato texto do Prometheus
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_labels(*sorted(labels.items()))} {value}"
+              for labels, value in samples]
+    return lines
+
+
+class _Histogram:
+    """Histograma cumulativo no formato texto do Prometheus"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            snapshot = [(key, list(counts), total, count)
+                        for key, (counts, total, count) in sorted(self._series.items())]
+        lines = [f"# HELP {self.name} {self.help_text}",
+                 f"# TYPE {self.name} histogram"]
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(
+                    f"{self.name}_bucket{_labels(*key, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(*key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_labels(*key)} {total}")
+            lines.append(f"{self.name}_count{_labels(*key)} {count}")
+        return lines
+
+
+_stage_seconds = _Histogram(
+    "image_stage_duration_seconds", "Duração de cada etapa do processamento.")
+_request_seconds = _Histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP.")
+_encode_seconds = _Histogram(
+    "image_encode_duration_seconds", "Duração da codificação da saída por formato.")
+_output_bytes = _Histogram(
+    "image_output_bytes", "Tamanho da imagem gerada por formato.",
+    buckets=(16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024,
+             16 * 1024 * 1024, 64 * 1024 * 1024))
+_batch_sizes = _Histogram(
+    "inference_batch_size", "Imagens por inferência em lote.",
+    buckets=(1, 2, 4, 8, 16, 32))
+_executor: ThreadPoolExecutor | None = None
+# Tempos por etapa da requisição atual (alimenta o Server-Timing)
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def _stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _stage_seconds.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def _create_session(model: str) -> BaseSession:
+    rembg_name = REMBG_MODELS[model]
+    session_class = next(
+        (sc for sc in sessions_class if sc.name() == rembg_name), None)
+    if session_class is None:
+        raise ValueError(f"Modelo não suportado pelo rembg: {rembg_name}")
+
+    sess_opts = ort.SessionOptions()
+    if ORT_INTRA_OP_THREADS > 0:
+        sess_opts.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    if ORT_INTER_OP_THREADS > 0:
+        sess_opts.inter_op_num_threads = ORT_INTER_OP_THREADS
+    sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return session_class(rembg_name, sess_opts)
+
+
+def _warmup_session(session: BaseSession) -> None:
+    # Uma inferência descartável aloca os buffers e compila o grafo
+    dummy = Image.new("RGB", WARMUP_IMAGE_SIZE, (127, 127, 127))
+    session.predict(dummy)
+
+
+def _get_session(model: str) -> BaseSession:
+    session = _sessions.get(model)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(model)
+        if session is None:
+            session = _create_session(model)
+            _warmup_session(session)
+            _sessions[model] = session
+    return session
+
+
+def _preload_sessions() -> None:
+    for model in PRELOAD_MODELS:
+        _get_session(model)
+
+
+def _model_input_from_image(image: Image.Image, model: str) -> np.ndarray:
+    # Mesmo pré-processamento do rembg, devolvendo um tensor CHW float32;
+    # reducing_gap encolhe por blocos antes do LANCZOS em imagens grandes
+    side, mean, std = MODEL_INPUT_SPECS[model]
+    resized = image.resize((side, side), Image.LANCZOS, reducing_gap=3.0)
+    arr = np.asarray(resized.convert("RGB"), dtype=np.float32)
+    arr /= max(float(arr.max()), 1.0)
+    arr -= np.asarray(mean, dtype=np.float32)
+    arr /= np.asarray(std, dtype=np.float32)
+    return arr.transpose(2, 0, 1)
+
+
+def _prepare_model_input(rgba: np.ndarray, model: str) -> np.ndarray:
+    with _stage("model_input"):
+        return _model_input_from_image(Image.fromarray(rgba), model)
+
+
+def _prepare_model_input_from_bytes(file_bytes: bytes, model: str) -> np.ndarray:
+    # JPEG: decodificação reduzida (draft, escala 1/2..1/8 no próprio DCT)
+    # já perto do tamanho do modelo, sem decodificar a imagem inteira
+    side = MODEL_INPUT_SPECS[model][0]
+    with _stage("model_input"), Image.open(io.BytesIO(file_bytes)) as im:
+        im.draft("RGB", (side, side))
+        return _model_input_from_image(_load_image(im), model)
+
+
+def _supports_batching(session: BaseSession) -> bool:
+    # Modelos exportados com batch fixo em 1 precisam rodar item a item
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not (isinstance(batch_dim, int) and batch_dim == 1)
+
+
+def _predict_masks_batch(model: str, batch: np.ndarray) -> np.ndarray:
+    # batch: (N, 3, S, S) -> máscaras uint8 (N, S, S) no tamanho da entrada
+    session = _get_session(model)
+    inner = session.inner_session
+    input_name = inner.get_inputs()[0].name
+    if _supports_batching(session):
+        preds = inner.run(None, {input_name: batch})[0][:, 0, :, :]
+    else:
+        preds = np.concatenate([
+            inner.run(None, {input_name: item[np.newaxis]})[0][:, 0, :, :]
+            for item in batch
+        ])
+
+    # Normalização min-max por imagem, como o rembg faz
+    mi = preds.min(axis=(1, 2), keepdims=True)
+    ma = preds.max(axis=(1, 2), keepdims=True)
+    preds = (preds - mi) / np.maximum(ma - mi, 1e-8)
+    return (preds * 255).astype(np.uint8)
+
+
+def _inference_worker_main(conn, intra_threads: int) -> None:
+    # Ponto de entrada de cada processo de inferência: carrega e aquece as
+    # sessões uma vez e depois executa as tarefas recebidas pelo pipe
+    global ORT_INTRA_OP_THREADS
+    if ORT_INTRA_OP_THREADS <= 0:
+        ORT_INTRA_OP_THREADS = intra_threads
+    start = time.perf_counter()
+    try:
+        _preload_sessions()
+    except Exception as exc:
+        conn.send(("error", repr(exc)))
+        return
+    conn.send(("ready", (sorted(_sessions), time.perf_counter() - start)))
+
+    while True:
+        try:
+            func, args = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            break
+        try:
+            conn.send(("ok", func(*args)))
+        except Exception as exc:
+            conn.send(("error", repr(exc)))
+
+
+class _InferenceWorker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.restarts = 0
+        self.models: list[str] = []
+        self.load_seconds: float | None = None
+
+    def call(self, func, args):
+        self.conn.send((func, args))
+        return self.conn.recv()
+
+
+class _InferencePool:
+    """Processos de inferência dedicados, cada um com suas próprias sessões carregadas"""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [_InferenceWorker(i) for i in range(self.size)]
+        # Uma thread por worker fica bloqueada esperando a resposta do pipe
+        self._io = ThreadPoolExecutor(
+            max_workers=self.size, thread_name_prefix="inference-io")
+        self._idle: asyncio.Queue | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def models(self) -> list[str]:
+        return sorted({m for w in self._workers if w.ready for m in w.models})
+
+    async def open(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._idle = asyncio.Queue()
+        # Sobe todos os processos antes de esperar o aquecimento de cada um
+        for worker in self._workers:
+            await loop.run_in_executor(None, self._spawn, worker)
+        for worker in self._workers:
+            await loop.run_in_executor(None, self._wait_ready, worker)
+            self._idle.put_nowait(worker)
+
+    async def run(self, func, args: tuple, timeout: float | None = None):
+        if self._idle is None:
+            raise RuntimeError("Pool de inferência não iniciado")
+        loop = asyncio.get_running_loop()
+        worker = await self._acquire()
+        job = loop.run_in_executor(self._io, worker.call, func, args)
+        try:
+            status, payload = await asyncio.wait_for(job, timeout)
+        except BaseException:
+            # Timeout, cancelamento ou processo morto: o processo é encerrado
+            # de fato (a inferência não continua gastando CPU) e substituído
+            self._schedule_restart(worker)
+            raise
+        self._idle.put_nowait(worker)
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "worker": w.index,
+                "pid": w.process.pid if w.process is not None else None,
+                "alive": w.process is not None and w.process.is_alive(),
+                "ready": w.ready,
+                "restarts": w.restarts,
+                "load_seconds": w.load_seconds,
+            }
+            for w in self._workers
+        ]
+
+    @property
+    def busy(self) -> int:
+        if self._idle is None:
+            return 0
+        return sum(1 for w in self._workers if w.ready) - self._idle.qsize()
+
+    def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        for worker in self._workers:
+            self._terminate(worker)
+        self._io.shutdown(wait=False)
+        self._idle = None
+
+    async def _acquire(self) -> _InferenceWorker:
+        while True:
+            worker = await self._idle.get()
+            if worker.process.is_alive():
+                return worker
+            # Worker morreu enquanto estava ocioso: repor e tentar o próximo
+            self._schedule_restart(worker)
+
+    def _schedule_restart(self, worker: _InferenceWorker) -> None:
+        worker.ready = False
+        task = asyncio.get_running_loop().create_task(self._restart(worker))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _restart(self, worker: _InferenceWorker) -> None:
+        loop = asyncio.get_running_loop()
+        worker.restarts += 1
+        while True:
+            try:
+                await loop.run_in_executor(None, self._replace, worker)
+                break
+            except Exception:
+                await asyncio.sleep(WORKER_RESTART_BACKOFF_SECONDS)
+        if self._idle is not None:
+            self._idle.put_nowait(worker)
+
+    def _replace(self, worker: _InferenceWorker) -> None:
+        self._terminate(worker)
+        self._spawn(worker)
+        self._wait_ready(worker)
+
+    def _spawn(self, worker: _InferenceWorker) -> None:
+        intra_threads = max(1, (os.cpu_count() or 1) // self.size)
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_inference_worker_main,
+            args=(child_conn, intra_threads),
+            name=f"inference-worker-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process, worker.conn, worker.ready = process, parent_conn, False
+
+    @staticmethod
+    def _wait_ready(worker: _InferenceWorker) -> None:
+        status, payload = worker.conn.recv()
+        if status != "ready":
+            raise RuntimeError(f"Falha ao iniciar worker de inferência: {payload}")
+        worker.models, worker.load_seconds = payload
+        worker.ready = True
+
+    @staticmethod
+    def _terminate(worker: _InferenceWorker) -> None:
+        worker.ready = False
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+        if worker.conn is not None:
+            worker.conn.close()
+            worker.conn = None
+
+
+class _AdmissionGate:
+    """Limita as requisições em processamento; acima do limite a resposta é 503"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.pending = 0
+
+    def try_acquire(self) -> bool:
+        if self.pending >= self.limit:
+            return False
+        self.pending += 1
+        return True
+
+    def release(self) -> None:
+        self.pending -= 1
+
+
+_inference_pool = _InferencePool(INFERENCE_WORKERS)
+_admission = _AdmissionGate(MAX_PENDING_REQUESTS)
+
+
+def _service_unavailable(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=detail,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+class _MaskBatcher:
+    """Agrupa pedidos de máscara por alguns milissegundos e roda uma inferência em lote"""
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float, slots: int):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.slots = max(1, slots)
+        self._slots = asyncio.Semaphore(self.slots)
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def predict(self, model: str, model_input: np.ndarray) -> np.ndarray:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = self._queues[model] = asyncio.Queue()
+            self._spawn(self._collect(model, queue))
+        future = asyncio.get_running_loop().create_future()
+        # Inclui a espera na fila do agrupador, não só a inferência em si
+        with _stage("inference"):
+            await queue.put((model_input, future))
+            return await future
+
+    @property
+    def queued(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self, model: str, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await queue.get()]
+            # Enquanto todos os workers de inferência estão ocupados, a fila
+            # continua acumulando e o próximo lote sai maior
+            await self._slots.acquire()
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Pedidos já abandonados (timeout/cancelamento) não entram no lote
+            items = [(t, f) for t, f in items if not f.done()]
+            if not items:
+                self._slots.release()
+                continue
+            self._spawn(self._dispatch(model, items))
+
+    async def _dispatch(self, model: str, items: list) -> None:
+        try:
+            batch = np.stack([model_input for model_input, _ in items])
+            _batch_sizes.observe(len(items))
+            job = asyncio.ensure_future(_inference_pool.run(
+                _predict_masks_batch, (model, batch), PROCESS_TIMEOUT_SECONDS))
+            # Se todos os pedidos do lote forem abandonados, a inferência é
+            # cancelada de verdade (o worker é encerrado e reposto)
+            waiting = {future for _, future in items}
+            while not job.done():
+                waiting = {future for future in waiting if not future.done()}
+                if not waiting:
+                    job.cancel()
+                    break
+                await asyncio.wait(
+                    {job, *waiting}, return_when=asyncio.FIRST_COMPLETED)
+            if job.cancelled():
+                return
+            masks = job.result()
+        except Exception as exc:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            self._slots.release()
+
+        for (_, future), mask in zip(items, masks):
+            if not future.done():
+                future.set_result(mask)
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queues.clear()
+        self._slots = asyncio.Semaphore(self.slots)
+
+
+_mask_batcher = _MaskBatcher(
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, INFERENCE_WORKERS)
+
+
+class _ByteLRUCache:
+    """Cache LRU limitado pelo total de bytes, com camada opcional em disco"""
+
+    def __init__(self, max_bytes: int, directory: str = "", disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._disk_index: OrderedDict[str, int] = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self) -> None:
+        # Reconstrói a ordem LRU do disco pelo mtime (atualizado a cada acerto)
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                self._remove_file(path)
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._disk_index[name] = size
+            self._disk_size += size
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            on_disk = key in self._disk_index
+
+        if on_disk:
+            value = self._read_disk(key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    if key in self._disk_index:
+                        self._disk_index.move_to_end(key)
+                    self._store_memory(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._store_memory(key, value)
+        if self.directory:
+            self._write_disk(key, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_size,
+            }
+
+    def _store_memory(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _read_disk(self, key: str) -> bytes | None:
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except OSError:
+            with self._lock:
+                size = self._disk_index.pop(key, None)
+                if size is not None:
+                    self._disk_size -= size
+            return None
+
+    def _write_disk(self, key: str, value: bytes) -> None:
+        if len(value) > self.disk_max_bytes:
+            return
+        path = os.path.join(self.directory, key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove_file(tmp_path)
+            return
+
+        evicted = []
+        with self._lock:
+            old = self._disk_index.pop(key, None)
+            if old is not None:
+                self._disk_size -= old
+            self._disk_index[key] = len(value)
+            self._disk_size += len(value)
+            while self._disk_size > self.disk_max_bytes:
+                name, size = self._disk_index.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(name)
+        for name in evicted:
+            self._remove_file(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_result_cache = _ByteLRUCache(
+    CACHE_MAX_BYTES,
+    os.path.join(CACHE_DIR, "results") if CACHE_DIR else "",
+    CACHE_DISK_MAX_BYTES,
+)
+# Máscaras independem do fundo/formato: trocar o fundo não refaz a inferência
+_mask_cache = _ByteLRUCache(
+    MASK_CACHE_MAX_BYTES,
+    os.path.join(CACHE_DIR, "masks") if CACHE_DIR else "",
+    CACHE_DISK_MAX_BYTES,
+)
+
+
+class _JobStore:
+    """Fila de jobs em SQLite; entradas e resultados ficam em arquivos ao lado"""
+
+    FINISHED = ("done", "failed")
+    ADDED_COLUMNS = (
+        ("background_fit", "TEXT NOT NULL DEFAULT 'stretch'"),
+        ("output_format", "TEXT"),
+        ("output_preset", "TEXT"),
+        ("output_quality", "INTEGER"),
+        ("result_mode", "TEXT NOT NULL DEFAULT 'image'"),
+        ("mask_encoding", "TEXT NOT NULL DEFAULT 'png'"),
+        ("crop_to_bbox", "INTEGER NOT NULL DEFAULT 0"),
+        ("image_size", "TEXT"),
+        ("foreground_bbox", "TEXT"),
+    )
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._files = os.path.join(directory, "files")
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        os.makedirs(self._files, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(self.directory, "jobs.sqlite3"),
+            check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    model TEXT NOT NULL,
+                    remove_background INTEGER NOT NULL,
+                    has_background INTEGER NOT NULL,
+                    background_fit TEXT NOT NULL DEFAULT 'stretch',
+                    output_format TEXT,
+                    output_preset TEXT,
+                    output_quality INTEGER,
+                    result_mode TEXT NOT NULL DEFAULT 'image',
+                    mask_encoding TEXT NOT NULL DEFAULT 'png',
+                    crop_to_bbox INTEGER NOT NULL DEFAULT 0,
+                    image_size TEXT,
+                    foreground_bbox TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    media_type TEXT,
+                    error_status INTEGER,
+                    error TEXT
+                )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            # Filas criadas por versões anteriores ganham as colunas novas
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in self.ADDED_COLUMNS:
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            # Jobs interrompidos por uma queda do serviço voltam para a fila,
+            # a menos que já tenham derrubado o serviço vezes demais
+            now = time.time()
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', updated_at = ?, error_status = 500,"
+                " error = 'Processamento interrompido repetidamente.'"
+                " WHERE status = 'running' AND attempts >= ?",
+                (now, JOB_MAX_ATTEMPTS))
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'",
+                (now,))
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def path(self, job_id: str, kind: str) -> str:
+        return os.path.join(self._files, f"{job_id}.{kind}")
+
+    def create(
+        self,
+        model: str,
+        remove_background: bool,
+        file_bytes: bytes,
+        background_bytes: bytes | None,
+        background_fit: str = DEFAULT_BACKGROUND_FIT,
+        output: tuple[str, str, int | None] | None = None,
+        mask: tuple[str, bool] | None = None,
+    ) -> str:
+        job_id = uuid.uuid4().hex
+        # Arquivos primeiro: um job só entra na fila com as entradas gravadas
+        self._write_file(self.path(job_id, "input"), file_bytes)
+        if background_bytes is not None:
+            self._write_file(self.path(job_id, "background"), background_bytes)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, created_at, updated_at, model,"
+                " remove_background, has_background, background_fit,"
+                " output_format, output_preset, output_quality,"
+                " result_mode, mask_encoding, crop_to_bbox)"
+                " VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, now, now, model, int(remove_background),
+                 int(background_bytes is not None), background_fit,
+                 *(output or (None, None, None)),
+                 # Só a máscara: codificação e recorte aplicados por _finish_mask
+                 "mask" if mask else "image",
+                 mask[0] if mask else "png", int(mask[1]) if mask else 0))
+        return job_id
+
+    def get(self, job_id: str) -> sqlite3.Row | None:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def count_by_status(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def count_queued(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+
+    def claim(self) -> sqlite3.Row | None:
+        # Próximo job da fila (FIFO), marcado como em execução
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued'"
+                " ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ?,"
+                " attempts = attempts + 1 WHERE id = ?", (time.time(), row["id"]))
+            return self._conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+    def complete(
+        self,
+        job_id: str,
+        data: bytes,
+        media_type: str,
+        image_size: str | None = None,
+        foreground_bbox: str | None = None,
+    ) -> None:
+        self._write_file(self.path(job_id, "result"), data)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', updated_at = ?, media_type = ?,"
+                " image_size = ?, foreground_bbox = ? WHERE id = ?",
+                (time.time(), media_type, image_size, foreground_bbox, job_id))
+        self._remove_inputs(job_id)
+
+    def fail(self, job_id: str, status_code: int, detail: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', updated_at = ?, error_status = ?,"
+                " error = ? WHERE id = ?", (time.time(), status_code, detail, job_id))
+        self._remove_inputs(job_id)
 
+    def requeue(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE id = ?",
+                (time.time(), job_id))
 
-app = FastAPI(title="image-background-service", version="1.0.0")
+    def delete(self, job_id: str) -> bool:
+        # Só remove jobs que não estão em execução
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM jobs WHERE id = ? AND status != 'running'",
+                (job_id,)).rowcount
+        if deleted:
+            self._remove_inputs(job_id)
+            _ByteLRUCache._remove_file(self.path(job_id, "result"))
+        return bool(deleted)
+
+    def purge(self, older_than: float) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed')"
+                " AND updated_at < ?", (older_than,)).fetchall()
+            self._conn.executemany(
+                "DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in rows])
+        for row in rows:
+            _ByteLRUCache._remove_file(self.path(row["id"], "result"))
+        return [row["id"] for row in rows]
+
+    def _remove_inputs(self, job_id: str) -> None:
+        for kind in ("input", "background"):
+            _ByteLRUCache._remove_file(self.path(job_id, kind))
+
+    @staticmethod
+    def _write_file(path: str, data: bytes) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+_job_store = _JobStore(JOBS_DIR)
+# Notifica long-polls de /jobs/{id} quando o job termina; o contador diz
+# quantos long-polls ainda esperam cada evento
+_job_events: dict[str, asyncio.Event] = {}
+_job_waiters: Counter[str] = Counter()
+_job_wakeup: asyncio.Event | None = None
+
+
+# Fundos já redimensionados para (tamanho, ajuste): reusar o mesmo fundo em
+# fotos do mesmo tamanho não refaz o LANCZOS
+_background_cache = _ByteLRUCache(BACKGROUND_CACHE_MAX_BYTES)
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def _cache_key(*parts) -> str:
+    raw = "|".join(str(part) for part in parts).encode()
+    return hashlib.blake2b(raw, digest_size=20).hexdigest()
+
+
+def _cache_keys(
+    file_hash: str,
+    remove_background: bool,
+    background_hash: str,
+    model: str,
+    output_format: str,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
+) -> tuple[str, str]:
+    # Ajuste só muda o resultado quando há fundo
+    fit = background_fit if background_hash else ""
+    result_key = _cache_key(
+        "result", file_hash, remove_background, model, background_hash,
+        output_format, fit)
+    mask_key = _cache_key("mask", file_hash, model)
+    return result_key, mask_key
+
+
+def _load_cached_mask(mask_key: str, model: str) -> np.ndarray | None:
+    data = _mask_cache.get(mask_key)
+    if data is None:
+        return None
+    side = MODEL_INPUT_SPECS[model][0]
+    return np.frombuffer(data, dtype=np.uint8).reshape(side, side)
+
+
+async def _start_inference_pool() -> None:
+    await _inference_pool.open()
+    _ready.set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sobe os workers em segundo plano; /health só fica pronto quando todos
+    # tiverem carregado e aquecido os modelos
+    global _executor, _job_wakeup
+    # Executor padrão próprio, para expor fila e threads ocupadas em /metrics
+    _executor = ThreadPoolExecutor(
+        max_workers=EXECUTOR_WORKERS, thread_name_prefix="pipeline")
+    asyncio.get_running_loop().set_default_executor(_executor)
+    startup = asyncio.create_task(_start_inference_pool())
+    # Jobs que estavam na fila (ou em execução) antes de reiniciar são retomados
+    _job_wakeup = asyncio.Event()
+    _job_store.open()
+    job_tasks = [asyncio.create_task(_run_jobs()) for _ in range(JOB_CONCURRENCY)]
+    job_tasks.append(asyncio.create_task(_purge_jobs()))
+    yield
+    startup.cancel()
+    for task in job_tasks:
+        task.cancel()
+    await asyncio.gather(*job_tasks, return_exceptions=True)
+    _job_store.close()
+    await _mask_batcher.close()
+    _inference_pool.close()
+
+
+class _BodySizeLimitMiddleware:
+    """Recusa corpos acima do limite enquanto os bytes chegam, antes do parse do multipart"""
+
+    def __init__(self, app, max_bytes: int, path_limits: dict[str, int] | None = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope.get("path", ""), self.max_bytes)
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() \
+                and int(content_length) > max_bytes:
+            response = JSONResponse(
+                {"detail": "Requisição excede o tamanho máximo."}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(
+                        status_code=413, detail="Requisição excede o tamanho máximo.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class _MetricsMiddleware:
+    """Mede cada requisição por rota e, se ligado, devolve o Server-Timing das etapas"""
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: dict[str, float] = {}
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def timed_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    timings["total"] = time.perf_counter() - start
+                    value = ", ".join(
+                        f"{name};dur={seconds * 1000:.1f}"
+                        for name, seconds in timings.items())
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", value.encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _request_timings.reset(token)
+            # Rota (template) em vez do caminho: /jobs/{job_id} é uma série só
+            route = getattr(scope.get("route"), "path", "other")
+            _request_seconds.observe(
+                time.perf_counter() - start, route=route, status=status_code)
+
+
+app = FastAPI(title="image-background-service",
+              version="1.0.0", lifespan=lifespan)
 
 # CORS (liberado para facilitar integração local)
 app.add_middleware(
@@ -21,105 +1208,763 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Foreground-BBox", "X-Image-Size"],
+)
+app.add_middleware(
+    _BodySizeLimitMiddleware,
+    max_bytes=MAX_REQUEST_BODY_BYTES,
+    path_limits={"/process-images": MAX_BATCH_REQUEST_BYTES,
+                 "/process-sequence": MAX_SEQUENCE_REQUEST_BYTES},
 )
+app.add_middleware(_MetricsMiddleware, server_timing=SERVER_TIMING)
 
 
 @app.get("/health")
 async def health() -> JSONResponse:
-    return JSONResponse({"status": "ok"})
+    workers = _inference_pool.stats()
+    if not _ready.is_set():
+        return JSONResponse(
+            {"status": "loading", "workers": workers}, status_code=503)
+    return JSONResponse({
+        "status": "ok",
+        "models": _inference_pool.models,
+        "workers": workers,
+        "pending_requests": _admission.pending,
+        "live_connections": _live_connections,
+        "cache": {
+            "results": _result_cache.stats(),
+            "masks": _mask_cache.stats(),
+            "backgrounds": _background_cache.stats(),
+        },
+    })
+
+
+def _render_metrics(jobs_by_status: dict[str, int]) -> str:
+    lines = _stage_seconds.render() + _request_seconds.render() + _batch_sizes.render()
+    lines += _encode_seconds.render() + _output_bytes.render()
+    lines += _metric("pending_requests", "gauge",
+                     "Requisições em processamento (controle de admissão).",
+                     [({}, _admission.pending)])
+    lines += _metric("max_pending_requests", "gauge",
+                     "Limite do controle de admissão.", [({}, _admission.limit)])
+    lines += _metric("live_connections", "gauge",
+                     "Conexões abertas do modo ao vivo (WebSocket).",
+                     [({}, _live_connections)])
+    lines += _metric("live_frames_total", "counter",
+                     "Quadros do modo ao vivo processados ou descartados.",
+                     [({"status": status}, count) for status, count in _live_frames.items()])
+    lines += _metric("sequence_frames_total", "counter",
+                     "Quadros de sequências por origem da máscara.",
+                     [({"mask": mask}, count) for mask, count in _sequence_frames.items()])
+    lines += _metric("batcher_queue_depth", "gauge",
+                     "Pedidos de máscara aguardando um lote.",
+                     [({}, _mask_batcher.queued)])
+    lines += _metric("inference_workers_busy", "gauge",
+                     "Processos de inferência ocupados.", [({}, _inference_pool.busy)])
+    workers = _inference_pool.stats()
+    lines += _metric("inference_workers_ready", "gauge",
+                     "Processos de inferência prontos.",
+                     [({}, sum(1 for w in workers if w["ready"]))])
+    lines += _metric("inference_worker_restarts_total", "counter",
+                     "Reinícios de cada processo de inferência.",
+                     [({"worker": w["worker"]}, w["restarts"]) for w in workers])
+    lines += _metric("model_load_seconds", "gauge",
+                     "Tempo de carga e aquecimento dos modelos em cada processo.",
+                     [({"worker": w["worker"]}, w["load_seconds"])
+                      for w in workers if w["load_seconds"] is not None])
+    if _executor is not None:
+        # Tarefas na fila do executor = threads todas ocupadas
+        lines += _metric("executor_queue_depth", "gauge",
+                         "Tarefas aguardando uma thread do executor.",
+                         [({}, _executor._work_queue.qsize())])
+        lines += _metric("executor_threads", "gauge",
+                         "Threads criadas no executor.", [({}, len(_executor._threads))])
+        lines += _metric("executor_max_threads", "gauge",
+                         "Máximo de threads do executor.", [({}, EXECUTOR_WORKERS)])
+    caches = {"results": _result_cache.stats(), "masks": _mask_cache.stats(),
+              "backgrounds": _background_cache.stats()}
+    lines += _metric("cache_hits_total", "counter", "Acertos de cache.", [
+        (labels, stats[key]) for name, stats in caches.items()
+        for labels, key in (({"cache": name, "tier": "memory"}, "hits"),
+                            ({"cache": name, "tier": "disk"}, "disk_hits"))])
+    lines += _metric("cache_misses_total", "counter", "Falhas de cache.",
+                     [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+    lines += _metric("cache_bytes", "gauge", "Bytes ocupados pelo cache.", [
+        (labels, stats[key]) for name, stats in caches.items()
+        for labels, key in (({"cache": name, "tier": "memory"}, "bytes"),
+                            ({"cache": name, "tier": "disk"}, "disk_bytes"))])
+    lines += _metric("jobs", "gauge", "Jobs por status.",
+                     [({"status": status}, count)
+                      for status, count in sorted(jobs_by_status.items())])
+    return "\n".join(lines) + "\n"
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    jobs_by_status = await asyncio.to_thread(_job_store.count_by_status)
+    return Response(
+        _render_metrics(jobs_by_status),
+        media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class _Upload(NamedTuple):
+    data: bytes
+    digest: str
+    # Aberta sobre os bytes completos (cabeçalho lido), ainda não decodificada
+    image: Image.Image
+
+
+class _InvalidImageError(ValueError):
+    pass
 
 
-def _validate_and_read_upload(file: UploadFile, *, required: bool = True) -> bytes:
+def _sniff_image_header(prefix: bytearray) -> Image.Image | None:
+    # Lê só o cabeçalho (formato e dimensões); None = ainda faltam bytes
+    try:
+        im = Image.open(io.BytesIO(prefix))
+    except Image.DecompressionBombError:
+        raise HTTPException(
+            status_code=413, detail="Imagem com dimensões excessivas.")
+    except Exception:
+        return None
+
+    if im.format not in ALLOWED_IMAGE_FORMATS:
+        raise HTTPException(
+            status_code=415, detail="Formato inválido. Aceito: JPG, PNG.")
+    width, height = im.size
+    if width == 0 or height == 0:
+        raise HTTPException(
+            status_code=415, detail="Arquivo não é uma imagem válida.")
+    if width * height > MAX_IMAGE_MEGAPIXELS * 1_000_000:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Imagem excede {MAX_IMAGE_MEGAPIXELS:g} megapixels.")
+    return im
+
+
+def _validate_and_read_upload(file: UploadFile, *, required: bool = True) -> _Upload | None:
     if file is None:
         if required:
             raise HTTPException(
                 status_code=400, detail="Arquivo de imagem é obrigatório.")
-        return b""
+        return None
 
     if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(
             status_code=415, detail="Formato inválido. Aceito: JPG, PNG.")
 
-    # Ler bytes e checar tamanho
-    data = file.file.read()
-    if len(data) == 0:
-        raise HTTPException(status_code=400, detail="Arquivo vazio.")
-    if len(data) > MAX_FILE_SIZE_BYTES:
-        raise HTTPException(status_code=413, detail="Arquivo excede 10MB.")
+    upload = _read_image_stream(file.file)
 
-    # Validar que é uma imagem suportada pelo Pillow
+    # Reset cursor do arquivo (por boa prática, ainda que não usemos novamente)
     try:
-        with Image.open(io.BytesIO(data)) as im:
-            im.verify()  # valida assinatura
+        file.file.seek(0)
     except Exception:
+        pass
+
+    return upload
+
+
+def _read_image_stream(stream) -> _Upload:
+    with _stage("read"):
+        return _read_image_stream_chunks(stream)
+
+
+def _read_image_stream_chunks(stream) -> _Upload:
+    # Ler em blocos: o limite de tamanho e o cabeçalho são checados à medida
+    # que os bytes chegam, e o hash do conteúdo sai de graça na mesma passada
+    data = bytearray()
+    digest = hashlib.blake2b(digest_size=20)
+    header = None
+    sniffed = False
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > MAX_FILE_SIZE_BYTES:
+            raise HTTPException(status_code=413, detail="Arquivo excede 10MB.")
+        data += chunk
+        digest.update(chunk)
+        if not sniffed and len(data) >= HEADER_SNIFF_BYTES:
+            # Uma análise só, sobre o prefixo: sem reprocessar o buffer a
+            # cada bloco quando o cabeçalho não aparece
+            header = _sniff_image_header(data)
+            sniffed = True
+
+    if len(data) == 0:
+        raise HTTPException(status_code=400, detail="Arquivo vazio.")
+    if header is None:
+        # Arquivo menor que o prefixo, ou cabeçalho além dele
+        header = _sniff_image_header(data)
+    if header is None:
         raise HTTPException(
             status_code=415, detail="Arquivo não é uma imagem válida.")
 
-    # Reset cursor do arquivo (por boa prática, ainda que não usemos novamente)
+    data = bytes(data)
+    return _Upload(data, digest.hexdigest(), Image.open(io.BytesIO(data)))
+
+
+def _load_image(image: Image.Image) -> Image.Image:
+    # Decodificação de fato; arquivo truncado/corrompido vira erro de entrada
     try:
-        file.file.seek(0)
-    except Exception:
-        pass
+        image.load()
+    except (OSError, SyntaxError, ValueError) as exc:
+        raise _InvalidImageError(str(exc)) from exc
+    return image
 
-    return data
 
+def _decode_to_rgba_array(image: Image.Image) -> np.ndarray:
+    # Única decodificação da imagem; o restante do pipeline usa o array
+    with _stage("decode"), image:
+        return np.array(_load_image(image).convert("RGBA"))
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    # Pelo cabeçalho: canal alpha ou cor transparente na paleta
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+
+def _original_media_type(image: Image.Image) -> str:
+    # Preferir o formato detectado no cabeçalho; se não, usar PNG
+    fmt = (image.format or "PNG").upper()
+    return "image/png" if fmt == "PNG" else "image/jpeg"
+
+
+def _box_filter(arr: np.ndarray, radius: int) -> np.ndarray:
+    # Média em janela (2r+1)² via somas acumuladas, com bordas replicadas
+    k = 2 * radius + 1
+    padded = np.pad(arr, ((radius + 1, radius), (radius + 1, radius)), mode="edge")
+    acc = padded.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    total = acc[k:, k:] - acc[:-k, k:] - acc[k:, :-k] + acc[:-k, :-k]
+    return (total / (k * k)).astype(np.float32)
+
+
+def _refine_mask_edges(rgba: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # Guided filter em resolução intermediária: a máscara do modelo é
+    # ampliada e ajustada às bordas da própria imagem; só o resultado (uint8)
+    # segue para a ampliação até o tamanho final
+    height, width = rgba.shape[:2]
+    scale = min(1.0, MASK_REFINE_MAX_SIDE / max(height, width))
+    work_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    guide_image = Image.fromarray(rgba).resize(
+        work_size, Image.BILINEAR, reducing_gap=2.0).convert("L")
+    guide = np.asarray(guide_image, dtype=np.float32) / 255
+    p = np.asarray(Image.fromarray(mask).resize(
+        work_size, Image.BILINEAR), dtype=np.float32) / 255
+
+    r = MASK_REFINE_RADIUS
+    mean_i = _box_filter(guide, r)
+    mean_p = _box_filter(p, r)
+    cov_ip = _box_filter(guide * p, r) - mean_i * mean_p
+    var_i = _box_filter(guide * guide, r) - mean_i * mean_i
+    a = cov_ip / (var_i + MASK_REFINE_EPS)
+    b = mean_p - a * mean_i
+    refined = _box_filter(a, r) * guide + _box_filter(b, r)
+    return (np.clip(refined, 0, 1) * 255).astype(np.uint8)
+
+
+def _remove_background_to_rgba(rgba: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    with _stage("alpha"):
+        return _apply_mask_to_alpha(rgba, mask)
+
+
+def _apply_mask_to_alpha(rgba: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # Grava a máscara ampliada direto no canal alpha (sem cópias nem PNG)
+    height, width = rgba.shape[:2]
+    rgba[..., 3] = _full_size_alpha(mask, (width, height), rgba)
+    return rgba
+
+
+def _full_size_alpha(
+    mask: np.ndarray, size: tuple[int, int], rgba: np.ndarray | None = None,
+) -> np.ndarray:
+    # Máscara vem no tamanho da entrada do modelo; ampliar para a imagem
+    # original. Sem os pixels (modo máscara de imagem sem alpha) não há
+    # refinamento nem transparência prévia a respeitar
+    if MASK_EDGE_REFINEMENT and rgba is not None:
+        mask = _refine_mask_edges(rgba, mask)
+    alpha = np.asarray(Image.fromarray(mask).resize(size, Image.LANCZOS))
+    if rgba is not None:
+        channel = rgba[..., 3]
+        if channel.min() < 255:
+            # Preserva transparência que já existia na imagem enviada
+            alpha = (channel.astype(np.uint16) * alpha // 255).astype(np.uint8)
+    return alpha
+
+
+def _foreground_bbox(alpha: np.ndarray) -> tuple[int, int, int, int] | None:
+    # Caixa justa (x, y, largura, altura) do primeiro plano; None se vazio
+    foreground = alpha > MASK_BBOX_THRESHOLD
+    rows = np.flatnonzero(foreground.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(foreground.any(axis=0))
+    return (int(cols[0]), int(rows[0]),
+            int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+
+def _run_lengths(alpha: np.ndarray) -> list[int]:
+    # RLE da máscara binarizada em ordem de linhas, alternando fundo e
+    # primeiro plano; a primeira sequência é sempre de fundo (pode ser 0)
+    flat = (alpha >= MASK_RLE_THRESHOLD).ravel()
+    if flat.size == 0:
+        return []
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+
+def _fit_background(background_image: Image.Image, size: tuple[int, int], fit: str) -> np.ndarray:
+    # Fundo no tamanho exato da foto (RGB, HxWx3):
+    #   stretch: distorce para o tamanho da foto
+    #   cover:   preenche tudo, cortando o excesso centralizado
+    #   contain: cabe inteiro, com faixas brancas nas sobras
+    width, height = size
+    bg = background_image if background_image.mode == "RGB" else background_image.convert("RGB")
+    if fit == "stretch":
+        return np.asarray(bg.resize(size, Image.LANCZOS, reducing_gap=3.0))
+
+    bg_width, bg_height = bg.size
+    if fit == "cover":
+        # Recorta no próprio resize (box), sem redimensionar o excesso
+        scale = max(width / bg_width, height / bg_height)
+        crop_w, crop_h = width / scale, height / scale
+        left, top = (bg_width - crop_w) / 2, (bg_height - crop_h) / 2
+        return np.asarray(bg.resize(
+            size, Image.LANCZOS, box=(left, top, left + crop_w, top + crop_h),
+            reducing_gap=3.0))
+
+    scale = min(width / bg_width, height / bg_height)
+    inner = (max(1, round(bg_width * scale)), max(1, round(bg_height * scale)))
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    left, top = (width - inner[0]) // 2, (height - inner[1]) // 2
+    canvas[top:top + inner[1], left:left + inner[0]] = np.asarray(
+        bg.resize(inner, Image.LANCZOS, reducing_gap=3.0))
+    return canvas
+
+
+def _prepare_background(
+    background_image: Image.Image,
+    size: tuple[int, int],
+    fit: str,
+    background_digest: str | None = None,
+) -> np.ndarray:
+    if background_digest is None:
+        return _fit_background(background_image, size, fit)
+    key = _cache_key("background", background_digest, fit, *size)
+    cached = _background_cache.get(key)
+    if cached is not None:
+        return np.frombuffer(cached, dtype=np.uint8).reshape(size[1], size[0], 3)
+    fitted = _fit_background(background_image, size, fit)
+    _background_cache.put(key, fitted.tobytes())
+    return fitted
+
+
+class _BlendBuffers:
+    """Buffers do _blend_over guardados entre quadros do mesmo tamanho (modo ao vivo)"""
+
+    def __init__(self):
+        self._key: tuple[int, int] | None = None
+        self._buffers: tuple[np.ndarray, ...] = ()
+
+    def get(self, height: int, width: int) -> tuple[np.ndarray, ...]:
+        if self._key != (height, width):
+            self._buffers = _allocate_blend_buffers(height, width)
+            self._key = (height, width)
+        return self._buffers
+
+
+class _BlendScratch(threading.local):
+    """Faixas uint16 do _blend_over por thread, reaproveitadas entre requisições"""
+
+    def __init__(self):
+        self._storage = np.empty(0, dtype=np.uint16)
+
+    def get(self, rows: int, width: int) -> tuple[np.ndarray, ...]:
+        # Um bloco só, que cresce até a maior largura vista; as faixas são
+        # vistas sobre ele (a saída, do tamanho do quadro, não fica retida)
+        band = rows * width * 3
+        needed = 2 * band + rows * width
+        if self._storage.size < needed:
+            self._storage = np.empty(needed, dtype=np.uint16)
+        return (self._storage[:band].reshape(rows, width, 3),
+                self._storage[band:2 * band].reshape(rows, width, 3),
+                self._storage[2 * band:needed].reshape(rows, width, 1))
+
+
+_blend_scratch = _BlendScratch()
+
+
+def _allocate_blend_buffers(height: int, width: int) -> tuple[np.ndarray, ...]:
+    rows = min(BLEND_CHUNK_ROWS, height)
+    return (np.empty((height, width, 3), dtype=np.uint8),
+            np.empty((rows, width, 3), dtype=np.uint16),
+            np.empty((rows, width, 3), dtype=np.uint16),
+            np.empty((rows, width, 1), dtype=np.uint16))
+
+
+def _blend_over(
+    rgba: np.ndarray, background: np.ndarray, buffers: _BlendBuffers | None = None,
+) -> np.ndarray:
+    # out = (fg * a + bg * (255 - a)) / 255 em uma passada, por faixas de
+    # linhas: os buffers uint16 de trabalho têm o tamanho de uma faixa e são
+    # reaproveitados, e só o resultado final ocupa o quadro inteiro
+    height, width = rgba.shape[:2]
+    if buffers is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+        acc, scratch, inverse = _blend_scratch.get(min(BLEND_CHUNK_ROWS, height), width)
+    else:
+        out, acc, scratch, inverse = buffers.get(height, width)
+    rows = acc.shape[0]
+    for top in range(0, height, rows):
+        n = min(rows, height - top)
+        alpha = rgba[top:top + n, :, 3:]
+        np.multiply(rgba[top:top + n, :, :3], alpha, out=acc[:n], dtype=np.uint16)
+        np.subtract(255, alpha, out=inverse[:n], dtype=np.uint16)
+        np.multiply(background[top:top + n], inverse[:n], out=scratch[:n], dtype=np.uint16)
+        # Soma máxima 255 * 255: cabe em uint16; +127 arredonda a divisão
+        acc[:n] += scratch[:n]
+        acc[:n] += 127
+        acc[:n] //= 255
+        out[top:top + n] = acc[:n]
+    return out
+
+
+def _composite_on_background(
+    rgba: np.ndarray,
+    background_image: Image.Image,
+    fit: str = DEFAULT_BACKGROUND_FIT,
+    background_digest: str | None = None,
+) -> np.ndarray:
+    # Fundo ajustado ao tamanho da foto (do cache, se repetido) e mistura
+    # pelo canal alpha do recorte
+    height, width = rgba.shape[:2]
+    background = _prepare_background(
+        background_image, (width, height), fit, background_digest)
+    return _composite_on_fitted(rgba, background)
+
+
+def _composite_on_fitted(
+    rgba: np.ndarray, background: np.ndarray, buffers: _BlendBuffers | None = None,
+) -> np.ndarray:
+    # Fundo já no tamanho da foto; sem nenhuma transparência não há mistura
+    alpha = rgba[..., 3]
+    if alpha.min() == 255:
+        return np.ascontiguousarray(rgba[..., :3])
+    return _blend_over(rgba, background, buffers)
 
-def _remove_background_to_rgba(pil_image: Image.Image) -> Image.Image:
-    # rembg.remove trabalha melhor com bytes em muitos casos
-    with io.BytesIO() as buf_in:
-        pil_image.save(buf_in, format="PNG")
-        input_bytes = buf_in.getvalue()
-    output_bytes = remove(input_bytes)
-    result = Image.open(io.BytesIO(output_bytes)).convert("RGBA")
-    return result
 
+class _OutputSpec(NamedTuple):
+    format: str
+    preset: str = DEFAULT_OUTPUT_PRESET
+    quality: int | None = None
 
-def _composite_on_background(foreground_rgba: Image.Image, background_image: Image.Image) -> Image.Image:
-    # Redimensionar background para o tamanho do foreground
-    bg = background_image.convert("RGB")
-    bg = bg.resize(foreground_rgba.size, Image.LANCZOS)
-    # Compor (usa o canal alpha do foreground)
-    composed = Image.new("RGB", foreground_rgba.size, (255, 255, 255))
-    composed.paste(bg, (0, 0))
-    composed.paste(foreground_rgba, (0, 0), mask=foreground_rgba.split()[-1])
-    return composed
+    @property
+    def key(self) -> str:
+        # Entra na chave do cache: mesma imagem em outro formato é outro resultado
+        return f"{self.format}:{self.preset}:{self.quality or ''}"
+
+    @property
+    def media_type(self) -> str:
+        return OUTPUT_MEDIA_TYPES[self.format]
+
+
+def _legacy_output_format(background: object | None) -> str:
+    # Composição sobre fundo sai em JPG; recorte transparente em PNG
+    return "jpeg" if background else "png"
+
+
+def _validate_output_options(output_format: str, output_preset: str, quality: int | None) -> None:
+    if output_format != "auto" and output_format not in AVAILABLE_OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato de saída inválido. Aceito: auto, {', '.join(AVAILABLE_OUTPUT_FORMATS)}.")
+    if output_preset not in OUTPUT_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Preset inválido. Aceito: {', '.join(OUTPUT_PRESETS)}.")
+    if quality is not None and not 1 <= quality <= 100:
+        raise HTTPException(
+            status_code=400, detail="Qualidade deve estar entre 1 e 100.")
+
+
+class _ProcessingOptions(NamedTuple):
+    model: str
+    background_fit: str
+    output_format: str
+    output_preset: str
+    quality: int | None
+    result: str
+    mask_encoding: str
+
+
+def _parse_processing_options(
+    model: str = DEFAULT_MODEL,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
+    output_format: str = "auto",
+    output_preset: str = DEFAULT_OUTPUT_PRESET,
+    quality: int | str | None = None,
+    result: str = "image",
+    mask_encoding: str = "png",
+) -> _ProcessingOptions:
+    # Validação única de todas as entradas (HTTP, jobs e modo ao vivo): os
+    # mesmos erros, na mesma ordem. A qualidade pode chegar como texto
+    if quality == "":
+        quality = None
+    elif quality is not None:
+        try:
+            quality = int(quality)
+        except (TypeError, ValueError):
+            raise HTTPException(
+                status_code=400, detail="Qualidade deve estar entre 1 e 100.")
+    if model not in REMBG_MODELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modelo inválido. Aceito: {', '.join(REMBG_MODELS)}.")
+    if background_fit not in BACKGROUND_FIT_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ajuste de fundo inválido. Aceito: {', '.join(BACKGROUND_FIT_MODES)}.")
+    _validate_output_options(output_format, output_preset, quality)
+    if result not in RESULT_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Resultado inválido. Aceito: {', '.join(RESULT_MODES)}.")
+    if mask_encoding not in MASK_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Codificação de máscara inválida. Aceito: {', '.join(MASK_ENCODINGS)}.")
+    return _ProcessingOptions(
+        model, background_fit, output_format, output_preset, quality,
+        result, mask_encoding)
+
+
+def _parse_accept(accept: str) -> dict[str, float]:
+    preferences = {}
+    for part in accept.split(","):
+        media_type, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        preferences[media_type.strip().lower()] = q
+    return preferences
+
+
+def _negotiate_output(
+    accept: str | None,
+    output_format: str,
+    output_preset: str,
+    quality: int | None,
+    background: object | None,
+) -> _OutputSpec:
+    if output_format != "auto":
+        return _OutputSpec(output_format, output_preset, quality)
+    # Só formatos citados explicitamente no Accept mudam a saída; */* e
+    # image/* mantêm PNG/JPG. Empate no q: WebP, AVIF e depois o padrão
+    legacy = _legacy_output_format(background)
+    preferences = _parse_accept(accept or "")
+    candidates = ["webp", "avif", legacy] + [
+        fmt for fmt in OUTPUT_MEDIA_TYPES if fmt not in ("webp", "avif", legacy)]
+    chosen, best = legacy, 0.0
+    for fmt in candidates:
+        q = preferences.get(OUTPUT_MEDIA_TYPES[fmt], 0.0)
+        if fmt in AVAILABLE_OUTPUT_FORMATS and q > best:
+            chosen, best = fmt, q
+    return _OutputSpec(chosen, output_preset, quality)
+
+
+def _encode_image(pixels: np.ndarray, output: _OutputSpec) -> bytes:
+    fmt = output.format
+    if fmt == "jpeg" and pixels.shape[2] == 4:
+        # JPEG não tem alpha: recorte achatado sobre branco
+        white = np.broadcast_to(np.uint8(255), pixels.shape[:2] + (3,))
+        pixels = _blend_over(pixels, white)
+    params = dict(ENCODER_PRESETS[fmt][output.preset])
+    if fmt in OUTPUT_QUALITY:
+        params["quality"] = output.quality or OUTPUT_QUALITY[fmt]
+    elif fmt == "png" and PNG_COMPRESS_LEVEL:
+        params["compress_level"] = int(PNG_COMPRESS_LEVEL)
+
+    start = time.perf_counter()
+    with _stage("encode"), io.BytesIO() as out:
+        Image.fromarray(pixels).save(out, format=fmt.upper(), **params)
+        data = out.getvalue()
+    _encode_seconds.observe(time.perf_counter() - start, format=fmt)
+    _output_bytes.observe(len(data), format=fmt)
+    return data
 
 
 def _process_image_sync(
     file_bytes: bytes,
     remove_background: bool,
     background_bytes: bytes | None,
+    model: str = DEFAULT_MODEL,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
+    output: _OutputSpec | None = None,
 ) -> tuple[bytes, str]:
     # Abrir imagem principal
     original = Image.open(io.BytesIO(file_bytes))
 
     if not remove_background:
         # Retornar original (mesmo formato de entrada quando possível)
-        # Preferir o content-type pelo cabeçalho; se não, usar PNG
-        fmt = (original.format or "PNG").upper()
-        media = "image/png" if fmt == "PNG" else "image/jpeg"
-        return (file_bytes, media)
+        return (file_bytes, _original_media_type(original))
 
-    # Remover fundo
-    fg_rgba = _remove_background_to_rgba(original.convert("RGBA"))
+    # Remover fundo (inferência direta, sem passar pelo agrupador)
+    if original.format == "JPEG":
+        model_input = _prepare_model_input_from_bytes(file_bytes, model)
+        rgba = _decode_to_rgba_array(original)
+    else:
+        rgba = _decode_to_rgba_array(original)
+        model_input = _prepare_model_input(rgba, model)
+    mask = _predict_masks_batch(model, model_input[np.newaxis])[0]
+    if not background_bytes:
+        return _finish_processing(rgba, mask, None, output=output)
+    return _finish_processing(
+        rgba, mask, Image.open(io.BytesIO(background_bytes)),
+        background_fit, _content_hash(background_bytes), output)
 
-    # Se background fornecido, compor e retornar JPG
-    if background_bytes:
-        bg_img = Image.open(io.BytesIO(background_bytes))
-        composed = _composite_on_background(fg_rgba, bg_img)
-        with io.BytesIO() as out:
-            composed.save(out, format="JPEG", quality=95, subsampling=0)
-            return (out.getvalue(), "image/jpeg")
 
-    # Caso contrário, retornar PNG com transparência
-    with io.BytesIO() as out:
-        fg_rgba.save(out, format="PNG")
-        return (out.getvalue(), "image/png")
+def _finish_processing(
+    rgba: np.ndarray,
+    mask: np.ndarray,
+    background: Image.Image | None,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
+    background_digest: str | None = None,
+    output: _OutputSpec | None = None,
+) -> tuple[bytes, str]:
+    # Alpha aplicado no próprio array; a única codificação acontece abaixo
+    pixels = _remove_background_to_rgba(rgba, mask)
+    if output is None:
+        output = _OutputSpec(_legacy_output_format(background))
 
+    # Se background fornecido, compor (sem alpha); senão recorte transparente
+    if background is not None:
+        with _stage("composite"):
+            pixels = _composite_on_background(
+                pixels, _load_image(background), background_fit, background_digest)
+    return (_encode_image(pixels, output), output.media_type)
 
-async def _process_with_timeout(*args, **kwargs):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _process_image_sync, *args, **kwargs)
+
+async def _predict_mask(
+    upload: _Upload, model: str, mask_key: str, decode: bool = True,
+) -> tuple[np.ndarray, np.ndarray | None]:
+    # Decodificação e pós-processamento no executor padrão (to_thread leva
+    # junto os tempos da requisição para o Server-Timing); a inferência
+    # passa pelo agrupador para dividir uma única execução do onnxruntime.
+    # Com decode=False um JPEG nunca é decodificado por inteiro (rgba = None)
+    mask = await asyncio.to_thread(_load_cached_mask, mask_key, model)
+    rgba = None
+    if mask is None and upload.image.format == "JPEG":
+        # Entrada do modelo sai de uma decodificação reduzida; a decodificação
+        # completa (só necessária para a saída) roda junto com a inferência
+        model_input = await asyncio.to_thread(
+            _prepare_model_input_from_bytes, upload.data, model)
+        if decode:
+            mask, rgba = await asyncio.gather(
+                _mask_batcher.predict(model, model_input),
+                asyncio.to_thread(_decode_to_rgba_array, upload.image),
+            )
+        else:
+            mask = await _mask_batcher.predict(model, model_input)
+        await asyncio.to_thread(_mask_cache.put, mask_key, mask.tobytes())
+    elif decode or mask is None:
+        rgba = await asyncio.to_thread(_decode_to_rgba_array, upload.image)
+        if mask is None:
+            model_input = await asyncio.to_thread(
+                _prepare_model_input, rgba, model)
+            mask = await _mask_batcher.predict(model, model_input)
+            await asyncio.to_thread(
+                _mask_cache.put, mask_key, mask.tobytes())
+    return mask, rgba
+
+
+async def _process_with_timeout(
+    upload: _Upload,
+    remove_background: bool,
+    background: _Upload | None,
+    model: str = DEFAULT_MODEL,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
+    output: _OutputSpec | None = None,
+) -> tuple[bytes, str]:
+    if not remove_background:
+        return (upload.data, _original_media_type(upload.image))
+
+    # Mesmo upload + mesmos parâmetros = mesmo resultado
+    if output is None:
+        output = _OutputSpec(_legacy_output_format(background))
+    result_key, mask_key = _cache_keys(
+        upload.digest, True, background.digest if background else "",
+        model, output.key, background_fit)
+    cached = await asyncio.to_thread(_result_cache.get, result_key)
+    if cached is not None:
+        return (cached, output.media_type)
+
+    mask, rgba = await _predict_mask(upload, model, mask_key)
+    if background is None:
+        result = await asyncio.to_thread(
+            _finish_processing, rgba, mask, None, output=output)
+    else:
+        result = await asyncio.to_thread(
+            _finish_processing, rgba, mask, background.image,
+            background_fit, background.digest, output)
+    await asyncio.to_thread(_result_cache.put, result_key, result[0])
+    return result
+
+
+def _finish_mask(
+    mask: np.ndarray,
+    size: tuple[int, int],
+    rgba: np.ndarray | None,
+    encoding: str = "png",
+    crop: bool = False,
+    preset: str = DEFAULT_OUTPUT_PRESET,
+) -> tuple[bytes, str, tuple[int, int, int, int] | None]:
+    # Só o canal alpha: sem composição nem codificação em cores
+    with _stage("alpha"):
+        alpha = _full_size_alpha(mask, size, rgba)
+        bbox = _foreground_bbox(alpha)
+    if crop:
+        x, y, w, h = bbox or (0, 0, 0, 0)
+        alpha = alpha[y:y + h, x:x + w]
+    if encoding == "rle":
+        with _stage("encode"):
+            data = json.dumps({
+                "width": int(alpha.shape[1]),
+                "height": int(alpha.shape[0]),
+                "bbox": list(bbox) if bbox else None,
+                "threshold": MASK_RLE_THRESHOLD,
+                "counts": _run_lengths(alpha),
+            }, separators=(",", ":")).encode()
+        return (data, "application/json", bbox)
+    if alpha.size == 0:
+        # Máscara vazia recortada: PNG não aceita 0x0
+        alpha = np.zeros((1, 1), dtype=np.uint8)
+    # Tons de cinza (modo L): 1 canal em vez de 4
+    return (_encode_image(alpha, _OutputSpec("png", preset)), "image/png", bbox)
+
+
+async def _process_mask_with_timeout(
+    upload: _Upload,
+    model: str = DEFAULT_MODEL,
+    encoding: str = "png",
+    crop: bool = False,
+    preset: str = DEFAULT_OUTPUT_PRESET,
+) -> tuple[bytes, str, tuple[int, int, int, int] | None]:
+    # Mesmo caminho da remoção de fundo até a máscara (inclusive o cache);
+    # os pixels só são decodificados quando o refinamento de bordas ou a
+    # transparência da própria imagem entram na máscara, com ou sem cache
+    _, mask_key = _cache_keys(upload.digest, True, "", model, "")
+    mask, rgba = await _predict_mask(
+        upload, model, mask_key,
+        decode=MASK_EDGE_REFINEMENT or _has_alpha(upload.image))
+    return await asyncio.to_thread(
+        _finish_mask, mask, upload.image.size, rgba, encoding, crop, preset)
 
 
 @app.post("/process-image")
@@ -127,30 +1972,1221 @@ async def process_image(
     file: UploadFile = File(...),
     remove_background: bool = Form(False),
     background: UploadFile | None = File(None),
+    model: str = Form(DEFAULT_MODEL),
+    background_fit: str = Form(DEFAULT_BACKGROUND_FIT),
+    output_format: str = Form("auto"),
+    output_preset: str = Form(DEFAULT_OUTPUT_PRESET),
+    quality: int | None = Form(None),
+    result: str = Form("image"),
+    mask_encoding: str = Form("png"),
+    crop_to_bbox: bool = Form(False),
+    accept: str | None = Header(None),
 ):
-    file_bytes = _validate_and_read_upload(file, required=True)
-    background_bytes = None
-    if background is not None:
-        if background.filename:
-            background_bytes = _validate_and_read_upload(
-                background, required=False)
+    _parse_processing_options(
+        model, background_fit, output_format, output_preset, quality,
+        result, mask_encoding)
+    mask_only = result == "mask"
 
+    if (remove_background or mask_only) and not _ready.is_set():
+        raise _service_unavailable("Modelos ainda carregando. Tente novamente.")
+    # Fila limitada: acima do limite é melhor recusar rápido do que acumular
+    if not _admission.try_acquire():
+        raise _service_unavailable("Serviço sobrecarregado. Tente novamente.")
     try:
-        processed_bytes, media_type = await asyncio.wait_for(
+        upload = await asyncio.to_thread(
+            _validate_and_read_upload, file, required=True)
+        background_upload = None
+        if background is not None:
+            if background.filename:
+                background_upload = await asyncio.to_thread(
+                    _validate_and_read_upload, background, required=False)
+        output = _negotiate_output(
+            accept, output_format, output_preset, quality, background_upload)
+
+        try:
+            if mask_only:
+                processed_bytes, media_type, bbox = await asyncio.wait_for(
+                    _process_mask_with_timeout(
+                        upload, model, mask_encoding, crop_to_bbox, output_preset),
+                    timeout=PROCESS_TIMEOUT_SECONDS,
+                )
+            else:
+                processed_bytes, media_type = await asyncio.wait_for(
+                    _process_with_timeout(
+                        upload, remove_background, background_upload, model,
+                        background_fit, output),
+                    timeout=PROCESS_TIMEOUT_SECONDS,
+                )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504, detail="Tempo de processamento excedido.")
+        except _InvalidImageError:
+            raise HTTPException(
+                status_code=415, detail="Arquivo não é uma imagem válida.")
+        except HTTPException:
+            raise
+        except Exception:
+            raise HTTPException(
+                status_code=500, detail="Falha ao processar a imagem.")
+
+        if mask_only:
+            # Caixa do primeiro plano em coordenadas da imagem original
+            width, height = upload.image.size
+            headers = {
+                "X-Foreground-BBox": ",".join(map(str, bbox)) if bbox else "",
+                "X-Image-Size": f"{width},{height}",
+            }
+            return Response(content=processed_bytes, media_type=media_type, headers=headers)
+
+        # Saída negociada pelo Accept: caches intermediários precisam saber
+        headers = {"Vary": "Accept"} if output_format == "auto" else None
+        return Response(content=processed_bytes, media_type=media_type, headers=headers)
+    finally:
+        _admission.release()
+
+
+async def _process_item(
+    upload: _Upload,
+    remove_background: bool,
+    background: _Upload | None,
+    model: str,
+    timeout: float,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
+    output: _OutputSpec | None = None,
+) -> tuple[int, bytes | None, str | None, str | None]:
+    # Igual a _process_with_timeout, mas devolve o erro em vez de levantá-lo:
+    # (status, dados, media type, detalhe do erro)
+    try:
+        data, media_type = await asyncio.wait_for(
             _process_with_timeout(
-                file_bytes, remove_background, background_bytes),
-            timeout=PROCESS_TIMEOUT_SECONDS,
+                upload, remove_background, background, model, background_fit, output),
+            timeout=timeout,
         )
+        return 200, data, media_type, None
     except asyncio.TimeoutError:
+        return 504, None, None, "Tempo de processamento excedido."
+    except _InvalidImageError:
+        return 415, None, None, "Arquivo não é uma imagem válida."
+    except HTTPException as exc:
+        return exc.status_code, None, None, exc.detail
+    except Exception:
+        return 500, None, None, "Falha ao processar a imagem."
+
+
+async def _process_mask_item(
+    upload: _Upload,
+    model: str,
+    timeout: float,
+    encoding: str = "png",
+    crop: bool = False,
+    preset: str = DEFAULT_OUTPUT_PRESET,
+) -> tuple[int, bytes | None, str | None, str | None, tuple[int, int, int, int] | None]:
+    # Versão de _process_item para result=mask; também devolve a caixa
+    try:
+        data, media_type, bbox = await asyncio.wait_for(
+            _process_mask_with_timeout(upload, model, encoding, crop, preset),
+            timeout=timeout,
+        )
+        return 200, data, media_type, None, bbox
+    except asyncio.TimeoutError:
+        return 504, None, None, "Tempo de processamento excedido.", None
+    except _InvalidImageError:
+        return 415, None, None, "Arquivo não é uma imagem válida.", None
+    except HTTPException as exc:
+        return exc.status_code, None, None, exc.detail, None
+    except Exception:
+        return 500, None, None, "Falha ao processar a imagem.", None
+
+
+def _detach_upload_file(upload: UploadFile):
+    # O FastAPI fecha os arquivos do formulário ao sair do endpoint, antes do
+    # corpo em streaming ser gerado: o arquivo temporário passa a ser nosso
+    spooled = upload.file
+    upload.file = io.BytesIO()
+    return spooled
+
+
+class _BatchItem(NamedTuple):
+    index: int
+    name: str
+    content_type: str | None
+    stream: object
+
+
+def _iter_zip_items(archive, start_index: int):
+    with zipfile.ZipFile(archive) as zf:
+        index = start_index
+        for info in zf.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") \
+                    or not name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                continue
+            if info.file_size > MAX_FILE_SIZE_BYTES:
+                yield _BatchItem(index, name, None, None)
+            else:
+                with zf.open(info) as entry:
+                    yield _BatchItem(index, name, None, entry)
+            index += 1
+
+
+def _count_zip_items(archive) -> int:
+    with zipfile.ZipFile(archive) as zf:
+        return sum(
+            1 for info in zf.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+            and info.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)
+        )
+
+
+def _read_batch_item(item: _BatchItem) -> _Upload:
+    if item.stream is None:
+        raise HTTPException(status_code=413, detail="Arquivo excede 10MB.")
+    if item.content_type is not None and item.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(
-            status_code=504, detail="Tempo de processamento excedido.")
-    except HTTPException:
-        raise
+            status_code=415, detail="Formato inválido. Aceito: JPG, PNG.")
+    return _read_image_stream(item.stream)
+
+
+def _result_filename(name: str, media_type: str | None, used: set[str]) -> str:
+    stem = os.path.splitext(os.path.basename(name))[0] or "imagem"
+    ext = next((OUTPUT_EXTENSIONS[fmt] for fmt, mt in OUTPUT_MEDIA_TYPES.items()
+                if mt == media_type), ".json")
+    candidate = f"{stem}{ext}"
+    counter = 1
+    while candidate in used:
+        candidate = f"{stem}-{counter}{ext}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+async def _iter_batch_results(
+    items, remove_background, background, model, background_fit, output,
+):
+    # Processa com concorrência limitada (o agrupador junta as inferências em
+    # lotes) e devolve cada item assim que fica pronto, na ordem de conclusão
+    loop = asyncio.get_running_loop()
+
+    async def run(item: _BatchItem, upload: _Upload):
+        return (item, *await _process_item(
+            upload, remove_background, background, model, PROCESS_TIMEOUT_SECONDS,
+            background_fit, output))
+
+    iterator = iter(items)
+    pending: set[asyncio.Task] = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < BATCH_ENDPOINT_CONCURRENCY:
+                # Itens são lidos em sequência (o zip não é lido em paralelo)
+                item = await loop.run_in_executor(None, next, iterator, None)
+                if item is None:
+                    exhausted = True
+                    break
+                try:
+                    upload = await loop.run_in_executor(None, _read_batch_item, item)
+                except HTTPException as exc:
+                    yield item, exc.status_code, None, None, exc.detail
+                    continue
+                pending.add(asyncio.create_task(run(item, upload)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Destino não-seekable do zip; os bytes escritos são drenados a cada entrada"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _stream_zip(results):
+    buffer = _StreamBuffer()
+    manifest = []
+    used: set[str] = set()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        async for item, status, data, media_type, detail in results:
+            entry = {"index": item.index, "filename": item.name, "status": status}
+            if data is not None:
+                entry["output"] = _result_filename(item.name, media_type, used)
+                zf.writestr(entry["output"], data)
+            else:
+                entry["detail"] = detail
+            manifest.append(entry)
+            yield buffer.drain()
+        zf.writestr("manifest.json", json.dumps(
+            sorted(manifest, key=lambda e: e["index"]), ensure_ascii=False, indent=2))
+    yield buffer.drain()
+
+
+async def _stream_multipart(results, boundary: str):
+    used: set[str] = set()
+    async for item, status, data, media_type, detail in results:
+        if data is None:
+            media_type = "application/json"
+            data = json.dumps({"filename": item.name, "status": status,
+                               "detail": detail}, ensure_ascii=False).encode()
+        filename = _result_filename(item.name, media_type, used)
+        headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f'Content-Disposition: attachment; filename="{filename}"\r\n'
+            f"X-Item-Index: {item.index}\r\n"
+            f"X-Item-Status: {status}\r\n\r\n"
+        )
+        yield headers.encode() + data + b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+@app.post("/process-images")
+async def process_images(
+    files: list[UploadFile] | None = File(None),
+    archive: UploadFile | None = File(None),
+    remove_background: bool = Form(False),
+    background: UploadFile | None = File(None),
+    model: str = Form(DEFAULT_MODEL),
+    background_fit: str = Form(DEFAULT_BACKGROUND_FIT),
+    output_format: str = Form("auto"),
+    output_preset: str = Form(DEFAULT_OUTPUT_PRESET),
+    quality: int | None = Form(None),
+    output: str = Form("zip"),
+):
+    _parse_processing_options(
+        model, background_fit, output_format, output_preset, quality)
+    if output not in ("zip", "multipart"):
+        raise HTTPException(
+            status_code=400, detail="Saída inválida. Aceito: zip, multipart.")
+    if remove_background and not _ready.is_set():
+        raise _service_unavailable("Modelos ainda carregando. Tente novamente.")
+
+    files = [f for f in files or [] if f.filename]
+    archive_file = None
+    archive_count = 0
+    if archive is not None and archive.filename:
+        archive_file = _detach_upload_file(archive)
+        if not zipfile.is_zipfile(archive_file):
+            archive_file.close()
+            raise HTTPException(status_code=415, detail="Arquivo zip inválido.")
+        archive_count = _count_zip_items(archive_file)
+    total = len(files) + archive_count
+    if total == 0:
+        raise HTTPException(
+            status_code=400, detail="Nenhuma imagem enviada (files ou archive).")
+    if total > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=413, detail=f"Lote excede {MAX_BATCH_ITEMS} imagens.")
+
+    # Um único fundo compartilhado por todas as imagens: decodificado uma vez
+    loop = asyncio.get_running_loop()
+    background_upload = None
+    if background is not None and background.filename:
+        background_upload = await loop.run_in_executor(
+            None, partial(_validate_and_read_upload, background, required=False))
+        try:
+            await loop.run_in_executor(None, _load_image, background_upload.image)
+        except _InvalidImageError:
+            raise HTTPException(
+                status_code=415, detail="Arquivo não é uma imagem válida.")
+
+    # Sem negociação pelo Accept aqui: ele descreve o zip/multipart
+    item_output = _negotiate_output(
+        None, output_format, output_preset, quality, background_upload)
+
+    if not _admission.try_acquire():
+        raise _service_unavailable("Serviço sobrecarregado. Tente novamente.")
+
+    detached = [(f.filename, f.content_type, _detach_upload_file(f)) for f in files]
+
+    def iter_items():
+        for index, (name, content_type, stream) in enumerate(detached):
+            with stream:
+                yield _BatchItem(index, name, content_type, stream)
+        if archive_file is not None:
+            with archive_file:
+                yield from _iter_zip_items(archive_file, len(detached))
+
+    async def body():
+        items = iter_items()
+        try:
+            results = _iter_batch_results(
+                items, remove_background, background_upload, model,
+                background_fit, item_output)
+            if output == "zip":
+                async for chunk in _stream_zip(results):
+                    yield chunk
+            else:
+                async for chunk in _stream_multipart(results, boundary):
+                    yield chunk
+        finally:
+            items.close()
+            _admission.release()
+
+    boundary = uuid.uuid4().hex
+    if output == "zip":
+        return StreamingResponse(
+            body(), media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="resultados.zip"'})
+    return StreamingResponse(
+        body(), media_type=f"multipart/mixed; boundary={boundary}")
+
+
+class _Frame(NamedTuple):
+    index: int
+    name: str
+    # None quando o quadro não pôde ser lido (status/detail dizem o motivo)
+    pixels: np.ndarray | None
+    duration: int | None = None
+    status: int = 200
+    detail: str | None = None
+
+
+def _open_animation(stream) -> Image.Image:
+    # Só o cabeçalho: os quadros são decodificados um a um durante a resposta
+    try:
+        image = Image.open(stream)
+    except Image.DecompressionBombError:
+        raise HTTPException(
+            status_code=413, detail="Imagem com dimensões excessivas.")
     except Exception:
         raise HTTPException(
-            status_code=500, detail="Falha ao processar a imagem.")
+            status_code=415, detail="Arquivo não é uma imagem válida.")
+    if image.format not in ANIMATED_IMAGE_FORMATS:
+        raise HTTPException(
+            status_code=415, detail="Formato inválido. Aceito: GIF, PNG, WebP.")
+    width, height = image.size
+    if width * height > MAX_IMAGE_MEGAPIXELS * 1_000_000:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Imagem excede {MAX_IMAGE_MEGAPIXELS:g} megapixels.")
+    return image
+
+
+def _count_animation_frames(image: Image.Image) -> int:
+    try:
+        return getattr(image, "n_frames", 1)
+    except (OSError, SyntaxError, ValueError, EOFError):
+        raise HTTPException(
+            status_code=415, detail="Arquivo não é uma imagem válida.")
+
+
+def _iter_animation_frames(image: Image.Image):
+    # Um quadro por vez (o PIL compõe GIF/APNG sobre o quadro anterior):
+    # a memória não cresce com a duração da animação
+    index = 0
+    try:
+        for frame in ImageSequence.Iterator(image):
+            with _stage("decode"):
+                pixels = np.array(frame.convert("RGBA"))
+            yield _Frame(index, f"quadro-{index:05d}", pixels,
+                         frame.info.get("duration"))
+            index += 1
+    except (OSError, SyntaxError, ValueError, EOFError):
+        # Animação truncada: não há como seguir para os quadros seguintes
+        yield _Frame(index, f"quadro-{index:05d}", None, status=415,
+                     detail="Quadro corrompido; sequência interrompida.")
+
+
+def _sequence_zip_entries(zf: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    # Quadros na ordem dos nomes (quadro-001.png, quadro-002.png, ...)
+    return sorted(
+        (info for info in zf.infolist()
+         if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+         and info.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)),
+        key=lambda info: info.filename)
+
+
+def _iter_zip_frames(archive):
+    with zipfile.ZipFile(archive) as zf:
+        for index, info in enumerate(_sequence_zip_entries(zf)):
+            try:
+                if info.file_size > MAX_FILE_SIZE_BYTES:
+                    raise HTTPException(status_code=413, detail="Arquivo excede 10MB.")
+                with zf.open(info) as entry:
+                    upload = _read_image_stream(entry)
+                pixels = _decode_to_rgba_array(upload.image)
+            except HTTPException as exc:
+                yield _Frame(index, info.filename, None,
+                             status=exc.status_code, detail=exc.detail)
+                continue
+            except _InvalidImageError:
+                yield _Frame(index, info.filename, None, status=415,
+                             detail="Arquivo não é uma imagem válida.")
+                continue
+            yield _Frame(index, info.filename, pixels)
+
+
+def _frame_signature(pixels: np.ndarray) -> np.ndarray:
+    # Miniatura em tons de cinza (0..1): custa uma fração da entrada do modelo
+    side = TEMPORAL_SIGNATURE_SIDE
+    thumb = Image.fromarray(pixels).resize((side, side), Image.BOX).convert("L")
+    return np.asarray(thumb, dtype=np.float32) / 255
+
+
+class _TemporalMask:
+    """Última máscara inferida de uma sequência, reaproveitada em quadros parecidos"""
+
+    def __init__(self, threshold: float = TEMPORAL_REUSE_THRESHOLD,
+                 max_reuse: int = TEMPORAL_MAX_REUSE):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self._mask: np.ndarray | None = None
+        self._signature: np.ndarray | None = None
+        self._shape: tuple | None = None
+        self._reused = 0
+
+    def match(self, signature: np.ndarray, shape: tuple) -> np.ndarray | None:
+        # Compara com o quadro da inferência (não com o anterior): mudanças
+        # lentas se acumulam e acabam forçando uma nova máscara
+        if self._mask is None or shape != self._shape \
+                or self._reused >= self.max_reuse:
+            return None
+        if float(np.abs(signature - self._signature).mean()) > self.threshold:
+            return None
+        self._reused += 1
+        return self._mask
+
+    def update(self, mask: np.ndarray, signature: np.ndarray, shape: tuple) -> None:
+        self._mask = mask
+        self._signature = signature
+        self._shape = shape
+        self._reused = 0
+
+
+_sequence_frames = {"inferred": 0, "reused": 0}
+
+
+async def _process_frame(
+    frame: _Frame,
+    temporal: _TemporalMask,
+    model: str,
+    result: str,
+    background: _Upload | None,
+    background_fit: str,
+    output: _OutputSpec,
+) -> tuple[bytes, str, bool]:
+    pixels = frame.pixels
+    signature = await asyncio.to_thread(_frame_signature, pixels)
+    mask = temporal.match(signature, pixels.shape)
+    reused = mask is not None
+    if mask is None:
+        model_input = await asyncio.to_thread(_prepare_model_input, pixels, model)
+        mask = await _mask_batcher.predict(model, model_input)
+        temporal.update(mask, signature, pixels.shape)
+    _sequence_frames["reused" if reused else "inferred"] += 1
+
+    size = (pixels.shape[1], pixels.shape[0])
+    if result == "mask":
+        data, media_type, _ = await asyncio.to_thread(
+            _finish_mask, mask, size, pixels, "png", False, output.preset)
+    elif background is None:
+        data, media_type = await asyncio.to_thread(
+            _finish_processing, pixels, mask, None, output=output)
+    else:
+        data, media_type = await asyncio.to_thread(
+            _finish_processing, pixels, mask, background.image,
+            background_fit, background.digest, output)
+    return data, media_type, reused
+
+
+async def _iter_sequence_results(frames, model, result, background, background_fit, output):
+    # Quadros em ordem (a máscara de um serve ao seguinte); o próximo quadro
+    # é decodificado no executor enquanto o atual passa pelo modelo
+    loop = asyncio.get_running_loop()
+    temporal = _TemporalMask()
+    upcoming = loop.run_in_executor(None, next, frames, None)
+    try:
+        while True:
+            frame = await upcoming
+            upcoming = None
+            if frame is None:
+                break
+            upcoming = loop.run_in_executor(None, next, frames, None)
+            if frame.pixels is None:
+                yield frame, frame.status, None, None, frame.detail, False
+                continue
+            try:
+                data, media_type, reused = await asyncio.wait_for(
+                    _process_frame(frame, temporal, model, result, background,
+                                   background_fit, output),
+                    timeout=PROCESS_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                yield frame, 504, None, None, "Tempo de processamento excedido.", False
+                continue
+            except Exception:
+                yield frame, 500, None, None, "Falha ao processar o quadro.", False
+                continue
+            yield frame, 200, data, media_type, None, reused
+    finally:
+        # O gerador de quadros só pode ser fechado depois da leitura em curso
+        if upcoming is not None:
+            try:
+                await upcoming
+            except Exception:
+                pass
+
+
+async def _stream_frames(results, boundary: str):
+    used: set[str] = set()
+    async for frame, status, data, media_type, detail, reused in results:
+        if data is None:
+            media_type = "application/json"
+            data = json.dumps({"filename": frame.name, "status": status,
+                               "detail": detail}, ensure_ascii=False).encode()
+        filename = _result_filename(frame.name, media_type, used)
+        headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f'Content-Disposition: attachment; filename="{filename}"\r\n'
+            f"X-Frame-Index: {frame.index}\r\n"
+            f"X-Frame-Status: {status}\r\n"
+            f"X-Mask-Reused: {'true' if reused else 'false'}\r\n"
+        )
+        if frame.duration is not None:
+            headers += f"X-Frame-Duration: {frame.duration}\r\n"
+        yield headers.encode() + b"\r\n" + data + b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+@app.post("/process-sequence")
+async def process_sequence(
+    file: UploadFile | None = File(None),
+    archive: UploadFile | None = File(None),
+    background: UploadFile | None = File(None),
+    model: str = Form(DEFAULT_MODEL),
+    background_fit: str = Form(DEFAULT_BACKGROUND_FIT),
+    result: str = Form("image"),
+    output_format: str = Form("auto"),
+    output_preset: str = Form(DEFAULT_OUTPUT_PRESET),
+    quality: int | None = Form(None),
+):
+    _parse_processing_options(
+        model, background_fit, output_format, output_preset, quality, result)
+    has_file = file is not None and bool(file.filename)
+    has_archive = archive is not None and bool(archive.filename)
+    if has_file == has_archive:
+        raise HTTPException(
+            status_code=400,
+            detail="Envie uma animação (file) ou um zip de quadros (archive).")
+    if not _ready.is_set():
+        raise _service_unavailable("Modelos ainda carregando. Tente novamente.")
+
+    loop = asyncio.get_running_loop()
+    if has_file:
+        stream = _detach_upload_file(file)
+        try:
+            image = await loop.run_in_executor(None, _open_animation, stream)
+            total = await loop.run_in_executor(None, _count_animation_frames, image)
+        except HTTPException:
+            stream.close()
+            raise
+    else:
+        stream = _detach_upload_file(archive)
+        if not zipfile.is_zipfile(stream):
+            stream.close()
+            raise HTTPException(status_code=415, detail="Arquivo zip inválido.")
+        with zipfile.ZipFile(stream) as zf:
+            total = len(_sequence_zip_entries(zf))
+    if total == 0 or total > MAX_SEQUENCE_FRAMES:
+        stream.close()
+        raise HTTPException(
+            status_code=400 if total == 0 else 413,
+            detail="Nenhum quadro enviado." if total == 0
+            else f"Sequência excede {MAX_SEQUENCE_FRAMES} quadros.")
+
+    # Mesmo fundo para todos os quadros: decodificado e redimensionado uma vez
+    background_upload = None
+    if result == "image" and background is not None and background.filename:
+        try:
+            background_upload = await loop.run_in_executor(
+                None, partial(_validate_and_read_upload, background, required=False))
+            await loop.run_in_executor(None, _load_image, background_upload.image)
+        except _InvalidImageError:
+            stream.close()
+            raise HTTPException(
+                status_code=415, detail="Arquivo não é uma imagem válida.")
+        except HTTPException:
+            stream.close()
+            raise
+    frame_output = _negotiate_output(
+        None, output_format, output_preset, quality, background_upload)
+
+    if not _admission.try_acquire():
+        stream.close()
+        raise _service_unavailable("Serviço sobrecarregado. Tente novamente.")
+
+    def iter_frames():
+        with stream:
+            if has_file:
+                with image:
+                    yield from _iter_animation_frames(image)
+            else:
+                yield from _iter_zip_frames(stream)
+
+    async def body():
+        frames = iter_frames()
+        results = _iter_sequence_results(
+            frames, model, result, background_upload, background_fit, frame_output)
+        try:
+            async for chunk in _stream_frames(results, boundary):
+                yield chunk
+        finally:
+            # Cliente desconectado: espera a leitura em curso antes de fechar
+            await results.aclose()
+            frames.close()
+            _admission.release()
+
+    boundary = uuid.uuid4().hex
+    return StreamingResponse(
+        body(), media_type=f"multipart/mixed; boundary={boundary}",
+        headers={"X-Frame-Count": str(total)})
+
+
+# Opções de uma conexão do modo ao vivo (query string ou mensagem "config")
+LIVE_DEFAULT_OPTIONS = {
+    "model": DEFAULT_MODEL,
+    "result": "image",
+    "mask_encoding": "png",
+    "background_fit": DEFAULT_BACKGROUND_FIT,
+    "output_format": "auto",
+    "output_preset": DEFAULT_OUTPUT_PRESET,
+    "quality": None,
+    "temporal_reuse": True,
+}
+
+
+def _live_options(values, current: dict | None = None) -> dict:
+    # Mesmas validações dos endpoints HTTP; valores da query chegam como texto
+    options = dict(current or LIVE_DEFAULT_OPTIONS)
+    options.update({name: values[name] for name in options if name in values})
+    if not isinstance(options["temporal_reuse"], bool):
+        options["temporal_reuse"] = str(options["temporal_reuse"]).lower() in ("1", "true", "yes")
+    parsed = _parse_processing_options(
+        options["model"], options["background_fit"], options["output_format"],
+        options["output_preset"], options["quality"], options["result"],
+        options["mask_encoding"])
+    options.update(parsed._asdict())
+    return options
+
+
+class _LiveSession:
+    """Estado de uma conexão do modo ao vivo: opções, fundo ajustado e buffers reaproveitados"""
+
+    def __init__(self, options: dict):
+        self.options = options
+        self.background: Image.Image | None = None
+        self.temporal = _TemporalMask()
+        self.buffers = _BlendBuffers()
+        self._fitted: tuple[tuple, np.ndarray] | None = None
+        self._update_output()
+
+    def configure(self, values) -> None:
+        self.options = _live_options(values, self.options)
+        self._fitted = None
+        self.temporal = _TemporalMask()
+        self._update_output()
+
+    def set_background(self, data: bytes | None) -> None:
+        # Decodificado uma vez por conexão; o ajuste ao tamanho do quadro
+        # fica guardado até o tamanho (ou o background_fit) mudar
+        if data is None:
+            self.background = None
+        else:
+            upload = _read_image_stream(io.BytesIO(data))
+            self.background = _load_image(upload.image)
+        self._fitted = None
+        self._update_output()
+
+    def _update_output(self) -> None:
+        # Sem Accept no WebSocket: auto mantém PNG/JPG conforme o fundo
+        self.output = _negotiate_output(
+            None, self.options["output_format"], self.options["output_preset"],
+            self.options["quality"], self.background)
+
+    def _fitted_background(self, size: tuple[int, int]) -> np.ndarray:
+        key = (size, self.options["background_fit"])
+        if self._fitted is None or self._fitted[0] != key:
+            self._fitted = (key, _fit_background(
+                self.background, size, self.options["background_fit"]))
+        return self._fitted[1]
+
+    def prepare(self, data: bytes):
+        # Leitura, decodificação e (se preciso) entrada do modelo numa só ida
+        # ao executor: (pixels, máscara reaproveitada, entrada do modelo, assinatura)
+        if len(data) > MAX_FILE_SIZE_BYTES:
+            raise HTTPException(status_code=413, detail="Arquivo excede 10MB.")
+        pixels = _decode_to_rgba_array(_read_image_stream(io.BytesIO(data)).image)
+        signature = _frame_signature(pixels)
+        mask = None
+        if self.options["temporal_reuse"]:
+            mask = self.temporal.match(signature, pixels.shape)
+        model_input = None
+        if mask is None:
+            model_input = _prepare_model_input(pixels, self.options["model"])
+        return pixels, mask, model_input, signature
+
+    def finish(self, pixels: np.ndarray, mask: np.ndarray):
+        size = (pixels.shape[1], pixels.shape[0])
+        if self.options["result"] == "mask":
+            return _finish_mask(mask, size, pixels, self.options["mask_encoding"],
+                                False, self.options["output_preset"])
+        pixels = _remove_background_to_rgba(pixels, mask)
+        bbox = _foreground_bbox(pixels[..., 3])
+        if self.background is not None:
+            with _stage("composite"):
+                pixels = _composite_on_fitted(
+                    pixels, self._fitted_background(size), self.buffers)
+        return _encode_image(pixels, self.output), self.output.media_type, bbox
+
+
+class _LiveInbox:
+    """Caixa de um quadro só: quadro novo substitui o que ainda não foi processado"""
+
+    def __init__(self):
+        self.frame: bytes | None = None
+        self.controls: list[tuple] = []
+        self.dropped = 0
+        self.closed = False
+        self.idle = False
+        self._event = asyncio.Event()
+
+    def put_frame(self, data: bytes) -> None:
+        if self.frame is not None:
+            self.dropped += 1
+            _live_frames["dropped"] += 1
+        self.frame = data
+        self._event.set()
+
+    def put_control(self, *control) -> None:
+        self.controls.append(control)
+        self._event.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._event.set()
+
+    async def take(self) -> tuple[list[tuple], bytes | None]:
+        await self._event.wait()
+        self._event.clear()
+        controls, self.controls = self.controls, []
+        frame, self.frame = self.frame, None
+        return controls, frame
+
+
+_live_connections = 0
+_live_frames = {"processed": 0, "dropped": 0}
+
+
+async def _live_receive(websocket: WebSocket, inbox: _LiveInbox) -> None:
+    # Lê tudo o que chega sem esperar o processamento: se o cliente manda
+    # quadros mais rápido que a inferência, só o mais recente é processado
+    expecting_background = False
+    try:
+        while True:
+            message = await asyncio.wait_for(
+                websocket.receive(), timeout=LIVE_IDLE_TIMEOUT_SECONDS)
+            if message["type"] == "websocket.disconnect":
+                break
+            data = message.get("bytes")
+            if data is not None:
+                if expecting_background:
+                    inbox.put_control("background", data)
+                    expecting_background = False
+                else:
+                    inbox.put_frame(data)
+                continue
+            try:
+                command = json.loads(message.get("text") or "")
+                kind = command.get("type")
+            except (ValueError, AttributeError):
+                inbox.put_control("error", 400, "Mensagem inválida.")
+                continue
+            if kind == "background":
+                expecting_background = True
+            elif kind in ("config", "clear_background"):
+                inbox.put_control(kind, command)
+            else:
+                inbox.put_control(
+                    "error", 400,
+                    "Tipo de mensagem inválido. Aceito: config, background, clear_background.")
+    except asyncio.TimeoutError:
+        inbox.idle = True
+    finally:
+        inbox.close()
+
+
+async def _live_apply(session: _LiveSession, control: tuple) -> dict:
+    # Mensagens de controle, na ordem em que chegaram, entre dois quadros
+    kind, payload = control[0], control[1:]
+    if kind == "error":
+        return {"type": "error", "status": payload[0], "detail": payload[1]}
+    try:
+        if kind == "config":
+            session.configure(payload[0])
+        elif kind == "clear_background":
+            session.set_background(None)
+        else:
+            await asyncio.to_thread(session.set_background, payload[0])
+    except HTTPException as exc:
+        return {"type": "error", "status": exc.status_code, "detail": exc.detail}
+    except _InvalidImageError:
+        return {"type": "error", "status": 415, "detail": "Arquivo não é uma imagem válida."}
+    except Exception:
+        return {"type": "error", "status": 500, "detail": "Falha ao aplicar a mensagem."}
+    return {"type": "config", **session.options,
+            "background": session.background is not None}
+
+
+async def _live_process(session: _LiveSession, data: bytes):
+    pixels, mask, model_input, signature = await asyncio.to_thread(session.prepare, data)
+    reused = mask is not None
+    if mask is None:
+        mask = await _mask_batcher.predict(session.options["model"], model_input)
+        session.temporal.update(mask, signature, pixels.shape)
+    payload, media_type, bbox = await asyncio.to_thread(session.finish, pixels, mask)
+    return payload, media_type, bbox, (pixels.shape[1], pixels.shape[0]), reused
+
+
+@app.websocket("/ws/live")
+async def live(websocket: WebSocket):
+    # Preview interativo: quadros JPG/PNG em binário entram; cada resultado
+    # sai como {"type": "result", ...} seguido dos bytes. Controle por JSON:
+    # "config" (opções), "background" (o próximo binário é o fundo) e
+    # "clear_background"
+    global _live_connections
+    await websocket.accept()
+    if not _ready.is_set():
+        await websocket.close(code=1013, reason="Modelos ainda carregando.")
+        return
+    if _live_connections >= MAX_LIVE_CONNECTIONS:
+        await websocket.close(code=1013, reason="Serviço sobrecarregado.")
+        return
+    try:
+        session = _LiveSession(_live_options(websocket.query_params))
+    except HTTPException as exc:
+        await websocket.close(code=1008, reason=exc.detail)
+        return
+
+    _live_connections += 1
+    inbox = _LiveInbox()
+    receiver = asyncio.create_task(_live_receive(websocket, inbox))
+    sequence = 0
+    try:
+        await websocket.send_json({"type": "config", **session.options,
+                                   "background": False})
+        while not inbox.closed or inbox.controls or inbox.frame is not None:
+            controls, frame = await inbox.take()
+            for control in controls:
+                await websocket.send_json(await _live_apply(session, control))
+            if frame is None:
+                continue
+            sequence += 1
+            dropped, inbox.dropped = inbox.dropped, 0
+            try:
+                payload, media_type, bbox, size, reused = await asyncio.wait_for(
+                    _live_process(session, frame), timeout=PROCESS_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.send_json({"type": "error", "sequence": sequence,
+                                           "status": 504,
+                                           "detail": "Tempo de processamento excedido."})
+                continue
+            except _InvalidImageError:
+                await websocket.send_json({"type": "error", "sequence": sequence,
+                                           "status": 415,
+                                           "detail": "Arquivo não é uma imagem válida."})
+                continue
+            except HTTPException as exc:
+                await websocket.send_json({"type": "error", "sequence": sequence,
+                                           "status": exc.status_code, "detail": exc.detail})
+                continue
+            except Exception:
+                # Falha do worker ou do pós-processamento: só este quadro se perde
+                await websocket.send_json({"type": "error", "sequence": sequence,
+                                           "status": 500,
+                                           "detail": "Falha ao processar o quadro."})
+                continue
+            _live_frames["processed"] += 1
+            await websocket.send_json({
+                "type": "result", "sequence": sequence, "dropped": dropped,
+                "media_type": media_type, "size": list(size),
+                "bbox": list(bbox) if bbox else None, "mask_reused": reused,
+            })
+            await websocket.send_bytes(payload)
+        if inbox.idle:
+            await websocket.close(code=1000, reason="Conexão ociosa.")
+    except (WebSocketDisconnect, OSError):
+        # Cliente saiu no meio de um envio
+        pass
+    except RuntimeError:
+        # O Starlette recusa envios depois do fechamento com RuntimeError;
+        # qualquer outro RuntimeError é um erro de verdade
+        if WebSocketState.DISCONNECTED not in (
+                websocket.client_state, websocket.application_state):
+            raise
+    finally:
+        receiver.cancel()
+        _live_connections -= 1
+
+
+def _read_job_file(path: str) -> _Upload:
+    with open(path, "rb") as f:
+        return _read_image_stream(f)
+
+
+def _job_output(job: sqlite3.Row) -> _OutputSpec | None:
+    if job["output_format"] is None:
+        return None
+    return _OutputSpec(job["output_format"], job["output_preset"], job["output_quality"])
+
+
+async def _run_job(job: sqlite3.Row) -> None:
+    # Erro inesperado (SQLite, decodificador, memória) encerra só este job:
+    # a tarefa que consome a fila continua viva
+    try:
+        await _execute_job(job)
+    except Exception:
+        _logger.exception("Falha inesperada no job %s", job["id"])
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, _job_store.fail, job["id"], 500, "Falha ao processar o job.")
+        except Exception:
+            # Sem como gravar: o job volta para a fila na próxima inicialização
+            _logger.exception("Não foi possível marcar o job %s como falho", job["id"])
+        _notify_job_waiters(job["id"])
+
+
+def _notify_job_waiters(job_id: str) -> None:
+    event = _job_events.pop(job_id, None)
+    if event is not None:
+        event.set()
+
+
+async def _execute_job(job: sqlite3.Row) -> None:
+    loop = asyncio.get_running_loop()
+    job_id = job["id"]
+    try:
+        upload = await loop.run_in_executor(
+            None, _read_job_file, _job_store.path(job_id, "input"))
+        background = None
+        if job["has_background"]:
+            background = await loop.run_in_executor(
+                None, _read_job_file, _job_store.path(job_id, "background"))
+        if job["result_mode"] == "mask":
+            status, data, media_type, detail, bbox = await _process_mask_item(
+                upload, job["model"], JOB_TIMEOUT_SECONDS, job["mask_encoding"],
+                bool(job["crop_to_bbox"]), job["output_preset"] or DEFAULT_OUTPUT_PRESET)
+            mask_headers = (
+                "{},{}".format(*upload.image.size),
+                ",".join(map(str, bbox)) if bbox else "")
+        else:
+            status, data, media_type, detail = await _process_item(
+                upload, bool(job["remove_background"]), background, job["model"],
+                JOB_TIMEOUT_SECONDS, job["background_fit"], _job_output(job))
+            mask_headers = (None, None)
+    except HTTPException as exc:
+        status, data, media_type, detail = exc.status_code, None, None, exc.detail
+    except OSError:
+        status, data, media_type, detail = 500, None, None, "Entrada do job não encontrada."
+
+    if data is not None:
+        await loop.run_in_executor(
+            None, _job_store.complete, job_id, data, media_type, *mask_headers)
+    elif status >= 500 and job["attempts"] < JOB_MAX_ATTEMPTS:
+        # Falha do serviço (worker reiniciado, timeout da inferência): tenta de novo
+        await loop.run_in_executor(None, _job_store.requeue, job_id)
+        return
+    else:
+        await loop.run_in_executor(None, _job_store.fail, job_id, status, detail)
+    _notify_job_waiters(job_id)
+
+
+async def _run_jobs() -> None:
+    loop = asyncio.get_running_loop()
+    # A remoção de fundo depende dos workers de inferência prontos
+    while not _ready.is_set():
+        await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS / 10)
+    while True:
+        try:
+            job = await loop.run_in_executor(None, _job_store.claim)
+        except Exception:
+            _logger.exception("Falha ao ler a fila de jobs")
+            await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+            continue
+        if job is None:
+            _job_wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    _job_wakeup.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await _run_job(job)
+
+
+async def _purge_jobs() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            purged = await loop.run_in_executor(
+                None, _job_store.purge, time.time() - JOB_RETENTION_SECONDS)
+        except Exception:
+            _logger.exception("Falha ao limpar jobs antigos")
+            purged = []
+        for job_id in purged:
+            _notify_job_waiters(job_id)
+        await asyncio.sleep(JOB_PURGE_INTERVAL_SECONDS)
+
+
+def _job_response(job: sqlite3.Row) -> dict:
+    body = {
+        "id": job["id"],
+        "status": job["status"],
+        "model": job["model"],
+        "remove_background": bool(job["remove_background"]),
+        "result": job["result_mode"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["status"] == "done":
+        body["result_url"] = f"/jobs/{job['id']}/result"
+    elif job["status"] == "failed":
+        body["error"] = {"status_code": job["error_status"], "detail": job["error"]}
+    return body
+
+
+async def _get_job_or_404(job_id: str) -> sqlite3.Row:
+    job = await asyncio.get_running_loop().run_in_executor(
+        None, _job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    remove_background: bool = Form(False),
+    background: UploadFile | None = File(None),
+    model: str = Form(DEFAULT_MODEL),
+    background_fit: str = Form(DEFAULT_BACKGROUND_FIT),
+    output_format: str = Form("auto"),
+    output_preset: str = Form(DEFAULT_OUTPUT_PRESET),
+    quality: int | None = Form(None),
+    result: str = Form("image"),
+    mask_encoding: str = Form("png"),
+    crop_to_bbox: bool = Form(False),
+    accept: str | None = Header(None),
+):
+    _parse_processing_options(
+        model, background_fit, output_format, output_preset, quality,
+        result, mask_encoding)
+
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(None, _job_store.count_queued) >= MAX_QUEUED_JOBS:
+        raise _service_unavailable("Fila de jobs cheia. Tente novamente.")
+
+    # Mesmas validações do /process-image, feitas antes de aceitar o job
+    upload = await loop.run_in_executor(
+        None, partial(_validate_and_read_upload, file, required=True))
+    background_upload = None
+    if background is not None and background.filename:
+        background_upload = await loop.run_in_executor(
+            None, partial(_validate_and_read_upload, background, required=False))
+
+    # Accept resolvido agora: quem consulta o resultado é o mesmo cliente
+    output = _negotiate_output(
+        accept, output_format, output_preset, quality, background_upload)
+    job_id = await loop.run_in_executor(
+        None, _job_store.create, model, remove_background, upload.data,
+        background_upload.data if background_upload else None, background_fit,
+        output, (mask_encoding, crop_to_bbox) if result == "mask" else None)
+    _job_wakeup.set()
+    return JSONResponse(
+        {"id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"},
+        status_code=202, headers={"Location": f"/jobs/{job_id}"})
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    # Long-poll: segura a resposta até o job terminar (ou o prazo acabar)
+    wait = min(max(wait, 0), JOB_LONG_POLL_MAX_SECONDS)
+    if not wait:
+        return JSONResponse(_job_response(await _get_job_or_404(job_id)))
+
+    # Evento registrado antes de ler o status: um job que termina entre a
+    # leitura e a espera já encontra o evento e o dispara
+    event = _job_events.setdefault(job_id, asyncio.Event())
+    _job_waiters[job_id] += 1
+    try:
+        job = await _get_job_or_404(job_id)
+        if job["status"] not in _JobStore.FINISHED:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            job = await _get_job_or_404(job_id)
+    finally:
+        # Último long-poll a sair leva o evento junto (prazo esgotado,
+        # job inexistente ou cliente desconectado)
+        _job_waiters[job_id] -= 1
+        if _job_waiters[job_id] <= 0:
+            del _job_waiters[job_id]
+            if _job_events.get(job_id) is event:
+                del _job_events[job_id]
+    return JSONResponse(_job_response(job))
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await _get_job_or_404(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job falhou: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail="Job ainda não concluído.")
+    headers = None
+    if job["result_mode"] == "mask":
+        # Mesmos cabeçalhos do /process-image com result=mask
+        headers = {
+            "X-Foreground-BBox": job["foreground_bbox"] or "",
+            "X-Image-Size": job["image_size"] or "",
+        }
+    return FileResponse(
+        _job_store.path(job_id, "result"), media_type=job["media_type"], headers=headers)
+
 
-    return Response(content=processed_bytes, media_type=media_type)
+@app.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str):
+    await _get_job_or_404(job_id)
+    deleted = await asyncio.get_running_loop().run_in_executor(
+        None, _job_store.delete, job_id)
+    if not deleted:
+        raise HTTPException(status_code=409, detail="Job em execução.")
+    _notify_job_waiters(job_id)
+    return Response(status_code=204)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Antes de importar o serviço: nada de cache em disco nem fila no repositório
+os.environ.setdefault("CACHE_DIR", "")
+os.environ.setdefault("JOBS_DIR", tempfile.mkdtemp(prefix="test-jobs-"))
+os.environ.setdefault("JOB_CONCURRENCY", "1")
+
+
+def _load_service():
+    # Nome próprio no sys.modules: o provador virtual também tem um main.py
+    sys.path.insert(0, BACKEND_DIR)
+    spec = importlib.util.spec_from_file_location(
+        "image_service_main", os.path.join(BACKEND_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+service = _load_service()
+
+
+def fake_mask(model: str) -> np.ndarray:
+    """Máscara do "modelo": primeiro plano no quadrado central"""
+    side = service.MODEL_INPUT_SPECS[model][0]
+    mask = np.zeros((side, side), dtype=np.uint8)
+    mask[side // 4:3 * side // 4, side // 4:3 * side // 4] = 255
+    return mask
+
+
+def _image_bytes(size=(64, 48), color=(200, 30, 30), fmt="PNG", mode="RGB") -> bytes:
+    with io.BytesIO() as out:
+        Image.new(mode, size, color).save(out, format=fmt)
+        return out.getvalue()
+
+
+@pytest.fixture
+def image_bytes():
+    """Fábrica de imagens sólidas já codificadas (PNG por padrão)"""
+    return _image_bytes
+
+
+@pytest.fixture
+def main():
+    return service
+
+
+@pytest.fixture
+def predictions(monkeypatch):
+    """Stub da inferência: sem workers nem onnxruntime; conta as chamadas"""
+    calls = []
+
+    async def open_pool():
+        pass
+
+    async def predict(model, model_input):
+        calls.append(model)
+        return fake_mask(model)
+
+    monkeypatch.setattr(service._inference_pool, "open", open_pool)
+    monkeypatch.setattr(service._mask_batcher, "predict", predict)
+    return calls
+
+
+@pytest.fixture
+def client(predictions, monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+
+    # Caches e fila novos a cada teste
+    monkeypatch.setattr(service, "_result_cache", service._ByteLRUCache(64 * 1024 * 1024))
+    monkeypatch.setattr(service, "_mask_cache", service._ByteLRUCache(64 * 1024 * 1024))
+    monkeypatch.setattr(service, "_job_store", service._JobStore(str(tmp_path / "jobs")))
+    monkeypatch.setattr(service, "_job_events", {})
+    with TestClient(service.app) as test_client:
+        # O pool "sobe" numa tarefa de fundo logo depois do startup
+        service._ready.wait(5)
+        yield test_client
+
+
+def _multipart_parts(response) -> list[tuple[dict, bytes]]:
+    # multipart/mixed das respostas em lote: [(cabeçalhos, corpo), ...]
+    boundary = response.headers["content-type"].split("boundary=")[1].encode()
+    parts = []
+    for chunk in response.content.split(b"--" + boundary)[1:]:
+        if chunk.startswith(b"--"):
+            break
+        head, _, body = chunk.partition(b"\r\n\r\n")
+        headers = dict(
+            line.decode().split(": ", 1) for line in head.strip().split(b"\r\n"))
+        parts.append(({k.lower(): v for k, v in headers.items()}, body[:-2]))
+    return parts
+
+
+@pytest.fixture
+def multipart_parts():
+    """Separa as partes de uma resposta multipart/mixed"""
+    return _multipart_parts
@@ -0,0 +1,23 @@
+def _post(client, data):
+    return client.post("/process-image", files={"file": ("foto.png", data, "image/png")},
+                       data={"remove_background": "true"})
+
+
+def test_full_gate_returns_503_with_retry_after(client, main, image_bytes, monkeypatch):
+    gate = main._AdmissionGate(1)
+    monkeypatch.setattr(main, "_admission", gate)
+    assert gate.try_acquire()
+    response = _post(client, image_bytes())
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(main.RETRY_AFTER_SECONDS)
+
+    gate.release()
+    assert _post(client, image_bytes()).status_code == 200
+    assert gate.pending == 0
+
+
+def test_loading_service_answers_503(client, main, monkeypatch):
+    assert client.get("/health").json()["status"] == "ok"
+    monkeypatch.setattr(main, "_ready", main.threading.Event())
+    assert client.get("/health").status_code == 503
+    assert _post(client, b"qualquer coisa").status_code == 503
@@ -0,0 +1,61 @@
+import io
+import json
+import zipfile
+
+from PIL import Image
+
+
+def _files(image_bytes):
+    return [
+        ("files", ("a.png", image_bytes(), "image/png")),
+        ("files", ("b.jpg", image_bytes(fmt="JPEG"), "image/jpeg")),
+        ("files", ("c.png", b"nada de imagem", "image/png")),
+    ]
+
+
+def test_zip_output_with_manifest(client, image_bytes):
+    response = client.post("/process-images", files=_files(image_bytes),
+                           data={"remove_background": "true"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        assert [e["status"] for e in manifest] == [200, 200, 415]
+        assert [e["filename"] for e in manifest] == ["a.png", "b.jpg", "c.png"]
+        for entry in manifest[:2]:
+            image = Image.open(io.BytesIO(zf.read(entry["output"])))
+            assert image.mode == "RGBA" and image.size == (64, 48)
+
+
+def test_multipart_output(client, image_bytes, multipart_parts):
+    response = client.post("/process-images", files=_files(image_bytes),
+                           data={"remove_background": "true", "output": "multipart"})
+    assert response.status_code == 200
+    parts = multipart_parts(response)
+    statuses = {int(h["x-item-index"]): int(h["x-item-status"]) for h, _ in parts}
+    assert statuses == {0: 200, 1: 200, 2: 415}
+    for headers, body in parts:
+        if headers["x-item-status"] == "200":
+            assert Image.open(io.BytesIO(body)).size == (64, 48)
+
+
+def test_archive_input(client, image_bytes):
+    with io.BytesIO() as buffer:
+        with zipfile.ZipFile(buffer, "w") as zf:
+            zf.writestr("fotos/um.png", image_bytes())
+            zf.writestr("fotos/dois.png", image_bytes(color=(0, 0, 200)))
+            zf.writestr("leia-me.txt", "ignorado")
+        archive = buffer.getvalue()
+    response = client.post(
+        "/process-images", files={"archive": ("fotos.zip", archive, "application/zip")},
+        data={"remove_background": "true"})
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+    assert len(manifest) == 2 and all(e["status"] == 200 for e in manifest)
+
+
+def test_batch_rejects_empty_and_bad_output(client, image_bytes):
+    assert client.post("/process-images", data={"remove_background": "true"}).status_code == 400
+    response = client.post("/process-images", files=_files(image_bytes),
+                           data={"output": "tar"})
+    assert response.status_code == 400
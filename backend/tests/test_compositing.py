@@ -0,0 +1,50 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+
+def _reference_blend(rgba, background):
+    alpha = rgba[..., 3:].astype(np.uint32)
+    mixed = rgba[..., :3] * alpha + background.astype(np.uint32) * (255 - alpha)
+    return ((mixed + 127) // 255).astype(np.uint8)
+
+
+def test_blend_matches_reference_and_reuses_scratch(main):
+    rng = np.random.default_rng(0)
+    rgba = rng.integers(0, 256, (300, 40, 4), dtype=np.uint8)
+    background = rng.integers(0, 256, (300, 40, 3), dtype=np.uint8)
+    first = main._blend_over(rgba, background)
+    storage = main._blend_scratch._storage
+    np.testing.assert_array_equal(first, _reference_blend(rgba, background))
+
+    # Quadro menor: mesmas faixas de trabalho, saída nova
+    second = main._blend_over(rgba[:100, :20], background[:100, :20])
+    assert main._blend_scratch._storage is storage
+    assert second is not first
+    np.testing.assert_array_equal(first, _reference_blend(rgba, background))
+
+
+def test_fit_modes(main):
+    background = Image.new("RGB", (100, 50), (0, 0, 255))
+    for fit in main.BACKGROUND_FIT_MODES:
+        fitted = main._fit_background(background, (40, 40), fit)
+        assert fitted.shape == (40, 40, 3)
+    contain = main._fit_background(background, (40, 40), "contain")
+    assert tuple(contain[0, 0]) == (255, 255, 255)
+    assert tuple(contain[20, 20]) == (0, 0, 255)
+
+
+def test_composite_over_background(client, image_bytes):
+    response = client.post(
+        "/process-image",
+        files={"file": ("foto.png", image_bytes(size=(64, 48)), "image/png"),
+               "background": ("fundo.png", image_bytes(size=(32, 32), color=(0, 0, 255)),
+                              "image/png")},
+        data={"remove_background": "true", "background_fit": "cover",
+              "output_format": "png"})
+    assert response.status_code == 200
+    result = np.asarray(Image.open(io.BytesIO(response.content)).convert("RGB"))
+    assert result.shape == (48, 64, 3)
+    assert tuple(result[0, 0]) == (0, 0, 255)  # fundo nos cantos
+    assert tuple(result[24, 32]) == (200, 30, 30)  # recorte no centro
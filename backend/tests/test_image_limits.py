@@ -0,0 +1,39 @@
+import io
+
+from PIL import Image
+
+
+def _post(client, data):
+    return client.post("/process-image", files={"file": ("foto.jpg", data, "image/jpeg")},
+                       data={"remove_background": "true"})
+
+
+def test_megapixel_cap_checked_on_header(client, main, image_bytes, monkeypatch):
+    monkeypatch.setattr(main, "MAX_IMAGE_MEGAPIXELS", 0.002)
+    response = _post(client, image_bytes(size=(64, 48), fmt="JPEG"))
+    assert response.status_code == 413
+    assert "megapixels" in response.json()["detail"]
+
+
+def test_decompression_bomb_is_413(client, image_bytes, monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    assert _post(client, image_bytes(size=(64, 48), fmt="JPEG")).status_code == 413
+
+
+def test_large_jpeg_uses_reduced_decode(client, main, image_bytes, monkeypatch):
+    decoded = []
+    load_image = main._load_image
+
+    def recording_load(image):
+        decoded.append(image.size)
+        return load_image(image)
+
+    monkeypatch.setattr(main, "_load_image", recording_load)
+    model_input = main._prepare_model_input_from_bytes(
+        image_bytes(size=(2400, 1600), fmt="JPEG"), "u2net")
+    assert model_input.shape == (3, 320, 320)
+    # draft: o DCT já entrega uma escala reduzida, não os 2400x1600
+    assert decoded and decoded[0][0] < 2400
+
+    response = _post(client, image_bytes(size=(2400, 1600), fmt="JPEG"))
+    assert Image.open(io.BytesIO(response.content)).size == (2400, 1600)
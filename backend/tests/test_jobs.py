@@ -0,0 +1,56 @@
+import sqlite3
+
+
+def _create(client, data, **fields):
+    response = client.post(
+        "/jobs", files={"file": ("foto.png", data, "image/png")}, data=fields)
+    assert response.status_code == 202
+    return response.json()["id"]
+
+
+def test_job_roundtrip(client, image_bytes):
+    job_id = _create(client, image_bytes(), remove_background="true")
+    status = client.get(f"/jobs/{job_id}?wait=10").json()
+    assert status["status"] == "done"
+    result = client.get(status["result_url"])
+    assert result.status_code == 200
+    assert result.headers["content-type"] == "image/png"
+
+    assert client.delete(f"/jobs/{job_id}").status_code == 204
+    assert client.get(f"/jobs/{job_id}").status_code == 404
+
+
+def test_mask_job_returns_bbox_headers(client, image_bytes):
+    job_id = _create(client, image_bytes(size=(64, 48)), result="mask", mask_encoding="rle")
+    status = client.get(f"/jobs/{job_id}?wait=10").json()
+    assert status["status"] == "done" and status["result"] == "mask"
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.headers["content-type"] == "application/json"
+    assert result.headers["x-image-size"] == "64,48"
+    assert result.headers["x-foreground-bbox"]
+
+
+def test_long_poll_leaves_no_events(client, main):
+    assert client.get("/jobs/desconhecido?wait=0.1").status_code == 404
+    assert main._job_events == {} and not main._job_waiters
+
+
+def test_unexpected_error_fails_job_and_keeps_worker(client, main, image_bytes, monkeypatch):
+    complete = main._job_store.complete
+    calls = []
+
+    def flaky_complete(*args):
+        calls.append(args[0])
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return complete(*args)
+
+    monkeypatch.setattr(main._job_store, "complete", flaky_complete)
+    first = _create(client, image_bytes(), remove_background="true")
+    status = client.get(f"/jobs/{first}?wait=10").json()
+    assert status["status"] == "failed"
+    assert status["error"]["status_code"] == 500
+
+    # A mesma tarefa de fundo segue consumindo a fila
+    second = _create(client, image_bytes(color=(0, 0, 255)), remove_background="true")
+    assert client.get(f"/jobs/{second}?wait=10").json()["status"] == "done"
@@ -0,0 +1,50 @@
+import io
+
+from PIL import Image
+
+
+def _receive_result(ws):
+    message = ws.receive_json()
+    assert message["type"] == "result", message
+    return message, ws.receive_bytes()
+
+
+def test_frames_background_and_mask_reuse(client, image_bytes, predictions):
+    with client.websocket_connect("/ws/live?output_format=png") as ws:
+        config = ws.receive_json()
+        assert config["type"] == "config" and config["background"] is False
+
+        ws.send_bytes(image_bytes())
+        message, payload = _receive_result(ws)
+        assert message["sequence"] == 1 and message["size"] == [64, 48]
+        assert message["mask_reused"] is False and message["bbox"]
+        assert Image.open(io.BytesIO(payload)).mode == "RGBA"
+
+        # Quadro igual: a máscara anterior é reaproveitada, sem inferência
+        ws.send_bytes(image_bytes())
+        message, _ = _receive_result(ws)
+        assert message["mask_reused"] is True and len(predictions) == 1
+
+        ws.send_json({"type": "background"})
+        ws.send_bytes(image_bytes(size=(20, 20), color=(0, 200, 0)))
+        assert ws.receive_json()["background"] is True
+        ws.send_bytes(image_bytes())
+        _, payload = _receive_result(ws)
+        composed = Image.open(io.BytesIO(payload))
+        assert composed.mode == "RGB" and composed.getpixel((0, 0)) == (0, 200, 0)
+
+
+def test_bad_messages_keep_connection(client, image_bytes):
+    with client.websocket_connect("/ws/live") as ws:
+        ws.receive_json()
+        ws.send_text("{nada")
+        assert ws.receive_json() == {"type": "error", "status": 400,
+                                     "detail": "Mensagem inválida."}
+        ws.send_bytes(b"nada de imagem")
+        error = ws.receive_json()
+        assert error["type"] == "error" and error["status"] == 415
+        ws.send_json({"type": "config", "result": "mask", "mask_encoding": "rle"})
+        assert ws.receive_json()["result"] == "mask"
+        ws.send_bytes(image_bytes())
+        message, _ = _receive_result(ws)
+        assert message["media_type"] == "application/json"
@@ -0,0 +1,65 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def batches(main, monkeypatch):
+    """Stub do pool: cada lote vira máscaras com o índice do item"""
+    sizes = []
+
+    async def run(func, args, timeout):
+        model, batch = args
+        sizes.append(len(batch))
+        return np.stack([np.full((4, 4), i, dtype=np.uint8) for i in range(len(batch))])
+
+    monkeypatch.setattr(main._inference_pool, "run", run)
+    return sizes
+
+
+def test_concurrent_requests_share_one_inference(main, batches):
+    async def scenario():
+        batcher = main._MaskBatcher(max_batch_size=8, max_wait_ms=50, slots=1)
+        try:
+            inputs = [np.zeros((3, 4, 4), dtype=np.float32) for _ in range(3)]
+            return await asyncio.gather(*(batcher.predict("u2net", x) for x in inputs))
+        finally:
+            await batcher.close()
+
+    masks = asyncio.run(scenario())
+    assert batches == [3]
+    # Cada pedido recebe a máscara da sua posição no lote
+    assert [int(mask[0, 0]) for mask in masks] == [0, 1, 2]
+
+
+def test_batch_size_is_capped(main, batches):
+    async def scenario():
+        batcher = main._MaskBatcher(max_batch_size=2, max_wait_ms=50, slots=1)
+        try:
+            inputs = [np.zeros((3, 4, 4), dtype=np.float32) for _ in range(5)]
+            await asyncio.gather(*(batcher.predict("u2net", x) for x in inputs))
+        finally:
+            await batcher.close()
+
+    asyncio.run(scenario())
+    assert batches == [2, 2, 1]
+
+
+def test_inference_error_reaches_every_caller(main, monkeypatch):
+    async def failing_run(func, args, timeout):
+        raise RuntimeError("worker morreu")
+
+    monkeypatch.setattr(main._inference_pool, "run", failing_run)
+
+    async def scenario():
+        batcher = main._MaskBatcher(max_batch_size=8, max_wait_ms=20, slots=1)
+        try:
+            inputs = [np.zeros((3, 4, 4), dtype=np.float32) for _ in range(2)]
+            return await asyncio.gather(
+                *(batcher.predict("u2net", x) for x in inputs), return_exceptions=True)
+        finally:
+            await batcher.close()
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
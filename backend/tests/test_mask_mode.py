@@ -0,0 +1,61 @@
+import io
+import json
+
+import numpy as np
+from PIL import Image
+
+
+def _half_transparent_png() -> bytes:
+    # 200x100: metade esquerda totalmente transparente
+    pixels = np.full((100, 200, 4), 255, dtype=np.uint8)
+    pixels[:, :100, 3] = 0
+    with io.BytesIO() as out:
+        Image.fromarray(pixels).save(out, format="PNG")
+        return out.getvalue()
+
+
+def _post_mask(client, data: bytes, **fields):
+    return client.post(
+        "/process-image",
+        files={"file": ("foto.png", data, "image/png")},
+        data={"result": "mask", **fields})
+
+
+def test_mask_png_with_bbox_headers(client, image_bytes):
+    response = _post_mask(client, image_bytes(size=(64, 48)))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["x-image-size"] == "64,48"
+    x, y, w, h = map(int, response.headers["x-foreground-bbox"].split(","))
+    assert 0 < x and 0 < y and x + w < 64 and y + h < 48
+    mask = Image.open(io.BytesIO(response.content))
+    assert mask.mode == "L" and mask.size == (64, 48)
+
+
+def test_mask_crop_and_rle(client, image_bytes):
+    cropped = _post_mask(client, image_bytes(), crop_to_bbox="true")
+    _, _, w, h = map(int, cropped.headers["x-foreground-bbox"].split(","))
+    assert Image.open(io.BytesIO(cropped.content)).size == (w, h)
+
+    rle = _post_mask(client, image_bytes(), mask_encoding="rle")
+    assert rle.headers["content-type"] == "application/json"
+    body = json.loads(rle.content)
+    assert (body["width"], body["height"]) == (64, 48)
+    assert sum(body["counts"]) == 64 * 48
+
+
+def test_mask_keeps_source_alpha_on_cache_hit(client, predictions):
+    data = _half_transparent_png()
+    miss = _post_mask(client, data)
+    hit = _post_mask(client, data)
+    assert len(predictions) == 1  # a segunda veio do cache de máscaras
+    assert miss.status_code == hit.status_code == 200
+    assert miss.headers["x-foreground-bbox"] == hit.headers["x-foreground-bbox"]
+    assert miss.content == hit.content
+    x, _, w, _ = map(int, hit.headers["x-foreground-bbox"].split(","))
+    assert x >= 100
+
+
+def test_invalid_mask_encoding(client, image_bytes):
+    response = _post_mask(client, image_bytes(), mask_encoding="bmp")
+    assert response.status_code == 400
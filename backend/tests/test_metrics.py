@@ -0,0 +1,40 @@
+import re
+
+
+def _sample(body: str, series: str) -> float:
+    match = re.search(rf"^{re.escape(series)} (\S+)$", body, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def _post(client, data):
+    return client.post("/process-image", files={"file": ("foto.png", data, "image/png")},
+                       data={"remove_background": "true"})
+
+
+def test_metrics_exposition(client, image_bytes):
+    requests = 'http_request_duration_seconds_count{route="/process-image",status="200"}'
+    decode = 'image_stage_duration_seconds_count{stage="decode"}'
+    before = client.get("/metrics").text
+    _post(client, image_bytes())
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert _sample(body, requests) == _sample(before, requests) + 1
+    assert _sample(body, decode) > _sample(before, decode)
+    assert "# TYPE pending_requests gauge" in body
+    assert _sample(body, 'cache_misses_total{cache="results"}') == 1
+
+
+def test_server_timing_lists_stages(client, main, image_bytes, monkeypatch):
+    # SERVER_TIMING é lido no import: liga no middleware já montado
+    layer = main.app.middleware_stack
+    while not isinstance(layer, main._MetricsMiddleware):
+        layer = layer.app
+    assert "server-timing" not in _post(client, image_bytes()).headers
+
+    monkeypatch.setattr(layer, "server_timing", True)
+    response = _post(client, image_bytes(color=(0, 90, 0)))
+    stages = dict(entry.split(";dur=") for entry in
+                  response.headers["server-timing"].split(", "))
+    assert {"read", "decode", "encode", "total"} <= set(stages)
+    assert all(float(value) >= 0 for value in stages.values())
@@ -0,0 +1,46 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+
+def _post(client, data, accept=None, **fields):
+    headers = {"Accept": accept} if accept else {}
+    return client.post("/process-image", files={"file": ("foto.png", data, "image/png")},
+                       data={"remove_background": "true", **fields}, headers=headers)
+
+
+@pytest.mark.parametrize("accept,expected", [
+    (None, "image/png"),
+    ("*/*", "image/png"),
+    ("image/webp,image/*;q=0.8", "image/webp"),
+    ("image/png,image/webp;q=0.5", "image/png"),
+    ("image/webp;q=0", "image/png"),
+])
+def test_accept_picks_format(client, main, image_bytes, accept, expected):
+    if expected == "image/webp" and "webp" not in main.AVAILABLE_OUTPUT_FORMATS:
+        pytest.skip("Pillow sem WebP")
+    response = _post(client, image_bytes(), accept)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == expected
+    assert "Accept" in response.headers["vary"]
+    assert Image.open(io.BytesIO(response.content)).format == expected.split("/")[1].upper()
+
+
+def test_explicit_format_ignores_accept(client, image_bytes):
+    response = _post(client, image_bytes(), "image/webp", output_format="jpeg", quality="70")
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "Accept" not in response.headers.get("vary", "")
+
+
+def test_presets_trade_size(client):
+    # Degradê: comprime bem, então o esforço do preset aparece no tamanho
+    y, x = np.mgrid[0:256, 0:256]
+    pixels = np.stack([x, y, x * y // 256], axis=-1).astype(np.uint8)
+    with io.BytesIO() as out:
+        Image.fromarray(pixels).save(out, format="PNG")
+        data = out.getvalue()
+    fast = _post(client, data, output_format="png", output_preset="fast")
+    small = _post(client, data, output_format="png", output_preset="small")
+    assert len(small.content) < len(fast.content)
@@ -0,0 +1,37 @@
+import pytest
+
+ENDPOINTS = [
+    ("/process-image", "file"),
+    ("/process-images", "files"),
+    ("/process-sequence", "file"),
+    ("/jobs", "file"),
+]
+
+
+@pytest.mark.parametrize("path,field", ENDPOINTS)
+@pytest.mark.parametrize("options", [
+    {"model": "inexistente"},
+    {"background_fit": "esticar"},
+    {"output_format": "bmp"},
+    {"output_preset": "qualquer"},
+    {"quality": "0"},
+])
+def test_invalid_options_rejected_alike(client, main, image_bytes, path, field, options):
+    with pytest.raises(main.HTTPException) as exc:
+        main._parse_processing_options(**options)
+
+    response = client.post(path, files={field: ("foto.png", image_bytes(), "image/png")},
+                           data={"remove_background": "true", **options})
+    assert response.status_code == 400
+    assert response.json()["detail"] == exc.value.detail
+
+
+def test_live_config_uses_same_validation(client, main):
+    with client.websocket_connect("/ws/live") as ws:
+        assert ws.receive_json()["type"] == "config"
+        ws.send_json({"type": "config", "model": "inexistente"})
+        message = ws.receive_json()
+    assert message["type"] == "error" and message["status"] == 400
+    with pytest.raises(main.HTTPException) as exc:
+        main._parse_processing_options(model="inexistente")
+    assert message["detail"] == exc.value.detail
@@ -0,0 +1,20 @@
+def _post(client, data, **fields):
+    return client.post("/process-image", files={"file": ("foto.png", data, "image/png")},
+                       data={"remove_background": "true", **fields})
+
+
+def test_repeated_upload_served_from_cache(client, main, image_bytes, predictions):
+    first = _post(client, image_bytes())
+    second = _post(client, image_bytes())
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    assert len(predictions) == 1
+    assert main._result_cache.stats()["hits"] == 1
+
+
+def test_cache_key_includes_options(client, image_bytes, predictions):
+    _post(client, image_bytes())
+    _post(client, image_bytes(), output_format="webp")
+    _post(client, image_bytes(), model="u2netp")
+    # Formato novo reaproveita a máscara; modelo novo não
+    assert predictions == ["u2net", "u2netp"]
@@ -0,0 +1,57 @@
+import io
+import zipfile
+
+from PIL import Image
+
+
+def _zip_of_frames(frames: dict[str, bytes]) -> bytes:
+    with io.BytesIO() as buffer:
+        with zipfile.ZipFile(buffer, "w") as zf:
+            for name, data in frames.items():
+                zf.writestr(name, data)
+        return buffer.getvalue()
+
+
+def test_frames_reuse_mask_until_scene_changes(client, image_bytes, predictions,
+                                               multipart_parts):
+    # Fora de ordem no zip: a sequência segue o nome dos arquivos
+    archive = _zip_of_frames({
+        "quadro-003.png": image_bytes(color=(0, 0, 255)),
+        "quadro-001.png": image_bytes(),
+        "quadro-002.png": image_bytes(),
+    })
+    response = client.post(
+        "/process-sequence", files={"archive": ("quadros.zip", archive, "application/zip")})
+    assert response.status_code == 200
+    assert response.headers["x-frame-count"] == "3"
+    parts = multipart_parts(response)
+    assert [h["x-frame-index"] for h, _ in parts] == ["0", "1", "2"]
+    assert [h["x-mask-reused"] for h, _ in parts] == ["false", "true", "false"]
+    assert len(predictions) == 2
+    for headers, body in parts:
+        assert headers["x-frame-status"] == "200"
+        assert Image.open(io.BytesIO(body)).mode == "RGBA"
+
+
+def test_animated_gif_keeps_frame_durations(client, predictions, multipart_parts):
+    frames = [Image.new("RGB", (32, 32), color) for color in ((255, 0, 0), (0, 255, 0))]
+    with io.BytesIO() as out:
+        frames[0].save(out, format="GIF", save_all=True,
+                       append_images=frames[1:], duration=80, loop=0)
+        gif = out.getvalue()
+    response = client.post(
+        "/process-sequence", files={"file": ("anim.gif", gif, "image/gif")},
+        data={"result": "mask"})
+    parts = multipart_parts(response)
+    assert len(parts) == 2
+    assert all(h["x-frame-duration"] == "80" for h, _ in parts)
+    assert all(Image.open(io.BytesIO(body)).mode == "L" for _, body in parts)
+
+
+def test_sequence_needs_exactly_one_source(client, image_bytes):
+    assert client.post("/process-sequence").status_code == 400
+    response = client.post("/process-sequence", files={
+        "file": ("a.png", image_bytes(), "image/png"),
+        "archive": ("q.zip", _zip_of_frames({"a.png": image_bytes()}), "application/zip"),
+    })
+    assert response.status_code == 400
@@ -0,0 +1,32 @@
+import io
+
+import pytest
+from fastapi import HTTPException
+
+
+def test_header_is_sniffed_once_on_long_input(main, monkeypatch):
+    calls = []
+    sniff = main._sniff_image_header
+
+    def counting_sniff(prefix):
+        calls.append(len(prefix))
+        return sniff(prefix)
+
+    monkeypatch.setattr(main, "_sniff_image_header", counting_sniff)
+    with pytest.raises(HTTPException) as exc:
+        main._read_image_stream_chunks(io.BytesIO(b"\0" * (4 * 1024 * 1024)))
+    assert exc.value.status_code == 415
+    # Prefixo e, no fim, o arquivo inteiro: nunca um por bloco
+    assert len(calls) == 2
+
+
+def test_upload_validation(client, image_bytes):
+    def post(data, content_type="image/png"):
+        return client.post(
+            "/process-image", files={"file": ("foto.png", data, content_type)})
+
+    assert post(image_bytes()).status_code == 200
+    assert post(b"").status_code == 400
+    assert post(b"nada de imagem").status_code == 415
+    assert post(image_bytes(fmt="GIF"), "image/png").status_code == 415
+    assert post(image_bytes(), "image/gif").status_code == 415
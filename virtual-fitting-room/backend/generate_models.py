@@ -1,14 +1,41 @@
 #!/usr/bin/env python3
 """
 Script para gerar modelos 3D básicos para o provador virtual
-Gera avatares e roupas simples usando geometrias básicas
+Gera avatares e roupas simples usando geometrias básicas, a partir de uma
+especificação em JSON (models_spec.json). Cada entrada vira um arquivo em
+models/avatars ou models/clothes; entradas com "matrix" são expandidas no
+produto cartesiano dos valores, com o id como modelo de nome:
+
+    {"id": "tshirt-{size}", "category": "tops", "matrix": {"size": ["P", "M", "G"]}}
+
+Os modelos são gerados em um pool de processos, e o hash da especificação de
+cada um fica registrado em models/.generated.json: modelos cuja especificação
+não mudou não são gerados de novo.
+
+Uso:
+    python generate_models.py [--spec models_spec.json] [--models-dir models]
+                              [--workers N] [--force]
 """
 
+import argparse
+import hashlib
+import itertools
+import json
 import os
 import trimesh
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+from optimize_assets import ingest_all, write_atomic
+
+SPEC_FILE = Path(__file__).with_name("models_spec.json")
+STATE_FILENAME = ".generated.json"
+# Incrementar quando a geometria gerada mudar: invalida todos os hashes
+GENERATOR_VERSION = 1
+# Escala das roupas por tamanho (M é a referência)
+SIZE_SCALES = {"PP": 0.9, "P": 0.95, "M": 1.0, "G": 1.05, "GG": 1.1}
+
 
 def create_basic_avatar(gender="unisex", height=1.8, width=0.6, depth=0.3):
     """Cria um avatar básico usando geometrias simples"""
@@ -62,6 +89,10 @@ def create_basic_avatar(gender="unisex", height=1.8, width=0.6, depth=0.3):
 def create_basic_clothing(category, size="M"):
     """Cria roupas básicas usando geometrias simples"""
 
+    if size not in SIZE_SCALES:
+        raise ValueError(
+            f"Tamanho inválido: {size}. Aceito: {', '.join(SIZE_SCALES)}")
+
     if category == "tops":
         # Camiseta
         clothing = trimesh.creation.box(extents=[0.7, 0.5, 0.4])
@@ -82,58 +113,130 @@ def create_basic_clothing(category, size="M"):
         clothing = trimesh.creation.box(extents=[0.5, 0.5, 0.3])
         clothing.visual.face_colors = [0.5, 0.5, 0.5, 1.0]  # Cinza
 
+    if SIZE_SCALES[size] != 1.0:
+        clothing.apply_scale(SIZE_SCALES[size])
+
     return clothing
 
 
-def generate_all_models():
-    """Gera todos os modelos básicos"""
+ASSET_BUILDERS = {"avatars": create_basic_avatar, "clothes": create_basic_clothing}
 
-    # Criar diretórios se não existirem
-    models_dir = Path("models")
-    avatars_dir = models_dir / "avatars"
-    clothes_dir = models_dir / "clothes"
 
-    avatars_dir.mkdir(parents=True, exist_ok=True)
-    clothes_dir.mkdir(parents=True, exist_ok=True)
+def expand_entries(entries):
+    """Expande entradas com "matrix" em um modelo por combinação de valores"""
+    for entry in entries:
+        base = {key: value for key, value in entry.items() if key != "matrix"}
+        matrix = entry.get("matrix") or {}
+        names = sorted(matrix)
+        for values in itertools.product(*(matrix[name] for name in names)):
+            params = {**base, **dict(zip(names, values))}
+            params["id"] = base["id"].format(**params)
+            yield params
+
+
+def load_spec(path):
+    """Lê a especificação: {(tipo, id): parâmetros do gerador}"""
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    assets = {}
+    for kind in ASSET_BUILDERS:
+        for params in expand_entries(spec.get(kind, [])):
+            asset_id = params.pop("id")
+            if (kind, asset_id) in assets:
+                raise ValueError(f"Id repetido na especificação: {kind}/{asset_id}")
+            assets[(kind, asset_id)] = params
+    return assets
+
 
-    # Gerar avatares
-    print("Gerando avatares...")
+def spec_hash(kind, params):
+    raw = json.dumps({"generator": GENERATOR_VERSION, "kind": kind, "params": params},
+                     sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
 
-    # Avatar feminino
-    female_avatar = create_basic_avatar(gender="female")
-    female_avatar.export(str(avatars_dir / "female-avatar.glb"))
 
-    # Avatar masculino
-    male_avatar = create_basic_avatar(gender="male")
-    male_avatar.export(str(avatars_dir / "male-avatar.glb"))
+def build_asset(models_dir, kind, asset_id, params):
+    """Gera e grava um modelo; roda em um processo do pool"""
+    mesh = ASSET_BUILDERS[kind](**params)
+    data = mesh.export(file_type="glb")
+    write_atomic(os.path.join(models_dir, kind, f"{asset_id}.glb"), data)
+    return len(data)
 
-    # Avatar unissex
-    unisex_avatar = create_basic_avatar(gender="unisex")
-    unisex_avatar.export(str(avatars_dir / "unisex-avatar.glb"))
 
-    # Gerar roupas
-    print("Gerando roupas...")
+def load_state(models_dir):
+    path = models_dir / STATE_FILENAME
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
 
-    # Camiseta
-    tshirt = create_basic_clothing("tops")
-    tshirt.export(str(clothes_dir / "tshirt-001.glb"))
 
-    # Calça jeans
-    jeans = create_basic_clothing("bottoms")
-    jeans.export(str(clothes_dir / "jeans-001.glb"))
+def generate_all_models(spec_path=SPEC_FILE, models_dir="models", workers=None,
+                        force=False):
+    """Gera os modelos da especificação que mudaram desde a última execução"""
 
-    # Vestido
-    dress = create_basic_clothing("dresses")
-    dress.export(str(clothes_dir / "dress-001.glb"))
+    assets = load_spec(spec_path)
+
+    # Criar diretórios se não existirem
+    models_dir = Path(models_dir)
+    for kind in ASSET_BUILDERS:
+        (models_dir / kind).mkdir(parents=True, exist_ok=True)
+
+    state = load_state(models_dir)
+    wanted = {f"{kind}/{asset_id}.glb": (kind, asset_id, params)
+              for (kind, asset_id), params in assets.items()}
+
+    # Modelos gerados antes e que saíram da especificação (só os gerados aqui)
+    for key in [key for key in state if key not in wanted]:
+        (models_dir / key).unlink(missing_ok=True)
+        del state[key]
+
+    pending = {}
+    for key, (kind, asset_id, params) in wanted.items():
+        digest = spec_hash(kind, params)
+        recorded = state.get(key)
+        path = models_dir / key
+        if not force and recorded and recorded["spec_sha256"] == digest \
+                and path.is_file() and path.stat().st_size == recorded["size"]:
+            continue
+        pending[key] = (kind, asset_id, params, digest)
+
+    print(f"Gerando {len(pending)} de {len(wanted)} modelos "
+          f"({len(wanted) - len(pending)} em dia)...")
+    try:
+        if pending:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(build_asset, str(models_dir), kind, asset_id, params): key
+                    for key, (kind, asset_id, params, _) in pending.items()}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    state[key] = {"spec_sha256": pending[key][3], "size": future.result()}
+    finally:
+        # O que já foi gerado fica registrado mesmo se algum modelo falhar
+        write_atomic(str(models_dir / STATE_FILENAME),
+                     json.dumps(state, indent=2, sort_keys=True).encode())
+
+    # Variantes otimizadas e pré-comprimidas servidas pela API
+    print("Otimizando modelos...")
+    ingest_all(str(models_dir), force=force, workers=workers)
 
     print("Modelos gerados com sucesso!")
-    print(f"Avatares salvos em: {avatars_dir}")
-    print(f"Roupas salvas em: {clothes_dir}")
+    print(f"Avatares salvos em: {models_dir / 'avatars'}")
+    print(f"Roupas salvas em: {models_dir / 'clothes'}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Gera os modelos 3D básicos a partir da especificação")
+    parser.add_argument("--spec", default=str(SPEC_FILE))
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processos do pool (padrão: número de CPUs)")
+    parser.add_argument("--force", action="store_true",
+                        help="Regerar mesmo os modelos em dia")
+    args = parser.parse_args()
     try:
-        generate_all_models()
+        generate_all_models(args.spec, args.models_dir, args.workers, args.force)
     except ImportError:
         print("Erro: Biblioteca trimesh não encontrada.")
         print("Instale com: pip install trimesh")
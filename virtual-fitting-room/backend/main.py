@@ -1,20 +1,1043 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, JSONResponse, FileResponse
+from fastapi.responses import (
+    Response, JSONResponse, FileResponse, RedirectResponse, StreamingResponse)
 from fastapi.staticfiles import StaticFiles
-from PIL import Image
-from rembg import remove
+from PIL import Image, ImageChops
+from rembg.sessions import sessions_class
+from rembg.sessions.base import BaseSession
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+import numpy as np
+import onnxruntime as ort
+import trimesh
+from trimesh.scene.scene import append_scenes
+import bisect
+import gzip
+import hashlib
 import io
 import asyncio
+import base64
 import os
 import json
-from typing import List, Optional
+import multiprocessing
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional
 from pydantic import BaseModel
 
 
 MAX_FILE_SIZE_BYTES = 10 * 1024 * 1024  # 10MB
 PROCESS_TIMEOUT_SECONDS = 30
 ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png"}
+ALLOWED_IMAGE_FORMATS = {"JPEG", "PNG"}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Prefixo analisado uma única vez atrás do cabeçalho (EXIF/ICC longos cabem)
+HEADER_SNIFF_BYTES = 256 * 1024
+# Foto + fundo + campos do formulário
+MAX_REQUEST_BODY_BYTES = 2 * MAX_FILE_SIZE_BYTES + 64 * 1024
+# Composição sobre o fundo: como o fundo ocupa o tamanho da foto
+BACKGROUND_FIT_MODES = ("cover", "contain", "stretch")
+DEFAULT_BACKGROUND_FIT = os.getenv("BACKGROUND_FIT", "stretch")
+# Fundos já ajustados, por processo de inferência
+BACKGROUND_CACHE_MAX_BYTES = int(
+    os.getenv("BACKGROUND_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Faixa de linhas por passada da mistura alpha (buffers de trabalho pequenos)
+BLEND_CHUNK_ROWS = 256
+
+# Modelos de segmentação disponíveis (nome público -> nome da sessão no rembg)
+REMBG_MODELS = {
+    "u2net": "u2net",
+    "u2netp": "u2netp",
+    "isnet": "isnet-general-use",
+    "silueta": "silueta",
+}
+DEFAULT_MODEL = os.getenv("REMBG_MODEL", "u2net")
+# Modelos carregados e aquecidos na inicialização (separados por vírgula)
+PRELOAD_MODELS = [
+    m.strip() for m in os.getenv("REMBG_PRELOAD_MODELS", DEFAULT_MODEL).split(",")
+    if m.strip()
+]
+# 0 = deixa o onnxruntime decidir
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+WARMUP_IMAGE_SIZE = (64, 64)
+
+# Processos de inferência dedicados e controle de admissão
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+MAX_PENDING_REQUESTS = int(os.getenv("MAX_PENDING_REQUESTS", "32"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+WORKER_RESTART_BACKOFF_SECONDS = 1
+
+# Métricas (/metrics) e cabeçalho Server-Timing opcional por requisição
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Registro dos modelos 3D em memória (id -> arquivo), montado na inicialização
+MODELS_DIR = "models"
+ASSET_KINDS = ("avatars", "clothes")
+# Em ordem de preferência quando o mesmo id existe nos dois formatos
+ASSET_EXTENSIONS = (".glb", ".gltf")
+# Intervalo entre verificações dos diretórios (só reindexa o que mudou)
+ASSET_REFRESH_SECONDS = float(os.getenv("ASSET_REFRESH_SECONDS", "2"))
+# URL canônica de cada tipo (a única que serve os arquivos) e media types
+ASSET_ROUTES = {"avatars": "/models/avatar", "clothes": "/models/clothes",
+                "outfits": "/outfits"}
+ASSET_MEDIA_TYPES = {"glb": "model/gltf-binary", "gltf": "model/gltf+json"}
+# URLs com ?v=<hash> nunca mudam de conteúdo; as demais revalidam pelo ETag
+ASSET_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+ASSET_REVALIDATE_CACHE = "no-cache"
+ASSET_VERSION_LENGTH = 16
+# Variantes geradas na ingestão (optimize_assets.py): GLB otimizado e cópias
+# pré-comprimidas, em ordem de preferência do Content-Encoding
+ASSET_VARIANTS_DIR = os.path.join(MODELS_DIR, "variants")
+ASSET_ENCODINGS = ("br", "gzip")
+ASSET_CHUNK_SIZE = 64 * 1024
+
+# Avatar + roupas montados em um único GLB no servidor, em cache LRU no disco
+OUTFIT_CACHE_DIR = os.getenv("OUTFIT_CACHE_DIR", "outfits")
+OUTFIT_CACHE_MAX_BYTES = int(
+    os.getenv("OUTFIT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Avatares sob medida (/models/avatar-custom): malha base em memória, corpo
+# gerado por combinação linear de formas, cache LRU por medidas arredondadas
+CUSTOM_AVATAR_CACHE_ENTRIES = int(os.getenv("CUSTOM_AVATAR_CACHE_ENTRIES", "256"))
+CUSTOM_AVATAR_STEP_CM = 1
+# Medidas em metros: (mínimo, padrão, máximo)
+CUSTOM_AVATAR_MEASURES = {"height": (1.0, 1.8, 2.3), "width": (0.3, 0.6, 1.0),
+                          "depth": (0.15, 0.3, 0.6)}
+AVATAR_COLORS = {"female": [0.9, 0.7, 0.7, 1.0], "male": [0.7, 0.7, 0.9, 1.0],
+                 "unisex": [0.8, 0.8, 0.8, 1.0]}
+
+# Catálogo de roupas em SQLite, com filtros e paginação por cursor no servidor
+CATALOG_DB = os.getenv("CATALOG_DB", "catalog.sqlite3")
+# JSON (lista de ClothingItem) importado na inicialização; vazio = nada a importar
+CATALOG_FILE = os.getenv("CATALOG_FILE", "")
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "50"))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", "200"))
+CLOTHING_CATEGORIES = ["tops", "bottoms", "dresses", "shoes", "accessories"]
+CLOTHING_GENDERS = ["male", "female", "unisex"]
+
+
+# Sessões rembg/onnxruntime nomeadas, criadas uma única vez por processo
+_sessions: dict[str, BaseSession] = {}
+_sessions_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def _labels(*pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def _metric(name: str, kind: str, help_text: str, samples) -> list[str]:
+    # samples: lista de (labels, valor) no formato texto do Prometheus
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_labels(*sorted(labels.items()))} {value}"
+              for labels, value in samples]
+    return lines
+
+
+class _Histogram:
+    """Histograma cumulativo no formato texto do Prometheus"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            snapshot = [(key, list(counts), total, count)
+                        for key, (counts, total, count) in sorted(self._series.items())]
+        lines = [f"# HELP {self.name} {self.help_text}",
+                 f"# TYPE {self.name} histogram"]
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(
+                    f"{self.name}_bucket{_labels(*key, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(*key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_labels(*key)} {total}")
+            lines.append(f"{self.name}_count{_labels(*key)} {count}")
+        return lines
+
+
+_stage_seconds = _Histogram(
+    "image_stage_duration_seconds", "Duração de cada etapa do processamento.")
+_request_seconds = _Histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP.")
+# Tempos por etapa da requisição atual (alimenta o Server-Timing)
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+
+def _record_stage(name: str, elapsed: float) -> None:
+    _stage_seconds.observe(elapsed, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def _stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage(name, time.perf_counter() - start)
+
+
+def _timed_call(func, args: tuple):
+    # Executado no processo de inferência: as etapas medidas lá voltam junto
+    # com o resultado e são registradas no processo principal
+    timings: dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        return func(*args), timings
+    finally:
+        _request_timings.reset(token)
+
+
+def _create_session(model: str) -> BaseSession:
+    rembg_name = REMBG_MODELS[model]
+    session_class = next(
+        (sc for sc in sessions_class if sc.name() == rembg_name), None)
+    if session_class is None:
+        raise ValueError(f"Modelo não suportado pelo rembg: {rembg_name}")
+
+    sess_opts = ort.SessionOptions()
+    if ORT_INTRA_OP_THREADS > 0:
+        sess_opts.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    if ORT_INTER_OP_THREADS > 0:
+        sess_opts.inter_op_num_threads = ORT_INTER_OP_THREADS
+    sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return session_class(rembg_name, sess_opts)
+
+
+def _warmup_session(session: BaseSession) -> None:
+    # Uma inferência descartável aloca os buffers e compila o grafo
+    dummy = Image.new("RGB", WARMUP_IMAGE_SIZE, (127, 127, 127))
+    session.predict(dummy)
+
+
+def _get_session(model: str) -> BaseSession:
+    session = _sessions.get(model)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(model)
+        if session is None:
+            session = _create_session(model)
+            _warmup_session(session)
+            _sessions[model] = session
+    return session
+
+
+def _preload_sessions() -> None:
+    for model in PRELOAD_MODELS:
+        _get_session(model)
+
+
+def _inference_worker_main(conn, intra_threads: int) -> None:
+    # Ponto de entrada de cada processo de inferência: carrega e aquece as
+    # sessões uma vez e depois executa as tarefas recebidas pelo pipe
+    global ORT_INTRA_OP_THREADS
+    if ORT_INTRA_OP_THREADS <= 0:
+        ORT_INTRA_OP_THREADS = intra_threads
+    start = time.perf_counter()
+    try:
+        _preload_sessions()
+    except Exception as exc:
+        conn.send(("error", repr(exc)))
+        return
+    conn.send(("ready", (sorted(_sessions), time.perf_counter() - start)))
+
+    while True:
+        try:
+            func, args = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            break
+        try:
+            conn.send(("ok", func(*args)))
+        except _InvalidImageError as exc:
+            conn.send(("invalid", str(exc)))
+        except Exception as exc:
+            conn.send(("error", repr(exc)))
+
+
+class _InferenceWorker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.restarts = 0
+        self.models: list[str] = []
+        self.load_seconds: float | None = None
+
+    def call(self, func, args):
+        self.conn.send((func, args))
+        return self.conn.recv()
+
+
+class _InferencePool:
+    """Processos de inferência dedicados, cada um com suas próprias sessões carregadas"""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [_InferenceWorker(i) for i in range(self.size)]
+        # Uma thread por worker fica bloqueada esperando a resposta do pipe
+        self._io = ThreadPoolExecutor(
+            max_workers=self.size, thread_name_prefix="inference-io")
+        self._idle: asyncio.Queue | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def models(self) -> list[str]:
+        return sorted({m for w in self._workers if w.ready for m in w.models})
+
+    async def open(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._idle = asyncio.Queue()
+        # Sobe todos os processos antes de esperar o aquecimento de cada um
+        for worker in self._workers:
+            await loop.run_in_executor(None, self._spawn, worker)
+        for worker in self._workers:
+            await loop.run_in_executor(None, self._wait_ready, worker)
+            self._idle.put_nowait(worker)
+
+    async def run(self, func, args: tuple, timeout: float | None = None):
+        if self._idle is None:
+            raise RuntimeError("Pool de inferência não iniciado")
+        loop = asyncio.get_running_loop()
+        worker = await self._acquire()
+        job = loop.run_in_executor(self._io, worker.call, func, args)
+        try:
+            status, payload = await asyncio.wait_for(job, timeout)
+        except BaseException:
+            # Timeout, cancelamento ou processo morto: o processo é encerrado
+            # de fato (a inferência não continua gastando CPU) e substituído
+            self._schedule_restart(worker)
+            raise
+        self._idle.put_nowait(worker)
+        if status == "invalid":
+            raise _InvalidImageError(payload)
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "worker": w.index,
+                "pid": w.process.pid if w.process is not None else None,
+                "alive": w.process is not None and w.process.is_alive(),
+                "ready": w.ready,
+                "restarts": w.restarts,
+                "load_seconds": w.load_seconds,
+            }
+            for w in self._workers
+        ]
+
+    @property
+    def busy(self) -> int:
+        if self._idle is None:
+            return 0
+        return sum(1 for w in self._workers if w.ready) - self._idle.qsize()
+
+    def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        for worker in self._workers:
+            self._terminate(worker)
+        self._io.shutdown(wait=False)
+        self._idle = None
+
+    async def _acquire(self) -> _InferenceWorker:
+        while True:
+            worker = await self._idle.get()
+            if worker.process.is_alive():
+                return worker
+            # Worker morreu enquanto estava ocioso: repor e tentar o próximo
+            self._schedule_restart(worker)
+
+    def _schedule_restart(self, worker: _InferenceWorker) -> None:
+        worker.ready = False
+        task = asyncio.get_running_loop().create_task(self._restart(worker))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _restart(self, worker: _InferenceWorker) -> None:
+        loop = asyncio.get_running_loop()
+        worker.restarts += 1
+        while True:
+            try:
+                await loop.run_in_executor(None, self._replace, worker)
+                break
+            except Exception:
+                await asyncio.sleep(WORKER_RESTART_BACKOFF_SECONDS)
+        if self._idle is not None:
+            self._idle.put_nowait(worker)
+
+    def _replace(self, worker: _InferenceWorker) -> None:
+        self._terminate(worker)
+        self._spawn(worker)
+        self._wait_ready(worker)
+
+    def _spawn(self, worker: _InferenceWorker) -> None:
+        intra_threads = max(1, (os.cpu_count() or 1) // self.size)
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_inference_worker_main,
+            args=(child_conn, intra_threads),
+            name=f"inference-worker-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process, worker.conn, worker.ready = process, parent_conn, False
+
+    @staticmethod
+    def _wait_ready(worker: _InferenceWorker) -> None:
+        status, payload = worker.conn.recv()
+        if status != "ready":
+            raise RuntimeError(f"Falha ao iniciar worker de inferência: {payload}")
+        worker.models, worker.load_seconds = payload
+        worker.ready = True
+
+    @staticmethod
+    def _terminate(worker: _InferenceWorker) -> None:
+        worker.ready = False
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+        if worker.conn is not None:
+            worker.conn.close()
+            worker.conn = None
+
+
+class _AdmissionGate:
+    """Limita as requisições em processamento; acima do limite a resposta é 503"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.pending = 0
+
+    def try_acquire(self) -> bool:
+        if self.pending >= self.limit:
+            return False
+        self.pending += 1
+        return True
+
+    def release(self) -> None:
+        self.pending -= 1
+
+
+_inference_pool = _InferencePool(INFERENCE_WORKERS)
+_admission = _AdmissionGate(MAX_PENDING_REQUESTS)
+
+
+def _service_unavailable(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=detail,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+class _Asset(NamedTuple):
+    id: str
+    kind: str
+    filename: str
+    path: str
+    type: str
+    size: int
+    mtime: float
+    sha256: str
+    # Content-Encoding -> (caminho, tamanho) das cópias pré-comprimidas
+    encodings: dict[str, tuple[str, int]]
+    # Nível de detalhe desta representação (0 = malha completa), triângulos
+    # (None = desconhecido) e, no nível 0, os LODs mais leves em ordem
+    lod: int = 0
+    triangles: int | None = None
+    lods: tuple = ()
+
+    @property
+    def version(self) -> str:
+        return self.sha256[:ASSET_VERSION_LENGTH]
+
+    @property
+    def canonical_url(self) -> str:
+        return f"{ASSET_ROUTES[self.kind]}/{self.id}"
+
+    @property
+    def url(self) -> str:
+        # Versionada pelo conteúdo: pode ficar em cache para sempre
+        if self.lod:
+            return f"{self.canonical_url}?lod={self.lod}&v={self.version}"
+        return f"{self.canonical_url}?v={self.version}"
+
+    def etag(self, encoding: str | None = None) -> str:
+        # Cada codificação é uma representação diferente: ETag próprio
+        return f'"{self.sha256}-{encoding}"' if encoding else f'"{self.sha256}"'
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _AssetRegistry:
+    """Índice em memória dos modelos 3D por tipo: listagem e busca sem tocar o disco"""
+
+    def __init__(self, root: str, kinds: tuple[str, ...], variants_root: str):
+        self.root = root
+        self.variants_root = variants_root
+        self._assets: dict[str, dict[str, _Asset]] = {kind: {} for kind in kinds}
+        self._listing: dict[str, list[_Asset]] = {kind: [] for kind in kinds}
+        self._dir_mtimes: dict[str, tuple] = {}
+        # caminho -> (tamanho, mtime em ns, sha256): só arquivos alterados são relidos
+        self._hashes: dict[str, tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+        self.refreshed_at: float | None = None
+
+    def get(self, kind: str, asset_id: str) -> _Asset | None:
+        return self._assets[kind].get(asset_id)
+
+    def list(self, kind: str) -> list[_Asset]:
+        return self._listing[kind]
+
+    def counts(self) -> dict[str, int]:
+        return {kind: len(assets) for kind, assets in self._assets.items()}
+
+    def refresh(self, force: bool = False) -> None:
+        # Criar/remover/renomear arquivos muda o mtime do diretório; um
+        # arquivo sobrescrito no lugar só muda o próprio (tamanho, mtime), que
+        # é conferido a cada verificação com um stat por modelo. Sem mudança
+        # não há o que reindexar. Manifestos de variantes são gravados com
+        # rename, então o diretório deles também conta
+        with self._lock:
+            for kind in self._assets:
+                directories = (os.path.join(self.root, kind),
+                               os.path.join(self.variants_root, kind))
+                mtimes = tuple(self._dir_mtime(d) for d in directories)
+                if not force and self._dir_mtimes.get(kind) == mtimes \
+                        and not self._files_changed(directories[0]):
+                    continue
+                self._dir_mtimes[kind] = mtimes
+                self._scan(kind, *directories)
+            self.refreshed_at = time.time()
+
+    @staticmethod
+    def _dir_mtime(directory: str) -> int | None:
+        try:
+            return os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _files_changed(self, directory: str) -> bool:
+        for path, (size, mtime_ns, _) in self._hashes.items():
+            if os.path.dirname(path) != directory:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return True
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                return True
+        return False
+
+    def _hash(self, path: str, stat: os.stat_result) -> str:
+        cached = self._hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        digest = _file_sha256(path)
+        self._hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def _scan(self, kind: str, directory: str, variants_dir: str) -> None:
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            entries = []
+
+        candidates = []
+        for entry in entries:
+            asset_id, extension = os.path.splitext(entry.name)
+            if extension in ASSET_EXTENSIONS:
+                candidates.append(
+                    (asset_id, ASSET_EXTENSIONS.index(extension), entry))
+
+        found: dict[str, _Asset] = {}
+        # Caminhos dos originais (com variantes, asset.path aponta para a cópia)
+        live: set[str] = set()
+        for asset_id, _, entry in sorted(candidates, key=lambda c: c[:2]):
+            if asset_id in found:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                asset = _Asset(
+                    asset_id, kind, entry.name, entry.path,
+                    os.path.splitext(entry.name)[1][1:], stat.st_size,
+                    stat.st_mtime, self._hash(entry.path, stat), {})
+            except OSError:
+                # Removido entre a listagem e a leitura
+                continue
+            found[asset_id] = self._with_variants(asset, variants_dir)
+            live.add(entry.path)
+
+        for path in [p for p in self._hashes
+                     if os.path.dirname(p) == directory and p not in live]:
+            del self._hashes[path]
+        # Troca atômica: leitores nunca veem um índice pela metade
+        self._assets[kind] = found
+        self._listing[kind] = list(found.values())
+
+    @staticmethod
+    def _with_variants(asset: _Asset, variants_dir: str) -> _Asset:
+        # Manifesto de outra versão do arquivo (ingestão pendente) é ignorado
+        try:
+            with open(os.path.join(variants_dir, f"{asset.id}.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return asset
+        if manifest.get("source_sha256") != asset.sha256:
+            return asset
+        asset_dir = os.path.join(variants_dir, asset.id)
+
+        def representation(entry: dict) -> dict:
+            fields = {"encodings": {
+                encoding: (os.path.join(asset_dir, variant["filename"]), variant["size"])
+                for encoding, variant in entry.get("encodings", {}).items()
+                if encoding in ASSET_ENCODINGS
+            }}
+            if entry.get("filename"):
+                # GLB gerado na ingestão substitui o original
+                fields.update(
+                    path=os.path.join(asset_dir, entry["filename"]), type="glb",
+                    size=entry["size"], sha256=entry["sha256"])
+            return fields
+
+        asset = asset._replace(
+            triangles=manifest.get("triangles"), **representation(manifest))
+        lods = tuple(
+            asset._replace(lod=entry["level"], triangles=entry["triangles"],
+                           **representation(entry))
+            for entry in sorted(manifest.get("lods", []), key=lambda e: e["level"]))
+        return asset._replace(lods=lods)
+
+
+_asset_registry = _AssetRegistry(MODELS_DIR, ASSET_KINDS, ASSET_VARIANTS_DIR)
+
+
+class _OutfitCache:
+    """GLBs de avatar + roupas já montados, em disco, com despejo LRU por bytes"""
+
+    # Receitas (avatar + roupas) lembradas depois do despejo, para remontar
+    # uma composição cuja URL já foi entregue
+    MAX_RECIPES = 4096
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _Asset] = OrderedDict()
+        self._recipes: OrderedDict[str, tuple[str, tuple[str, ...]]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(avatar: _Asset, clothes: list[_Asset]) -> str:
+        # Configuração ordenada + hash do conteúdo: trocar um arquivo invalida
+        parts = [avatar.id, avatar.sha256,
+                 *sorted(f"{item.id}:{item.sha256}" for item in clothes)]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def open(self) -> None:
+        # Composições de execuções anteriores continuam valendo (mais antigas
+        # primeiro na ordem de despejo). O hash vem do arquivo .json ao lado:
+        # nenhum GLB é lido na inicialização
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            key, extension = os.path.splitext(entry.name)
+            if extension == ".glb":
+                stat = entry.stat()
+                entries.append((stat.st_mtime, key, entry.path, stat.st_size))
+        for mtime, key, path, size in sorted(entries):
+            try:
+                with open(f"{path[:-len('.glb')]}.json") as f:
+                    meta = json.load(f)
+                recipe = (meta["avatar"], tuple(meta["clothes"]))
+                sha256 = meta["sha256"]
+            except (OSError, ValueError, KeyError, TypeError):
+                # Sem metadados (versão anterior): remontada quando pedida
+                self._remove_files(path)
+                continue
+            self._remember(key, recipe)
+            self._add(self._entry(key, path, size, sha256, mtime))
+
+    def get(self, key: str) -> _Asset | None:
+        with self._lock:
+            asset = self._entries.get(key)
+            if asset is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return asset
+
+    def peek(self, key: str) -> _Asset | None:
+        # Sem contar acerto nem mexer na ordem (downloads do arquivo)
+        with self._lock:
+            return self._entries.get(key)
+
+    def recipe(self, key: str) -> tuple[str, tuple[str, ...]] | None:
+        # (avatar, roupas) de uma composição já montada, mesmo se despejada
+        with self._lock:
+            return self._recipes.get(key)
+
+    def build(self, key: str, avatar: _Asset, clothes: list[_Asset]) -> _Asset:
+        # Roupas já modeladas no espaço do avatar: a cena é só a união
+        scenes = [trimesh.load(item.path, force="scene") for item in (avatar, *clothes)]
+        data = append_scenes(scenes).export(file_type="glb")
+        path = os.path.join(self.directory, f"{key}.glb")
+        sha256 = hashlib.sha256(data).hexdigest()
+        recipe = (avatar.id, tuple(item.id for item in clothes))
+        self._write(path, data)
+        compressed = gzip.compress(data, compresslevel=6, mtime=0)
+        if len(compressed) < len(data):
+            self._write(f"{path}.gz", compressed)
+        self._write(os.path.join(self.directory, f"{key}.json"), json.dumps(
+            {"sha256": sha256, "avatar": recipe[0], "clothes": list(recipe[1])}).encode())
+        asset = self._entry(key, path, len(data), sha256, time.time())
+        with self._lock:
+            self._remember(key, recipe)
+            self._add(asset)
+        return asset
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries), "bytes": self._bytes}
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _entry(key: str, path: str, size: int, sha256: str, mtime: float) -> _Asset:
+        encodings = {}
+        if os.path.exists(f"{path}.gz"):
+            encodings["gzip"] = (f"{path}.gz", os.path.getsize(f"{path}.gz"))
+        return _Asset(key, "outfits", os.path.basename(path), path, "glb",
+                      size, mtime, sha256, encodings)
+
+    @staticmethod
+    def _remove_files(path: str) -> None:
+        for name in (path, f"{path}.gz", f"{path[:-len('.glb')]}.json"):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key: str, recipe: tuple[str, tuple[str, ...]]) -> None:
+        self._recipes[key] = recipe
+        self._recipes.move_to_end(key)
+        while len(self._recipes) > self.MAX_RECIPES:
+            self._recipes.popitem(last=False)
+
+    def _size(self, asset: _Asset) -> int:
+        return asset.size + sum(size for _, size in asset.encodings.values())
+
+    def _add(self, asset: _Asset) -> None:
+        previous = self._entries.pop(asset.id, None)
+        if previous is not None:
+            self._bytes -= self._size(previous)
+        self._entries[asset.id] = asset
+        self._bytes += self._size(asset)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._size(evicted)
+            self._remove_files(evicted.path)
+
+
+_outfit_cache = _OutfitCache(OUTFIT_CACHE_DIR, OUTFIT_CACHE_MAX_BYTES)
+# Montagens em andamento: pedidos simultâneos da mesma roupa esperam a mesma
+_outfit_builds: dict[str, asyncio.Future] = {}
+
+
+async def _get_outfit(avatar: _Asset, clothes: list[_Asset]) -> _Asset:
+    key = _OutfitCache.key(avatar, clothes)
+    cached = _outfit_cache.get(key)
+    if cached is not None:
+        return cached
+    build = _outfit_builds.get(key)
+    if build is None:
+        build = asyncio.ensure_future(
+            asyncio.to_thread(_outfit_cache.build, key, avatar, clothes))
+        _outfit_builds[key] = build
+        build.add_done_callback(lambda _: _outfit_builds.pop(key, None))
+    # shield: um cliente que desiste não cancela a montagem dos outros
+    return await asyncio.shield(build)
+
+
+class _CustomAvatar(NamedTuple):
+    id: str
+    gender: str
+    # Medidas já arredondadas (metros): altura, largura, profundidade
+    measures: tuple[float, float, float]
+    data: bytes
+    sha256: str
+    encodings: dict[str, bytes]
+    type: str = "glb"
+
+    @property
+    def version(self) -> str:
+        return self.sha256[:ASSET_VERSION_LENGTH]
+
+    @property
+    def url(self) -> str:
+        height, width, depth = self.measures
+        return (f"/models/avatar-custom?gender={self.gender}&height={height:g}"
+                f"&width={width:g}&depth={depth:g}&v={self.version}")
+
+    def etag(self, encoding: str | None = None) -> str:
+        return f'"{self.sha256}-{encoding}"' if encoding else f'"{self.sha256}"'
+
+
+class _ParametricAvatars:
+    """Malha base do avatar em memória; corpos sob medida por transformação vetorizada"""
+
+    # Mesmo corpo do create_basic_avatar (generate_models.py). Cada parte é
+    # uma primitiva unitária com escala e posição por eixo (x, y, z), e cada
+    # valor é dado por pesos de (altura, largura, profundidade)
+    PARTS = (
+        ("box", ((0, 1, 0), (0.4, 0, 0), (0, 0, 1)),
+         ((0, 0, 0), (0.3, 0, 0), (0, 0, 0))),                 # torso
+        ("sphere", ((0, 0.3, 0), (0, 0.3, 0), (0, 0.3, 0)),
+         ((0, 0, 0), (0.7, 0, 0), (0, 0, 0))),                 # cabeça
+        ("box", ((0, 0.15, 0), (0.35, 0, 0), (0, 0.15, 0)),
+         ((0, -0.4, 0), (0.4, 0, 0), (0, 0, 0))),              # braço esquerdo
+        ("box", ((0, 0.15, 0), (0.35, 0, 0), (0, 0.15, 0)),
+         ((0, 0.4, 0), (0.4, 0, 0), (0, 0, 0))),               # braço direito
+        ("box", ((0, 0.2, 0), (0.5, 0, 0), (0, 0.2, 0)),
+         ((0, -0.2, 0), (-0.1, 0, 0), (0, 0, 0))),             # perna esquerda
+        ("box", ((0, 0.2, 0), (0.5, 0, 0), (0, 0.2, 0)),
+         ((0, 0.2, 0), (-0.1, 0, 0), (0, 0, 0))),              # perna direita
+    )
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, _CustomAvatar] = OrderedDict()
+        self._lock = threading.Lock()
+        self._basis: np.ndarray | None = None
+        self._faces: np.ndarray | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def _base(self) -> tuple[np.ndarray, np.ndarray]:
+        # Montada uma vez: basis[m] é o deslocamento de cada vértice por metro
+        # da medida m, então vértices = medidas · basis (uma tensordot só)
+        with self._lock:
+            if self._basis is None:
+                bases, faces, offset = [], [], 0
+                for primitive, scale, position in self.PARTS:
+                    if primitive == "box":
+                        unit = trimesh.creation.box(extents=[1, 1, 1])
+                    else:
+                        unit = trimesh.creation.uv_sphere(radius=1)
+                    scale = np.asarray(scale, dtype=np.float64).T        # (medida, eixo)
+                    position = np.asarray(position, dtype=np.float64).T
+                    bases.append(unit.vertices[None] * scale[:, None] + position[:, None])
+                    faces.append(unit.faces + offset)
+                    offset += len(unit.vertices)
+                self._basis = np.concatenate(bases, axis=1)
+                self._faces = np.concatenate(faces)
+            return self._basis, self._faces
+
+    @staticmethod
+    def key(gender: str, height: float, width: float, depth: float) -> tuple:
+        # Medidas arredondadas: corpos a menos de meio passo são o mesmo
+        return (gender, *(round(value * 100 / CUSTOM_AVATAR_STEP_CM)
+                          for value in (height, width, depth)))
+
+    def get(self, gender: str, height: float, width: float, depth: float) -> _CustomAvatar:
+        key = self.key(gender, height, width, depth)
+        with self._lock:
+            avatar = self._entries.get(key)
+            if avatar is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return avatar
+            self.misses += 1
+        avatar = self._build(key)
+        with self._lock:
+            self._entries[key] = avatar
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return avatar
+
+    def _build(self, key: tuple) -> _CustomAvatar:
+        gender, *steps = key
+        measures = np.asarray(steps, dtype=np.float64) * CUSTOM_AVATAR_STEP_CM / 100
+        basis, faces = self._base()
+        mesh = trimesh.Trimesh(np.tensordot(measures, basis, axes=1), faces,
+                               process=False)
+        mesh.visual.face_colors = AVATAR_COLORS[gender]
+        data = mesh.export(file_type="glb")
+        encodings = {}
+        compressed = gzip.compress(data, compresslevel=6, mtime=0)
+        if len(compressed) < len(data):
+            encodings["gzip"] = compressed
+        return _CustomAvatar(
+            "-".join(map(str, key)), gender,
+            tuple(round(float(v), 4) for v in measures), data,
+            hashlib.sha256(data).hexdigest(), encodings)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+_custom_avatars = _ParametricAvatars(CUSTOM_AVATAR_CACHE_ENTRIES)
+
+
+async def _refresh_assets() -> None:
+    while True:
+        await asyncio.sleep(ASSET_REFRESH_SECONDS)
+        await asyncio.to_thread(_asset_registry.refresh)
+
+
+async def _start_inference_pool() -> None:
+    await _inference_pool.open()
+    _ready.set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sobe os workers em segundo plano; /health só fica pronto quando todos
+    # tiverem carregado e aquecido os modelos
+    startup = asyncio.create_task(_start_inference_pool())
+    # Índice dos modelos 3D pronto antes da primeira requisição
+    await asyncio.to_thread(_asset_registry.refresh, True)
+    await asyncio.to_thread(_catalog_store.open, CATALOG_FILE)
+    await asyncio.to_thread(_outfit_cache.open)
+    refresh = asyncio.create_task(_refresh_assets())
+    yield
+    startup.cancel()
+    refresh.cancel()
+    _catalog_store.close()
+    _inference_pool.close()
+
+
+class _BodySizeLimitMiddleware:
+    """Recusa corpos acima do limite enquanto os bytes chegam, antes do parse do multipart"""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() \
+                and int(content_length) > self.max_bytes:
+            response = JSONResponse(
+                {"detail": "Requisição excede o tamanho máximo."}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(
+                        status_code=413, detail="Requisição excede o tamanho máximo.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class _MetricsMiddleware:
+    """Mede cada requisição por rota e, se ligado, devolve o Server-Timing das etapas"""
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: dict[str, float] = {}
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def timed_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    timings["total"] = time.perf_counter() - start
+                    value = ", ".join(
+                        f"{name};dur={seconds * 1000:.1f}"
+                        for name, seconds in timings.items())
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", value.encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _request_timings.reset(token)
+            # Rota (template) em vez do caminho: um id por série seria demais
+            route = getattr(scope.get("route"), "path", "other")
+            _request_seconds.observe(
+                time.perf_counter() - start, route=route, status=status_code)
 
 
 # Modelos Pydantic para o provador virtual
@@ -37,7 +1060,195 @@ class AvatarConfig(BaseModel):
     background: Optional[str] = "studio"
 
 
-app = FastAPI(title="virtual-fitting-room-service", version="2.0.0")
+# Catálogo de demonstração, gravado quando o banco começa vazio
+DEFAULT_CLOTHES = [
+    {
+        "id": "tshirt-001",
+        "name": "Camiseta Básica",
+        "category": "tops",
+        "gender": "unisex",
+        "size": "M",
+        "texture_url": "/static-models/textures/tshirt-001.jpg",
+        "model_url": "/static-models/clothes/tshirt-001.glb",
+        "price": 49.90,
+        "description": "Camiseta básica de algodão"
+    },
+    {
+        "id": "jeans-001",
+        "name": "Calça Jeans",
+        "category": "bottoms",
+        "gender": "unisex",
+        "size": "M",
+        "texture_url": "/static-models/textures/jeans-001.jpg",
+        "model_url": "/static-models/clothes/jeans-001.glb",
+        "price": 89.90,
+        "description": "Calça jeans clássica"
+    },
+    {
+        "id": "dress-001",
+        "name": "Vestido Elegante",
+        "category": "dresses",
+        "gender": "female",
+        "size": "M",
+        "texture_url": "/static-models/textures/dress-001.jpg",
+        "model_url": "/static-models/clothes/dress-001.glb",
+        "price": 129.90,
+        "description": "Vestido elegante para ocasiões especiais"
+    }
+]
+
+
+class _CatalogStore:
+    """Catálogo de roupas em SQLite, indexado pelos campos de filtro e ordenação"""
+
+    COLUMNS = ("id", "name", "category", "gender", "size", "texture_url",
+               "model_url", "price", "description")
+    FILTERS = ("category", "gender", "size")
+    # Ordenação pública -> (expressão SQL, descendente). A expressão é a mesma
+    # dos índices para o SQLite usá-los; roupas sem preço ficam no fim
+    SORTS = {
+        "id": ("id", False),
+        "name": ("name", False),
+        "price": ("IFNULL(price, 9e999)", False),
+        "-price": ("IFNULL(price, 9e999)", True),
+    }
+    # Tipo da chave de cada ordenação, conferido nos cursores recebidos
+    SORT_KEY_TYPES = {"id": (str,), "name": (str,),
+                      "price": (int, float), "-price": (int, float)}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def open(self, import_file: str = "") -> None:
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS clothes (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    gender TEXT NOT NULL,
+                    size TEXT NOT NULL,
+                    texture_url TEXT NOT NULL,
+                    model_url TEXT,
+                    price REAL,
+                    description TEXT
+                )""")
+            # Filtro + id: a paginação por cursor continua no próprio índice
+            for column in self.FILTERS:
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS clothes_{column} ON clothes ({column}, id)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS clothes_name ON clothes (name, id)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS clothes_price"
+                " ON clothes (IFNULL(price, 9e999), id)")
+            empty = self._conn.execute("SELECT 1 FROM clothes LIMIT 1").fetchone() is None
+
+        if import_file:
+            with open(import_file, encoding="utf-8") as f:
+                self.upsert(json.load(f))
+        elif empty:
+            self.upsert(DEFAULT_CLOTHES)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def upsert(self, items: list[dict]) -> None:
+        # Valida pelo mesmo modelo da API antes de gravar
+        rows = [
+            tuple(ClothingItem(**item).model_dump()[column] for column in self.COLUMNS)
+            for item in items
+        ]
+        placeholders = ", ".join("?" * len(self.COLUMNS))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO clothes ({', '.join(self.COLUMNS)})"
+                    f" VALUES ({placeholders})", rows)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            # Estatísticas para o planejador escolher entre os índices
+            self._conn.execute("PRAGMA optimize")
+
+    def page(
+        self,
+        filters: dict[str, list[str]],
+        min_price: float | None,
+        max_price: float | None,
+        sort: str,
+        limit: int,
+        after: tuple | None = None,
+    ) -> tuple[list[dict], tuple | None]:
+        # Paginação por chave (keyset): o custo não cresce com a página
+        expression, descending = self.SORTS[sort]
+        where, params = [], []
+        for column, values in filters.items():
+            if values:
+                where.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params += values
+        if min_price is not None:
+            where.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            where.append("price <= ?")
+            params.append(max_price)
+        if after is not None:
+            where.append(f"({expression}, id) {'<' if descending else '>'} (?, ?)")
+            params += after
+        direction = "DESC" if descending else "ASC"
+        sql = (f"SELECT *, {expression} AS sort_key FROM clothes"
+               + (f" WHERE {' AND '.join(where)}" if where else "")
+               + f" ORDER BY {expression} {direction}, id {direction} LIMIT ?")
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        last = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = (rows[-1]["sort_key"], rows[-1]["id"])
+        return [{column: row[column] for column in self.COLUMNS} for row in rows], last
+
+
+_catalog_store = _CatalogStore(CATALOG_DB)
+
+
+def _encode_cursor(sort: str, last: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, *last]).encode()).decode()
+
+
+def _decode_cursor(cursor: str, sort: str) -> tuple:
+    # O cursor só vale para a mesma ordenação que o gerou
+    try:
+        cursor_sort, key, item_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    # Campos vão direto para o SQLite: lista/objeto/bool no cursor é 400
+    if cursor_sort != sort \
+            or isinstance(key, bool) or isinstance(item_id, bool) \
+            or not isinstance(key, _CatalogStore.SORT_KEY_TYPES[sort]) \
+            or not isinstance(item_id, (int, str)):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    return (key, item_id)
+
+
+def _split_values(value: str | None) -> list[str]:
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+
+app = FastAPI(title="virtual-fitting-room-service",
+              version="2.0.0", lifespan=lifespan)
 
 # CORS (liberado para facilitar integração local)
 app.add_middleware(
@@ -47,6 +1258,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(_BodySizeLimitMiddleware, max_bytes=MAX_REQUEST_BODY_BYTES)
+app.add_middleware(_MetricsMiddleware, server_timing=SERVER_TIMING)
 
 # Criar diretórios para modelos 3D se não existirem
 os.makedirs("models/avatars", exist_ok=True)
@@ -56,30 +1269,241 @@ os.makedirs("models/textures", exist_ok=True)
 
 @app.get("/health")
 async def health() -> JSONResponse:
-    return JSONResponse({"status": "ok", "service": "virtual-fitting-room"})
+    workers = _inference_pool.stats()
+    if not _ready.is_set():
+        return JSONResponse(
+            {"status": "loading", "service": "virtual-fitting-room",
+             "workers": workers},
+            status_code=503)
+    return JSONResponse({"status": "ok", "service": "virtual-fitting-room",
+                         "models": _inference_pool.models,
+                         "workers": workers,
+                         "pending_requests": _admission.pending,
+                         "assets": _asset_registry.counts(),
+                         "outfits": _outfit_cache.stats(),
+                         "custom_avatars": _custom_avatars.stats()})
 
 
 # Endpoints do provador virtual 3D
+@app.get("/metrics")
+async def metrics() -> Response:
+    workers = _inference_pool.stats()
+    lines = _stage_seconds.render() + _request_seconds.render()
+    lines += _metric("pending_requests", "gauge",
+                     "Requisições em processamento (controle de admissão).",
+                     [({}, _admission.pending)])
+    lines += _metric("max_pending_requests", "gauge",
+                     "Limite do controle de admissão.", [({}, _admission.limit)])
+    lines += _metric("inference_workers_busy", "gauge",
+                     "Processos de inferência ocupados.", [({}, _inference_pool.busy)])
+    lines += _metric("inference_workers_ready", "gauge",
+                     "Processos de inferência prontos.",
+                     [({}, sum(1 for w in workers if w["ready"]))])
+    lines += _metric("inference_worker_restarts_total", "counter",
+                     "Reinícios de cada processo de inferência.",
+                     [({"worker": w["worker"]}, w["restarts"]) for w in workers])
+    lines += _metric("model_load_seconds", "gauge",
+                     "Tempo de carga e aquecimento dos modelos em cada processo.",
+                     [({"worker": w["worker"]}, w["load_seconds"])
+                      for w in workers if w["load_seconds"] is not None])
+    outfits = _outfit_cache.stats()
+    lines += _metric("outfit_cache_hits_total", "counter",
+                     "Composições avatar + roupas servidas do cache.",
+                     [({}, outfits["hits"])])
+    lines += _metric("outfit_cache_misses_total", "counter",
+                     "Composições avatar + roupas montadas.",
+                     [({}, outfits["misses"])])
+    lines += _metric("outfit_cache_bytes", "gauge",
+                     "Bytes em disco do cache de composições.",
+                     [({}, outfits["bytes"])])
+    custom = _custom_avatars.stats()
+    lines += _metric("custom_avatar_cache_hits_total", "counter",
+                     "Avatares sob medida servidos do cache.", [({}, custom["hits"])])
+    lines += _metric("custom_avatar_cache_misses_total", "counter",
+                     "Avatares sob medida gerados.", [({}, custom["misses"])])
+    lines += _metric("assets", "gauge", "Modelos 3D indexados por tipo.",
+                     [({"kind": kind}, count)
+                      for kind, count in _asset_registry.counts().items()])
+    return Response(
+        "\n".join(lines) + "\n",
+        media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match usa comparação fraca: W/"x" casa com "x"
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    # Um único intervalo "bytes=início-fim", "bytes=início-" ou "bytes=-sufixo";
+    # None = ignorar o Range e responder o arquivo inteiro
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            suffix = int(last)
+            # Sufixo vazio ("bytes=-0") não seleciona byte nenhum
+            start = max(size - suffix, 0) if suffix > 0 else size
+            end = size - 1
+    except ValueError:
+        return None
+    if start < 0 or (end < start and start < size):
+        return None
+    if start >= size:
+        raise HTTPException(
+            status_code=416, detail="Intervalo não satisfatível.",
+            headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def _iter_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(ASSET_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _pick_encoding(accept_encoding: str | None, asset: _Asset) -> str | None:
+    # Melhor cópia pré-comprimida aceita pelo cliente (q > 0); None = original
+    if not accept_encoding or not asset.encodings:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+    for encoding in ASSET_ENCODINGS:
+        if encoding in asset.encodings \
+                and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def _select_lod(asset: _Asset, lod: int | None, max_triangles: int | None) -> _Asset:
+    # lod=N: o nível mais leve disponível até N (níveis cujo orçamento já
+    # comportava a malha não existem). max_triangles=N: o mais detalhado que
+    # cabe no orçamento, ou o mais leve de todos
+    if lod is not None:
+        chosen = asset
+        for level in asset.lods:
+            if level.lod <= lod:
+                chosen = level
+        return chosen
+    if max_triangles is not None:
+        levels = (asset, *asset.lods)
+        for level in levels:
+            if level.triangles is not None and level.triangles <= max_triangles:
+                return level
+        return levels[-1]
+    return asset
+
+
+def _validate_lod_hint(lod: int | None, max_triangles: int | None) -> None:
+    if lod is not None and lod < 0:
+        raise HTTPException(status_code=400, detail="lod deve ser maior ou igual a 0.")
+    if max_triangles is not None and max_triangles < 1:
+        raise HTTPException(
+            status_code=400, detail="max_triangles deve ser maior que 0.")
+
+
+def _asset_response(request: Request, asset: _Asset) -> Response:
+    """Entrega um modelo 3D com ETag forte, GET condicional, intervalos de bytes
+    e cópias pré-comprimidas escolhidas pelo Accept-Encoding"""
+    # Só a URL versionada com o hash atual é imutável; hash antigo revalida.
+    # O LOD escolhido é outra representação, com hash e ETag próprios
+    if request.query_params.get("v") == asset.version:
+        cache_control = ASSET_IMMUTABLE_CACHE
+    else:
+        cache_control = ASSET_REVALIDATE_CACHE
+    range_header = request.headers.get("range")
+    # Intervalos valem sobre o arquivo original (carregamento progressivo)
+    encoding = None if range_header else _pick_encoding(
+        request.headers.get("accept-encoding"), asset)
+    etag = asset.etag(encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if asset.encodings:
+        headers["Vary"] = "Accept-Encoding"
+    media_type = ASSET_MEDIA_TYPES[asset.type]
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding is not None:
+        path, _ = asset.encodings[encoding]
+        headers["Content-Encoding"] = encoding
+        return FileResponse(path, headers=headers, media_type=media_type)
+
+    if_range = request.headers.get("if-range")
+    # If-Range com outro ETag (ou data): o arquivo mudou, vai inteiro
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, asset.size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{asset.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _iter_file_range(asset.path, start, end), status_code=206,
+                headers=headers, media_type=media_type)
+    if range_header:
+        # Range ignorado: o FileResponse leria o mesmo cabeçalho por conta
+        # própria (multipart/byteranges, 400 em unidade desconhecida)
+        headers["Content-Length"] = str(asset.size)
+        return StreamingResponse(
+            _iter_file_range(asset.path, 0, asset.size - 1),
+            headers=headers, media_type=media_type)
+
+    return FileResponse(asset.path, headers=headers, media_type=media_type)
+
+
 @app.get("/models/avatar")
 async def get_avatar_models() -> JSONResponse:
     """Retorna lista de modelos de avatar disponíveis"""
     try:
-        avatar_dir = "models/avatars"
-        avatars = []
-
-        if os.path.exists(avatar_dir):
-            for file in os.listdir(avatar_dir):
-                if file.endswith(('.glb', '.gltf')):
-                    avatars.append({
-                        "id": file.replace('.glb', '').replace('.gltf', ''),
-                        "filename": file,
-                        "url": f"/static-models/avatars/{file}",
-                        "type": "glb" if file.endswith('.glb') else "gltf"
-                    })
+        avatars = [
+            {"id": asset.id, "filename": asset.filename, "url": asset.url,
+             "type": asset.type, "triangles": asset.triangles,
+             # Níveis mais leves para dispositivos fracos
+             "lods": [{"level": level.lod, "triangles": level.triangles,
+                       "url": level.url} for level in asset.lods]}
+            for asset in _asset_registry.list("avatars")
+        ]
 
         return JSONResponse({
             "avatars": avatars,
-            "default": "female-avatar" if avatars else None
+            "default": "female-avatar" if avatars else None,
+            # Corpo gerado sob medida (medidas em metros)
+            "custom": {
+                "url": "/models/avatar-custom",
+                "genders": list(AVATAR_COLORS),
+                "measures": {name: {"min": low, "default": default, "max": high}
+                             for name, (low, default, high)
+                             in CUSTOM_AVATAR_MEASURES.items()},
+            },
         })
     except Exception as e:
         raise HTTPException(
@@ -87,50 +1511,44 @@ async def get_avatar_models() -> JSONResponse:
 
 
 @app.get("/models/clothes")
-async def get_clothing_catalog() -> JSONResponse:
-    """Retorna catálogo de roupas disponíveis"""
-    try:
-        # Dados mockados para demonstração
-        clothes_catalog = [
-            {
-                "id": "tshirt-001",
-                "name": "Camiseta Básica",
-                "category": "tops",
-                "gender": "unisex",
-                "size": "M",
-                "texture_url": "/static-models/textures/tshirt-001.jpg",
-                "model_url": "/static-models/clothes/tshirt-001.glb",
-                "price": 49.90,
-                "description": "Camiseta básica de algodão"
-            },
-            {
-                "id": "jeans-001",
-                "name": "Calça Jeans",
-                "category": "bottoms",
-                "gender": "unisex",
-                "size": "M",
-                "texture_url": "/static-models/textures/jeans-001.jpg",
-                "model_url": "/static-models/clothes/jeans-001.glb",
-                "price": 89.90,
-                "description": "Calça jeans clássica"
-            },
-            {
-                "id": "dress-001",
-                "name": "Vestido Elegante",
-                "category": "dresses",
-                "gender": "female",
-                "size": "M",
-                "texture_url": "/static-models/textures/dress-001.jpg",
-                "model_url": "/static-models/clothes/dress-001.glb",
-                "price": 129.90,
-                "description": "Vestido elegante para ocasiões especiais"
-            }
-        ]
+async def get_clothing_catalog(
+    category: str | None = None,
+    gender: str | None = None,
+    size: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    sort: str = "id",
+    limit: int = CATALOG_PAGE_SIZE,
+    cursor: str | None = None,
+) -> JSONResponse:
+    """Retorna uma página do catálogo de roupas, filtrada e ordenada no servidor"""
+    if sort not in _CatalogStore.SORTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ordenação inválida. Aceito: {', '.join(_CatalogStore.SORTS)}.")
+    if not 1 <= limit <= CATALOG_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit deve estar entre 1 e {CATALOG_MAX_PAGE_SIZE}.")
+    after = _decode_cursor(cursor, sort) if cursor else None
+    # Listas separadas por vírgula (ex.: gender=female,unisex)
+    filters = {"category": _split_values(category),
+               "gender": _split_values(gender),
+               "size": _split_values(size)}
 
+    try:
+        clothes, last = await asyncio.to_thread(
+            _catalog_store.page, filters, min_price, max_price, sort, limit, after)
+        # Modelos indexados saem pela URL canônica versionada
+        for item in clothes:
+            asset = _asset_registry.get("clothes", item["id"])
+            if asset is not None:
+                item["model_url"] = asset.url
         return JSONResponse({
-            "clothes": clothes_catalog,
-            "categories": ["tops", "bottoms", "dresses", "shoes", "accessories"],
-            "genders": ["male", "female", "unisex"]
+            "clothes": clothes,
+            "next_cursor": _encode_cursor(sort, last) if last else None,
+            "categories": CLOTHING_CATEGORIES,
+            "genders": CLOTHING_GENDERS,
         })
     except Exception as e:
         raise HTTPException(
@@ -142,20 +1560,30 @@ async def apply_clothing_to_avatar(config: AvatarConfig) -> JSONResponse:
     """Aplica roupas ao avatar e retorna configuração para renderização"""
     try:
         # Validar se o avatar existe
-        avatar_dir = "models/avatars"
-        avatar_files = [f for f in os.listdir(avatar_dir) if f.endswith(
-            ('.glb', '.gltf'))] if os.path.exists(avatar_dir) else []
-
-        if not avatar_files:
+        if not _asset_registry.list("avatars"):
             raise HTTPException(
                 status_code=404, detail="Nenhum avatar disponível")
+        avatar = _asset_registry.get("avatars", config.avatar_id)
+        if avatar is None:
+            raise HTTPException(
+                status_code=404, detail="Avatar não encontrado")
 
-        # Validar roupas
-        valid_clothes = []
-        for clothing_id in config.clothing_items:
-            # Aqui você implementaria a lógica de validação real
-            # Por enquanto, aceitamos qualquer ID
+        # Validar roupas: só entram as que existem no registro de modelos
+        valid_clothes, clothing_assets, warnings = [], [], []
+        for clothing_id in dict.fromkeys(config.clothing_items):
+            asset = _asset_registry.get("clothes", clothing_id)
+            if asset is None:
+                warnings.append(f"Roupa não encontrada: {clothing_id}")
+                continue
             valid_clothes.append(clothing_id)
+            clothing_assets.append(asset)
+
+        # Cena única avatar + roupas, montada uma vez e servida do cache
+        outfit_url = None
+        try:
+            outfit_url = (await _get_outfit(avatar, clothing_assets)).url
+        except Exception:
+            warnings.append("Não foi possível montar o modelo combinado.")
 
         # Retornar configuração para o frontend
         return JSONResponse({
@@ -164,12 +1592,14 @@ async def apply_clothing_to_avatar(config: AvatarConfig) -> JSONResponse:
                 "clothing_items": valid_clothes,
                 "pose": config.pose,
                 "background": config.background,
-                "render_url": f"/static-models/avatars/{config.avatar_id}.glb"
+                "render_url": avatar.url,
+                "outfit_url": outfit_url
             },
             "compatibility": {
                 "avatar_ready": True,
-                "clothing_compatible": True,
-                "warnings": []
+                "clothing_compatible": len(valid_clothes) == len(
+                    set(config.clothing_items)),
+                "warnings": warnings
             }
         })
     except HTTPException:
@@ -179,16 +1609,89 @@ async def apply_clothing_to_avatar(config: AvatarConfig) -> JSONResponse:
             status_code=500, detail=f"Erro ao aplicar roupas: {str(e)}")
 
 
-@app.get("/models/avatar/{avatar_id}")
-async def get_avatar_model(avatar_id: str):
+@app.api_route("/outfits/{outfit_id}", methods=["GET", "HEAD"])
+async def get_outfit_model(outfit_id: str, request: Request):
+    """Retorna o GLB de avatar + roupas montado por /apply-clothes"""
+    outfit = _outfit_cache.peek(outfit_id)
+    if outfit is None:
+        # Despejada do cache depois de entregue: remontada a partir da
+        # receita, se os modelos continuam os mesmos
+        outfit = await _rebuild_outfit(outfit_id)
+    if outfit is None:
+        raise HTTPException(status_code=404, detail="Composição não encontrada")
+    return _asset_response(request, outfit)
+
+
+async def _rebuild_outfit(outfit_id: str) -> _Asset | None:
+    recipe = _outfit_cache.recipe(outfit_id)
+    if recipe is None:
+        return None
+    avatar_id, clothing_ids = recipe
+    avatar = _asset_registry.get("avatars", avatar_id)
+    clothes = [_asset_registry.get("clothes", item) for item in clothing_ids]
+    if avatar is None or None in clothes \
+            or _OutfitCache.key(avatar, clothes) != outfit_id:
+        return None
+    return await _get_outfit(avatar, clothes)
+
+
+def _custom_avatar_response(request: Request, avatar: _CustomAvatar) -> Response:
+    # Como _asset_response, mas com os bytes em memória (sem intervalos)
+    if request.query_params.get("v") == avatar.version:
+        cache_control = ASSET_IMMUTABLE_CACHE
+    else:
+        cache_control = ASSET_REVALIDATE_CACHE
+    encoding = _pick_encoding(request.headers.get("accept-encoding"), avatar)
+    etag = avatar.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if avatar.encodings:
+        headers["Vary"] = "Accept-Encoding"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=avatar.encodings[encoding] if encoding else avatar.data,
+        headers=headers, media_type=ASSET_MEDIA_TYPES[avatar.type])
+
+
+@app.api_route("/models/avatar-custom", methods=["GET", "HEAD"])
+async def get_custom_avatar_model(
+    request: Request,
+    gender: str = "unisex",
+    height: float = CUSTOM_AVATAR_MEASURES["height"][1],
+    width: float = CUSTOM_AVATAR_MEASURES["width"][1],
+    depth: float = CUSTOM_AVATAR_MEASURES["depth"][1],
+):
+    """Retorna um avatar gerado para as medidas informadas (em metros)"""
+    if gender not in AVATAR_COLORS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Gênero inválido. Aceito: {', '.join(AVATAR_COLORS)}")
+    for name, value in (("height", height), ("width", width), ("depth", depth)):
+        low, _, high = CUSTOM_AVATAR_MEASURES[name]
+        if not low <= value <= high:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{name} deve estar entre {low:g} e {high:g} metros.")
+    avatar = await asyncio.to_thread(_custom_avatars.get, gender, height, width, depth)
+    return _custom_avatar_response(request, avatar)
+
+
+@app.api_route("/models/avatar/{avatar_id}", methods=["GET", "HEAD"])
+async def get_avatar_model(
+    avatar_id: str,
+    request: Request,
+    lod: int | None = None,
+    max_triangles: int | None = None,
+):
     """Retorna o arquivo do modelo 3D do avatar"""
     try:
-        avatar_path = f"models/avatars/{avatar_id}.glb"
-        if not os.path.exists(avatar_path):
-            avatar_path = f"models/avatars/{avatar_id}.gltf"
-
-        if os.path.exists(avatar_path):
-            return FileResponse(avatar_path, media_type="application/octet-stream")
+        _validate_lod_hint(lod, max_triangles)
+        asset = _asset_registry.get("avatars", avatar_id)
+        if asset is not None:
+            return _asset_response(request, _select_lod(asset, lod, max_triangles))
         else:
             raise HTTPException(
                 status_code=404, detail="Avatar não encontrado")
@@ -199,16 +1702,19 @@ async def get_avatar_model(avatar_id: str):
             status_code=500, detail=f"Erro ao carregar avatar: {str(e)}")
 
 
-@app.get("/models/clothes/{clothing_id}")
-async def get_clothing_model(clothing_id: str):
+@app.api_route("/models/clothes/{clothing_id}", methods=["GET", "HEAD"])
+async def get_clothing_model(
+    clothing_id: str,
+    request: Request,
+    lod: int | None = None,
+    max_triangles: int | None = None,
+):
     """Retorna o arquivo do modelo 3D da roupa"""
     try:
-        clothing_path = f"models/clothes/{clothing_id}.glb"
-        if not os.path.exists(clothing_path):
-            clothing_path = f"models/clothes/{clothing_id}.gltf"
-
-        if os.path.exists(clothing_path):
-            return FileResponse(clothing_path, media_type="application/octet-stream")
+        _validate_lod_hint(lod, max_triangles)
+        asset = _asset_registry.get("clothes", clothing_id)
+        if asset is not None:
+            return _asset_response(request, _select_lod(asset, lod, max_triangles))
         else:
             raise HTTPException(status_code=404, detail="Roupa não encontrada")
     except HTTPException:
@@ -230,20 +1736,8 @@ def _validate_and_read_upload(file: UploadFile, *, required: bool = True) -> byt
         raise HTTPException(
             status_code=415, detail="Formato inválido. Aceito: JPG, PNG.")
 
-    # Ler bytes e checar tamanho
-    data = file.file.read()
-    if len(data) == 0:
-        raise HTTPException(status_code=400, detail="Arquivo vazio.")
-    if len(data) > MAX_FILE_SIZE_BYTES:
-        raise HTTPException(status_code=413, detail="Arquivo excede 10MB.")
-
-    # Validar que é uma imagem suportada pelo Pillow
-    try:
-        with Image.open(io.BytesIO(data)) as im:
-            im.verify()  # valida assinatura
-    except Exception:
-        raise HTTPException(
-            status_code=415, detail="Arquivo não é uma imagem válida.")
+    with _stage("read"):
+        data = _read_upload_chunks(file.file)
 
     # Reset cursor do arquivo (por boa prática, ainda que não usemos novamente)
     try:
@@ -254,31 +1748,189 @@ def _validate_and_read_upload(file: UploadFile, *, required: bool = True) -> byt
     return data
 
 
-def _remove_background_to_rgba(pil_image: Image.Image) -> Image.Image:
-    # rembg.remove trabalha melhor com bytes em muitos casos
-    with io.BytesIO() as buf_in:
-        pil_image.save(buf_in, format="PNG")
-        input_bytes = buf_in.getvalue()
-    output_bytes = remove(input_bytes)
-    result = Image.open(io.BytesIO(output_bytes)).convert("RGBA")
-    return result
+def _sniff_image_header(prefix: bytearray) -> bool:
+    # Lê só o cabeçalho (formato e dimensões); False = cabeçalho incompleto
+    try:
+        im = Image.open(io.BytesIO(prefix))
+    except Image.DecompressionBombError:
+        raise HTTPException(
+            status_code=413, detail="Imagem com dimensões excessivas.")
+    except Exception:
+        return False
+
+    if im.format not in ALLOWED_IMAGE_FORMATS:
+        raise HTTPException(
+            status_code=415, detail="Formato inválido. Aceito: JPG, PNG.")
+    width, height = im.size
+    if width == 0 or height == 0:
+        raise HTTPException(
+            status_code=415, detail="Arquivo não é uma imagem válida.")
+    return True
+
+
+def _read_upload_chunks(stream) -> bytes:
+    # Ler em blocos: o limite de tamanho é checado à medida que os bytes
+    # chegam e o cabeçalho é analisado uma vez, sobre o prefixo; a
+    # decodificação completa fica para o processamento (uma só)
+    data = bytearray()
+    header = None
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > MAX_FILE_SIZE_BYTES:
+            raise HTTPException(status_code=413, detail="Arquivo excede 10MB.")
+        data += chunk
+        if header is None and len(data) >= HEADER_SNIFF_BYTES:
+            header = _sniff_image_header(data)
+
+    if len(data) == 0:
+        raise HTTPException(status_code=400, detail="Arquivo vazio.")
+    if not header and not _sniff_image_header(data):
+        raise HTTPException(
+            status_code=415, detail="Arquivo não é uma imagem válida.")
+    return bytes(data)
+
+
+class _InvalidImageError(ValueError):
+    pass
+
+
+def _remove_background_to_rgba(pil_image: Image.Image, session: BaseSession) -> Image.Image:
+    # Máscara prevista direto sobre a imagem em memória e aplicada no próprio
+    # canal alpha (sem codificar/decodificar PNG no meio do caminho)
+    with _stage("inference"):
+        mask = session.predict(pil_image)[0]
+    with _stage("alpha"):
+        pil_image.putalpha(ImageChops.multiply(pil_image.getchannel("A"), mask))
+    return pil_image
+
+
+def _fit_background(background_image: Image.Image, size: tuple[int, int], fit: str) -> np.ndarray:
+    # Fundo no tamanho exato da foto (RGB, HxWx3):
+    #   stretch: distorce para o tamanho da foto
+    #   cover:   preenche tudo, cortando o excesso centralizado
+    #   contain: cabe inteiro, com faixas brancas nas sobras
+    width, height = size
+    bg = background_image if background_image.mode == "RGB" else background_image.convert("RGB")
+    if fit == "stretch":
+        return np.asarray(bg.resize(size, Image.LANCZOS, reducing_gap=3.0))
+
+    bg_width, bg_height = bg.size
+    if fit == "cover":
+        # Recorta no próprio resize (box), sem redimensionar o excesso
+        scale = max(width / bg_width, height / bg_height)
+        crop_w, crop_h = width / scale, height / scale
+        left, top = (bg_width - crop_w) / 2, (bg_height - crop_h) / 2
+        return np.asarray(bg.resize(
+            size, Image.LANCZOS, box=(left, top, left + crop_w, top + crop_h),
+            reducing_gap=3.0))
+
+    scale = min(width / bg_width, height / bg_height)
+    inner = (max(1, round(bg_width * scale)), max(1, round(bg_height * scale)))
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    left, top = (width - inner[0]) // 2, (height - inner[1]) // 2
+    canvas[top:top + inner[1], left:left + inner[0]] = np.asarray(
+        bg.resize(inner, Image.LANCZOS, reducing_gap=3.0))
+    return canvas
+
+
+class _BackgroundCache:
+    """Fundos já ajustados (LRU por bytes): o mesmo fundo em fotos do mesmo tamanho não refaz o LANCZOS"""
 
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._size = 0
 
-def _composite_on_background(foreground_rgba: Image.Image, background_image: Image.Image) -> Image.Image:
-    # Redimensionar background para o tamanho do foreground
-    bg = background_image.convert("RGB")
-    bg = bg.resize(foreground_rgba.size, Image.LANCZOS)
-    # Compor (usa o canal alpha do foreground)
-    composed = Image.new("RGB", foreground_rgba.size, (255, 255, 255))
-    composed.paste(bg, (0, 0))
-    composed.paste(foreground_rgba, (0, 0), mask=foreground_rgba.split()[-1])
-    return composed
+    def get(self, key: tuple) -> np.ndarray | None:
+        fitted = self._entries.get(key)
+        if fitted is not None:
+            self._entries.move_to_end(key)
+        return fitted
+
+    def put(self, key: tuple, fitted: np.ndarray) -> None:
+        if fitted.nbytes > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = fitted
+        self._size += fitted.nbytes
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.nbytes
+
+
+_background_cache = _BackgroundCache(BACKGROUND_CACHE_MAX_BYTES)
+
+
+class _BlendScratch(threading.local):
+    """Faixas uint16 do _blend_over por thread, reaproveitadas entre requisições"""
+
+    def __init__(self):
+        self._storage = np.empty(0, dtype=np.uint16)
+
+    def get(self, rows: int, width: int) -> tuple[np.ndarray, ...]:
+        # Um bloco só, que cresce até a maior largura vista; as faixas são
+        # vistas sobre ele (a saída, do tamanho do quadro, não fica retida)
+        band = rows * width * 3
+        needed = 2 * band + rows * width
+        if self._storage.size < needed:
+            self._storage = np.empty(needed, dtype=np.uint16)
+        return (self._storage[:band].reshape(rows, width, 3),
+                self._storage[band:2 * band].reshape(rows, width, 3),
+                self._storage[2 * band:needed].reshape(rows, width, 1))
+
+
+_blend_scratch = _BlendScratch()
+
+
+def _blend_over(rgba: np.ndarray, background: np.ndarray) -> np.ndarray:
+    # out = (fg * a + bg * (255 - a)) / 255 em uma passada, por faixas de
+    # linhas, sobre buffers de trabalho reaproveitados
+    height, width = rgba.shape[:2]
+    out = np.empty((height, width, 3), dtype=np.uint8)
+    acc, scratch, inverse = _blend_scratch.get(min(BLEND_CHUNK_ROWS, height), width)
+    rows = acc.shape[0]
+    for top in range(0, height, rows):
+        n = min(rows, height - top)
+        alpha = rgba[top:top + n, :, 3:]
+        np.multiply(rgba[top:top + n, :, :3], alpha, out=acc[:n], dtype=np.uint16)
+        np.subtract(255, alpha, out=inverse[:n], dtype=np.uint16)
+        np.multiply(background[top:top + n], inverse[:n], out=scratch[:n], dtype=np.uint16)
+        # Soma máxima 255 * 255: cabe em uint16; +127 arredonda a divisão
+        acc[:n] += scratch[:n]
+        acc[:n] += 127
+        acc[:n] //= 255
+        out[top:top + n] = acc[:n]
+    return out
+
+
+def _composite_on_background(
+    rgba: np.ndarray, background_bytes: bytes, fit: str = DEFAULT_BACKGROUND_FIT,
+) -> np.ndarray:
+    # Fundo ajustado ao tamanho da foto (do cache, se repetido) e mistura
+    # pelo canal alpha do recorte
+    height, width = rgba.shape[:2]
+    key = (hashlib.blake2b(background_bytes, digest_size=20).digest(), fit, width, height)
+    background = _background_cache.get(key)
+    if background is None:
+        try:
+            with Image.open(io.BytesIO(background_bytes)) as image:
+                background = _fit_background(image, (width, height), fit)
+        except (OSError, SyntaxError, ValueError) as exc:
+            raise _InvalidImageError(str(exc)) from exc
+        _background_cache.put(key, background)
+    # Sem nenhuma transparência não há mistura
+    if rgba[..., 3].min() == 255:
+        return np.ascontiguousarray(rgba[..., :3])
+    return _blend_over(rgba, background)
 
 
 def _process_image_sync(
     file_bytes: bytes,
     remove_background: bool,
     background_bytes: bytes | None,
+    model: str = DEFAULT_MODEL,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
 ) -> tuple[bytes, str]:
     # Abrir imagem principal
     original = Image.open(io.BytesIO(file_bytes))
@@ -290,26 +1942,45 @@ def _process_image_sync(
         media = "image/png" if fmt == "PNG" else "image/jpeg"
         return (file_bytes, media)
 
-    # Remover fundo
-    fg_rgba = _remove_background_to_rgba(original.convert("RGBA"))
+    # Remover fundo; única decodificação (arquivo truncado/corrompido vira 415)
+    try:
+        with _stage("decode"):
+            rgba = original.convert("RGBA")
+    except (OSError, SyntaxError, ValueError) as exc:
+        raise _InvalidImageError(str(exc)) from exc
+    fg_rgba = _remove_background_to_rgba(rgba, _get_session(model))
 
     # Se background fornecido, compor e retornar JPG
     if background_bytes:
-        bg_img = Image.open(io.BytesIO(background_bytes))
-        composed = _composite_on_background(fg_rgba, bg_img)
-        with io.BytesIO() as out:
-            composed.save(out, format="JPEG", quality=95, subsampling=0)
+        with _stage("composite"):
+            composed = _composite_on_background(
+                np.asarray(fg_rgba), background_bytes, background_fit)
+        with _stage("encode"), io.BytesIO() as out:
+            Image.fromarray(composed).save(out, format="JPEG", quality=95, subsampling=0)
             return (out.getvalue(), "image/jpeg")
 
     # Caso contrário, retornar PNG com transparência
-    with io.BytesIO() as out:
+    with _stage("encode"), io.BytesIO() as out:
         fg_rgba.save(out, format="PNG")
         return (out.getvalue(), "image/png")
 
 
-async def _process_with_timeout(*args, **kwargs):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _process_image_sync, *args, **kwargs)
+async def _process_with_timeout(
+    file_bytes: bytes,
+    remove_background: bool,
+    background_bytes: bytes | None,
+    model: str = DEFAULT_MODEL,
+    background_fit: str = DEFAULT_BACKGROUND_FIT,
+) -> tuple[bytes, str]:
+    args = (file_bytes, remove_background, background_bytes, model, background_fit)
+    if not remove_background:
+        return await asyncio.to_thread(_process_image_sync, *args)
+    # Cancelar esta corrotina (timeout) encerra o worker que estava processando
+    result, timings = await _inference_pool.run(
+        _timed_call, (_process_image_sync, args))
+    for name, elapsed in timings.items():
+        _record_stage(name, elapsed)
+    return result
 
 
 @app.post("/process-image")
@@ -317,35 +1988,79 @@ async def process_image(
     file: UploadFile = File(...),
     remove_background: bool = Form(False),
     background: UploadFile | None = File(None),
+    model: str = Form(DEFAULT_MODEL),
+    background_fit: str = Form(DEFAULT_BACKGROUND_FIT),
 ):
-    file_bytes = _validate_and_read_upload(file, required=True)
-    background_bytes = None
-    if background is not None:
-        if background.filename:
-            background_bytes = _validate_and_read_upload(
-                background, required=False)
-
-    try:
-        processed_bytes, media_type = await asyncio.wait_for(
-            _process_with_timeout(
-                file_bytes, remove_background, background_bytes),
-            timeout=PROCESS_TIMEOUT_SECONDS,
-        )
-    except asyncio.TimeoutError:
+    if model not in REMBG_MODELS:
         raise HTTPException(
-            status_code=504, detail="Tempo de processamento excedido.")
-    except HTTPException:
-        raise
-    except Exception:
+            status_code=400,
+            detail=f"Modelo inválido. Aceito: {', '.join(REMBG_MODELS)}.")
+    if background_fit not in BACKGROUND_FIT_MODES:
         raise HTTPException(
-            status_code=500, detail="Falha ao processar a imagem.")
+            status_code=400,
+            detail=f"Ajuste de fundo inválido. Aceito: {', '.join(BACKGROUND_FIT_MODES)}.")
+
+    if remove_background and not _ready.is_set():
+        raise _service_unavailable("Modelos ainda carregando. Tente novamente.")
+    # Fila limitada: acima do limite é melhor recusar rápido do que acumular
+    if not _admission.try_acquire():
+        raise _service_unavailable("Serviço sobrecarregado. Tente novamente.")
+    try:
+        file_bytes = await asyncio.to_thread(
+            _validate_and_read_upload, file, required=True)
+        background_bytes = None
+        if background is not None:
+            if background.filename:
+                background_bytes = await asyncio.to_thread(
+                    _validate_and_read_upload, background, required=False)
+
+        try:
+            processed_bytes, media_type = await asyncio.wait_for(
+                _process_with_timeout(
+                    file_bytes, remove_background, background_bytes, model,
+                    background_fit),
+                timeout=PROCESS_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504, detail="Tempo de processamento excedido.")
+        except _InvalidImageError:
+            raise HTTPException(
+                status_code=415, detail="Arquivo não é uma imagem válida.")
+        except HTTPException:
+            raise
+        except Exception:
+            raise HTTPException(
+                status_code=500, detail="Falha ao processar a imagem.")
+
+        return Response(content=processed_bytes, media_type=media_type)
+    finally:
+        _admission.release()
+
+
+# Caminhos antigos dos modelos 3D redirecionam para a URL canônica: uma URL
+# por arquivo, em vez de duas entradas de cache com o mesmo conteúdo
+@app.get("/static-models/avatars/{filename}")
+async def redirect_static_avatar(filename: str):
+    return _redirect_to_asset("avatars", filename)
+
+
+@app.get("/static-models/clothes/{filename}")
+async def redirect_static_clothing(filename: str):
+    return _redirect_to_asset("clothes", filename)
+
 
-    return Response(content=processed_bytes, media_type=media_type)
+def _redirect_to_asset(kind: str, filename: str) -> RedirectResponse:
+    asset = _asset_registry.get(kind, os.path.splitext(filename)[0])
+    if asset is None or asset.filename != filename:
+        raise HTTPException(status_code=404, detail="Modelo não encontrado")
+    # Permanente: aponta para a URL sem versão, que revalida pelo ETag
+    return RedirectResponse(asset.canonical_url, status_code=301)
 
 
-# Montar arquivos estáticos para modelos 3D em um caminho diferente
-app.mount("/static-models", StaticFiles(directory="models"),
-          name="static-models")
+# Texturas continuam como arquivos estáticos
+app.mount("/static-models/textures", StaticFiles(directory="models/textures"),
+          name="static-textures")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Etapa de ingestão dos modelos 3D do provador virtual
+Para cada avatar/roupa gera variantes otimizadas (vértices deduplicados,
+posições quantizadas, texturas reduzidas), níveis de detalhe (LODs) com
+orçamentos de triângulos e cópias pré-comprimidas (gzip e, se disponível,
+brotli) em models/variants. O servidor escolhe o LOD pela dica do cliente e
+a variante pelo Accept-Encoding, sem comprimir nada durante a requisição.
+
+Uso:
+    python optimize_assets.py [--models-dir models] [--workers N] [--force]
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional: sem ele só há a variante gzip
+    brotli = None
+
+ASSET_KINDS = ("avatars", "clothes")
+ASSET_EXTENSIONS = (".glb", ".gltf")
+VARIANTS_DIRNAME = "variants"
+# Posições arredondadas para uma grade de 0,1 mm: une vértices quase iguais
+# e deixa os buffers bem mais compressíveis
+POSITION_DIGITS = 4
+TEXTURE_MAX_SIDE = int(os.getenv("TEXTURE_MAX_SIDE", "2048"))
+TEXTURE_ATTRIBUTES = ("baseColorTexture", "metallicRoughnessTexture",
+                      "normalTexture", "occlusionTexture", "emissiveTexture")
+VERSION_LENGTH = 16
+# Orçamento de triângulos de cada LOD (nível 1, 2, ...); o nível 0 é a malha
+# completa. Níveis cujo orçamento já comporta a malha não são gerados
+LOD_TRIANGLE_BUDGETS = tuple(
+    int(v) for v in os.getenv("LOD_TRIANGLE_BUDGETS", "20000,5000,1000").split(",")
+    if v.strip())
+# Resolução máxima da grade de agrupamento (células no maior lado)
+LOD_MAX_GRID = 1024
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def downscale_textures(material):
+    """Reduz as texturas do material para no máximo TEXTURE_MAX_SIDE"""
+    from PIL import Image
+
+    for attribute in TEXTURE_ATTRIBUTES:
+        image = getattr(material, attribute, None)
+        if isinstance(image, Image.Image) and max(image.size) > TEXTURE_MAX_SIDE:
+            image = image.copy()
+            image.thumbnail((TEXTURE_MAX_SIDE, TEXTURE_MAX_SIDE), Image.LANCZOS)
+            setattr(material, attribute, image)
+
+
+def load_scene(data):
+    """Cena do trimesh a partir de um GLB, ou None se não puder ser carregada"""
+    import trimesh
+
+    try:
+        return trimesh.load(io.BytesIO(data), file_type="glb", force="scene")
+    except Exception:
+        return None
+
+
+def meshes(scene):
+    import trimesh
+
+    return [(name, geometry) for name, geometry in scene.geometry.items()
+            if isinstance(geometry, trimesh.Trimesh)]
+
+
+def triangle_count(scene):
+    return sum(len(geometry.faces) for _, geometry in meshes(scene))
+
+
+def optimize_mesh(scene):
+    """Deduplica vértices e faces e reduz texturas, no próprio objeto"""
+    for _, geometry in meshes(scene):
+        geometry.vertices = np.round(geometry.vertices, POSITION_DIGITS)
+        geometry.merge_vertices(digits_vertex=POSITION_DIGITS)
+        geometry.update_faces(geometry.nondegenerate_faces())
+        geometry.update_faces(geometry.unique_faces())
+        geometry.remove_unreferenced_vertices()
+        material = getattr(geometry.visual, "material", None)
+        if material is not None:
+            downscale_textures(material)
+    return scene
+
+
+def cluster_vertices(geometry, cell_size):
+    """Decimação por agrupamento: vértices na mesma célula viram um só"""
+    import trimesh
+
+    origin = geometry.bounds[0]
+    keys = np.floor((geometry.vertices - origin) / cell_size).astype(np.int64)
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = np.bincount(inverse)[:, None]
+
+    def average(values):
+        total = np.zeros((len(counts), values.shape[1]), dtype=np.float64)
+        np.add.at(total, inverse, values)
+        return total / counts
+
+    faces = inverse[geometry.faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) \
+        & (faces[:, 0] != faces[:, 2])
+    _, unique = np.unique(np.sort(faces[keep], axis=1), axis=0, return_index=True)
+    kept = np.flatnonzero(keep)[np.sort(unique)]
+
+    # Cores por face seguem as faces mantidas; por vértice e UVs, a média
+    visual = geometry.visual
+    if visual.kind == "face":
+        visual = trimesh.visual.ColorVisuals(face_colors=visual.face_colors[kept])
+    elif visual.kind == "vertex":
+        visual = trimesh.visual.ColorVisuals(vertex_colors=np.round(
+            average(visual.vertex_colors.astype(np.float64))).astype(np.uint8))
+    elif visual.kind == "texture" and visual.uv is not None:
+        visual = trimesh.visual.TextureVisuals(
+            uv=average(np.asarray(visual.uv, dtype=np.float64)),
+            material=visual.material)
+    else:
+        visual = None
+
+    simplified = trimesh.Trimesh(
+        average(geometry.vertices), faces[kept], visual=visual, process=False)
+    simplified.remove_unreferenced_vertices()
+    return simplified
+
+
+def decimate(scene, budget):
+    """Cena com no máximo `budget` triângulos (a mais detalhada que couber)"""
+    geometries = meshes(scene)
+    extent = max((float(np.ptp(g.vertices, axis=0).max()) for _, g in geometries),
+                 default=0.0)
+    if extent == 0:
+        return None
+
+    # Busca binária na resolução da grade: mais células, mais triângulos
+    best = None
+    low, high = 1, LOD_MAX_GRID
+    while low <= high:
+        cells = (low + high) // 2
+        simplified = {name: cluster_vertices(geometry, extent / cells)
+                      for name, geometry in geometries}
+        if sum(len(g.faces) for g in simplified.values()) <= budget:
+            best = simplified
+            low = cells + 1
+        else:
+            high = cells - 1
+    if best is None:
+        return None
+
+    result = scene.copy()
+    for name, geometry in best.items():
+        result.geometry[name] = geometry
+    return result
+
+
+def precompress(data):
+    """Cópias comprimidas que valem a pena (menores que o original)"""
+    encoded = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(data, quality=11)
+    return {encoding: blob for encoding, blob in encoded.items()
+            if len(blob) < len(data)}
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def add_representation(data, extension, files, keep_file=True):
+    """Registra um arquivo servido e suas cópias comprimidas em `files`"""
+    digest = sha256_bytes(data)
+    version = digest[:VERSION_LENGTH]
+    entry = {"sha256": digest, "size": len(data), "encodings": {}}
+    if keep_file:
+        entry["filename"] = f"{version}{extension}"
+        files[entry["filename"]] = data
+    for encoding, blob in precompress(data).items():
+        name = f"{version}{extension}.{'gz' if encoding == 'gzip' else encoding}"
+        files[name] = blob
+        entry["encodings"][encoding] = {"filename": name, "size": len(blob)}
+    return entry
+
+
+def ingest_asset(models_dir, kind, filename, force=False):
+    """Gera as variantes de um arquivo; devolve False se já estavam em dia"""
+    asset_id = os.path.splitext(filename)[0]
+    variants_dir = os.path.join(models_dir, VARIANTS_DIRNAME, kind)
+    asset_dir = os.path.join(variants_dir, asset_id)
+    manifest_path = os.path.join(variants_dir, f"{asset_id}.json")
+
+    with open(os.path.join(models_dir, kind, filename), "rb") as f:
+        source = f.read()
+    source_sha256 = sha256_bytes(source)
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("source_sha256") == source_sha256 \
+                and manifest.get("lod_budgets") == list(LOD_TRIANGLE_BUDGETS):
+            return False
+
+    # .gltf com buffers externos não é otimizado (só .glb autocontido)
+    scene = load_scene(source) if filename.endswith(".glb") else None
+    files = {}
+    data, extension, keep_file = source, os.path.splitext(filename)[1], False
+    if scene is not None:
+        optimized = optimize_mesh(scene).export(file_type="glb")
+        if len(optimized) < len(source):
+            data, extension, keep_file = optimized, ".glb", True
+
+    manifest = {"source_sha256": source_sha256,
+                "lod_budgets": list(LOD_TRIANGLE_BUDGETS)}
+    manifest.update(add_representation(data, extension, files, keep_file))
+    manifest["lods"] = []
+    if scene is not None:
+        triangles = triangle_count(scene)
+        manifest["triangles"] = triangles
+        for level, budget in enumerate(LOD_TRIANGLE_BUDGETS, start=1):
+            if budget >= triangles:
+                continue
+            simplified = decimate(scene, budget)
+            if simplified is None:
+                break
+            lod = {"level": level, "triangles": triangle_count(simplified)}
+            lod.update(add_representation(
+                simplified.export(file_type="glb"), ".glb", files))
+            manifest["lods"].append(lod)
+
+    os.makedirs(asset_dir, exist_ok=True)
+    for name, blob in files.items():
+        write_atomic(os.path.join(asset_dir, name), blob)
+    # Manifesto por último: o servidor só vê variantes completas
+    write_atomic(manifest_path, json.dumps(manifest, indent=2).encode())
+    for name in os.listdir(asset_dir):
+        if name not in files:
+            os.remove(os.path.join(asset_dir, name))
+    return True
+
+
+def remove_orphans(models_dir, kind, asset_ids):
+    """Apaga variantes de arquivos que não existem mais"""
+    variants_dir = os.path.join(models_dir, VARIANTS_DIRNAME, kind)
+    if not os.path.isdir(variants_dir):
+        return
+    for name in os.listdir(variants_dir):
+        asset_id = name[:-len(".json")] if name.endswith(".json") else name
+        if asset_id in asset_ids:
+            continue
+        path = os.path.join(variants_dir, name)
+        if os.path.isdir(path):
+            for child in os.listdir(path):
+                os.remove(os.path.join(path, child))
+            os.rmdir(path)
+        else:
+            os.remove(path)
+
+
+def _ingest_task(task):
+    return ingest_asset(*task)
+
+
+def ingest_all(models_dir="models", force=False, workers=1):
+    """Processa todos os avatares e roupas (em paralelo com workers != 1)"""
+    tasks = []
+    for kind in ASSET_KINDS:
+        source_dir = os.path.join(models_dir, kind)
+        if not os.path.isdir(source_dir):
+            continue
+        # Mesmo id em .glb e .gltf: vale o .glb, como no servidor
+        sources = {}
+        for name in sorted(os.listdir(source_dir)):
+            asset_id, extension = os.path.splitext(name)
+            if extension in ASSET_EXTENSIONS and (
+                    asset_id not in sources or extension == ".glb"):
+                sources[asset_id] = name
+        tasks += [(models_dir, kind, filename, force) for filename in sources.values()]
+        remove_orphans(models_dir, kind, set(sources))
+
+    # workers=None usa todos os núcleos; a decimação dos LODs é o gargalo
+    if workers == 1 or len(tasks) <= 1:
+        results = map(_ingest_task, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_ingest_task, tasks, chunksize=4)
+    try:
+        for (_, kind, filename, _), changed in zip(tasks, results):
+            print(f"{kind}/{filename}: {'variantes geradas' if changed else 'em dia'}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Gera variantes otimizadas, LODs e cópias pré-comprimidas dos modelos 3D")
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processos do pool (padrão: número de CPUs)")
+    parser.add_argument("--force", action="store_true",
+                        help="Regerar mesmo as variantes em dia")
+    args = parser.parse_args()
+    try:
+        ingest_all(args.models_dir, args.force, args.workers)
+    except ImportError as e:
+        print(f"Erro: dependência não encontrada ({e.name}).")
+        print("Instale com: pip install -r requirements.txt")
@@ -0,0 +1,110 @@
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+import trimesh
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# O serviço usa caminhos relativos (models/, catálogo, cache de outfits):
+# tudo dentro de um diretório temporário, criado antes da importação
+WORK_DIR = tempfile.mkdtemp(prefix="test-fitting-room-")
+os.chdir(WORK_DIR)
+
+
+def write_model(kind: str, name: str, extents=(0.5, 1.7, 0.3)) -> str:
+    """Grava um GLB simples (uma caixa) em models/<kind>/"""
+    path = os.path.join(WORK_DIR, "models", kind, f"{name}.glb")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    trimesh.creation.box(extents=extents).export(path)
+    return path
+
+
+write_model("avatars", "female_avatar")
+write_model("clothes", "shirt_001", extents=(0.55, 0.6, 0.35))
+
+
+def _load_service():
+    # Nome próprio no sys.modules: o serviço de imagens também tem um main.py
+    sys.path.insert(0, BACKEND_DIR)
+    spec = importlib.util.spec_from_file_location(
+        "fitting_room_main", os.path.join(BACKEND_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+service = _load_service()
+
+
+class _FakeSession:
+    """Sessão rembg de mentira: primeiro plano no retângulo central"""
+
+    def predict(self, image):
+        width, height = image.size
+        mask = Image.new("L", image.size, 0)
+        mask.paste(255, (width // 4, height // 4, 3 * width // 4, 3 * height // 4))
+        return [mask]
+
+
+@pytest.fixture
+def main():
+    return service
+
+
+@pytest.fixture
+def work_dir():
+    return WORK_DIR
+
+
+@pytest.fixture
+def image_bytes():
+    """Fábrica de imagens sólidas já codificadas (PNG por padrão)"""
+
+    def make(size=(64, 48), color=(200, 30, 30), fmt="PNG", mode="RGB") -> bytes:
+        with io.BytesIO() as out:
+            Image.new(mode, size, color).save(out, format=fmt)
+            return out.getvalue()
+
+    return make
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    # Inferência no próprio processo, sem workers nem onnxruntime
+    async def open_pool():
+        pass
+
+    async def run(func, args, timeout=None):
+        return func(*args)
+
+    monkeypatch.setattr(service._inference_pool, "open", open_pool)
+    monkeypatch.setattr(service._inference_pool, "run", run)
+    monkeypatch.setattr(service, "_get_session", lambda model: _FakeSession())
+    with TestClient(service.app) as test_client:
+        service._ready.wait(5)
+        yield test_client
+
+
+@pytest.fixture
+def ingest(client, monkeypatch):
+    """Grava um modelo, roda a ingestão (optimize_assets) e reindexa"""
+    import optimize_assets
+
+    def run(kind, name, mesh, budgets=(1000, 200)):
+        path = os.path.join(WORK_DIR, "models", kind, f"{name}.glb")
+        mesh.export(path)
+        monkeypatch.setattr(optimize_assets, "LOD_TRIANGLE_BUDGETS", budgets)
+        optimize_assets.ingest_asset(
+            os.path.join(WORK_DIR, "models"), kind, f"{name}.glb", force=True)
+        service._asset_registry.refresh()
+        return service._asset_registry.get(kind, name)
+
+    return run
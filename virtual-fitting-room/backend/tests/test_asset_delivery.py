@@ -0,0 +1,66 @@
+import pytest
+
+URL = "/models/avatar/female_avatar"
+
+
+@pytest.fixture
+def avatar(client, work_dir):
+    with open(f"{work_dir}/models/avatars/female_avatar.glb", "rb") as f:
+        return f.read()
+
+
+def test_etag_and_conditional_get(client, main, avatar):
+    response = client.get(URL)
+    assert response.status_code == 200 and response.content == avatar
+    etag = response.headers["etag"]
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["cache-control"] == main.ASSET_REVALIDATE_CACHE
+
+    assert client.get(URL, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(URL, headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get(URL, headers={"If-None-Match": '"outro"'}).status_code == 200
+    head = client.head(URL)
+    assert head.status_code == 200 and head.headers["etag"] == etag
+
+
+def test_versioned_url_is_immutable(client, main):
+    listing = client.get("/models/avatar").json()["avatars"]
+    url = next(a["url"] for a in listing if a["id"] == "female_avatar")
+    assert client.get(url).headers["cache-control"] == main.ASSET_IMMUTABLE_CACHE
+    stale = client.get(f"{URL}?v=antigo")
+    assert stale.headers["cache-control"] == main.ASSET_REVALIDATE_CACHE
+
+
+@pytest.mark.parametrize("header,selected", [
+    ("bytes=0-9", slice(0, 10)),
+    ("bytes=10-", slice(10, None)),
+    ("bytes=-16", slice(-16, None)),
+])
+def test_byte_ranges(client, avatar, header, selected):
+    response = client.get(URL, headers={"Range": header})
+    assert response.status_code == 206
+    expected = avatar[selected]
+    assert response.content == expected
+    start = len(avatar) - len(expected) if header.startswith("bytes=-") \
+        else selected.start
+    assert response.headers["content-range"] == \
+        f"bytes {start}-{start + len(expected) - 1}/{len(avatar)}"
+
+
+@pytest.mark.parametrize("header", ["bytes=-0", "bytes=999999999-"])
+def test_unsatisfiable_range_is_416(client, avatar, header):
+    response = client.get(URL, headers={"Range": header})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(avatar)}"
+
+
+def test_ignored_ranges_return_whole_file(client, avatar):
+    # Só um intervalo em bytes é atendido; o resto recebe o arquivo inteiro
+    etag = client.get(URL).headers["etag"]
+    for headers in ({"Range": "bytes=0-1,4-5"}, {"Range": "itens=0-1"},
+                    {"Range": "bytes=0-1", "If-Range": '"outro"'}):
+        response = client.get(URL, headers=headers)
+        assert response.status_code == 200 and response.content == avatar
+        assert response.headers["content-length"] == str(len(avatar))
+    response = client.get(URL, headers={"Range": "bytes=0-1", "If-Range": etag})
+    assert response.status_code == 206
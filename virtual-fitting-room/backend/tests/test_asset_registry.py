@@ -0,0 +1,45 @@
+import os
+
+import trimesh
+
+
+def test_listing_uses_registry(client):
+    response = client.get("/models/avatar")
+    assert response.status_code == 200
+    assert "female_avatar" in response.text
+
+
+def test_file_overwritten_in_place_gets_new_etag(client, main, work_dir):
+    path = f"{work_dir}/models/clothes/hat_overwrite.glb"
+    trimesh.creation.box(extents=(0.2, 0.2, 0.2)).export(path)
+    main._asset_registry.refresh()
+    first = client.get("/models/clothes/hat_overwrite")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    # Mesmo nome, conteúdo novo, sem rename: o diretório não muda
+    with open(path, "wb") as f:
+        f.write(trimesh.creation.icosphere().export(file_type="glb"))
+    main._asset_registry.refresh()
+
+    second = client.get("/models/clothes/hat_overwrite", headers={"If-None-Match": etag})
+    assert second.status_code == 200
+    assert second.headers["etag"] != etag
+    assert second.content == open(path, "rb").read()
+
+
+def test_overwritten_ingested_file_drops_stale_variants(client, main, work_dir, ingest):
+    # Vértices repetidos por face: a ingestão grava um GLB otimizado
+    sphere = trimesh.creation.icosphere()
+    mesh = trimesh.Trimesh(sphere.vertices[sphere.faces].reshape(-1, 3),
+                           faces=range(len(sphere.faces) * 3), process=False)
+    ingest("clothes", "belt_ingested", mesh, budgets=())
+    assert main._asset_registry.get("clothes", "belt_ingested").path.startswith(
+        os.path.join("models", "variants"))
+
+    # O asset aponta para a cópia otimizada; a troca do original ainda conta
+    trimesh.creation.box().export(f"{work_dir}/models/clothes/belt_ingested.glb")
+    main._asset_registry.refresh()
+    asset = main._asset_registry.get("clothes", "belt_ingested")
+    assert asset.encodings == {}
+    assert asset.path.endswith("clothes/belt_ingested.glb")
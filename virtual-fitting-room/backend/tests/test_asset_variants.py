@@ -0,0 +1,44 @@
+import gzip
+import os
+
+import pytest
+import trimesh
+
+URL = "/models/clothes/scarf_variants"
+
+
+@pytest.fixture
+def scarf(ingest):
+    # Vértices repetidos por face: a otimização tem o que deduplicar
+    mesh = trimesh.creation.icosphere(subdivisions=3)
+    mesh = trimesh.Trimesh(mesh.vertices[mesh.faces].reshape(-1, 3),
+                           faces=range(len(mesh.faces) * 3), process=False)
+    return ingest("clothes", "scarf_variants", mesh, budgets=())
+
+
+def test_optimized_glb_replaces_original(client, work_dir, scarf):
+    original = os.path.getsize(f"{work_dir}/models/clothes/scarf_variants.glb")
+    assert scarf.path.startswith(os.path.join("models", "variants"))
+    assert scarf.size < original
+    response = client.get(URL, headers={"Accept-Encoding": "identity"})
+    assert response.headers["etag"] == scarf.etag()
+    assert len(response.content) == scarf.size
+
+
+def test_precompressed_copy_by_accept_encoding(client, scarf):
+    assert "gzip" in scarf.encodings
+    path, size = scarf.encodings["gzip"]
+    response = client.get(URL, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == scarf.etag("gzip")
+    assert "Accept-Encoding" in response.headers["vary"]
+    with open(path, "rb") as f:
+        assert gzip.decompress(f.read()) == response.content
+
+    refused = client.get(URL, headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in refused.headers
+    # Intervalos valem sobre o arquivo sem compressão
+    ranged = client.get(URL, headers={"Accept-Encoding": "gzip", "Range": "bytes=0-3"})
+    assert ranged.status_code == 206 and ranged.content == b"glTF"
+    assert "content-encoding" not in ranged.headers
+
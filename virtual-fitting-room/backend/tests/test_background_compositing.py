@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+
+def test_fit_modes_and_cached_background(main):
+    background = Image.new("RGB", (100, 50), (0, 0, 255))
+    with io.BytesIO() as out:
+        background.save(out, format="PNG")
+        data = out.getvalue()
+    contain = main._fit_background(background, (40, 40), "contain")
+    assert tuple(contain[0, 0]) == (255, 255, 255)
+    assert tuple(contain[20, 20]) == (0, 0, 255)
+
+    rgba = np.zeros((40, 40, 4), dtype=np.uint8)
+    rgba[10:30, 10:30] = (200, 30, 30, 255)
+    first = main._composite_on_background(rgba, data, "cover")
+    assert tuple(first[0, 0]) == (0, 0, 255) and tuple(first[20, 20]) == (200, 30, 30)
+    key = next(k for k in main._background_cache._entries if k[1:] == ("cover", 40, 40))
+    cached = main._background_cache._entries[key]
+    main._composite_on_background(rgba, data, "cover")
+    assert main._background_cache._entries[key] is cached
+
+
+def test_process_image_with_background_fit(client, image_bytes):
+    response = client.post(
+        "/process-image",
+        files={"file": ("foto.png", image_bytes(size=(64, 48)), "image/png"),
+               "background": ("fundo.png", image_bytes(size=(16, 64), color=(0, 0, 255)),
+                              "image/png")},
+        data={"remove_background": "true", "background_fit": "contain"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    result = np.asarray(Image.open(io.BytesIO(response.content)))
+    assert result.shape == (48, 64, 3)
+    # contain: faixas brancas nas laterais, recorte no centro
+    assert (result[24, 1] > 240).all()
+    assert result[24, 32, 0] > 150 and result[24, 32, 2] < 80
+
+
+def test_invalid_background_fit(client, image_bytes):
+    response = client.post(
+        "/process-image",
+        files={"file": ("foto.png", image_bytes(), "image/png")},
+        data={"background_fit": "tile"})
+    assert response.status_code == 400
@@ -0,0 +1,39 @@
+import base64
+import json
+
+import pytest
+
+
+def _cursor(*fields) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(fields)).encode()).decode()
+
+
+def test_cursor_pagination_covers_catalog(client):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 1, "sort": "-price"}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/models/clothes", params=params).json()
+        seen += [item["id"] for item in page["clothes"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    full = client.get("/models/clothes", params={"sort": "-price"}).json()["clothes"]
+    assert seen == [item["id"] for item in full]
+    assert len(seen) == len(set(seen)) > 1
+
+
+@pytest.mark.parametrize("sort, cursor", [
+    ("price", _cursor("price", [1], "x")),
+    ("price", _cursor("price", "caro", "x")),
+    ("id", _cursor("id", "a", {"b": 1})),
+    ("name", _cursor("name", True, "x")),
+    ("id", _cursor("id", "a")),
+    ("id", _cursor("name", "a", "x")),  # cursor de outra ordenação
+    ("id", "nao-e-base64!"),
+])
+def test_malformed_cursor_is_400(client, sort, cursor):
+    response = client.get("/models/clothes", params={"sort": sort, "cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor inválido."
@@ -0,0 +1,51 @@
+import io
+
+import numpy as np
+import pytest
+import trimesh
+
+URL = "/models/avatar-custom"
+
+
+def _bounds(data: bytes) -> np.ndarray:
+    return trimesh.load(io.BytesIO(data), file_type="glb", force="mesh").bounds
+
+
+def test_measures_shape_the_mesh(client):
+    # Corpo linear nas medidas: dobrar todas dobra a caixa envolvente
+    small, large = (
+        client.get(URL, params={"height": h, "width": w, "depth": d},
+                   headers={"Accept-Encoding": "identity"})
+        for h, w, d in ((1.0, 0.4, 0.2), (2.0, 0.8, 0.4)))
+    assert small.status_code == large.status_code == 200
+    assert small.headers["content-type"] == "model/gltf-binary"
+    np.testing.assert_allclose(_bounds(large.content), 2 * _bounds(small.content), atol=1e-5)
+
+
+def test_nearby_measures_share_cache_entry(client, main):
+    before = main._custom_avatars.stats()
+    first = client.get(URL, params={"gender": "male", "width": 0.501})
+    second = client.get(URL, params={"gender": "male", "width": 0.503})
+    after = main._custom_avatars.stats()
+    assert first.headers["etag"] == second.headers["etag"]
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+
+def test_conditional_get_and_gzip(client, main):
+    response = client.get(URL, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    etag = response.headers["etag"]
+    assert etag.endswith('-gzip"')
+    repeat = client.get(URL, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert repeat.status_code == 304
+
+    url = client.get("/models/avatar").json()["custom"]["url"]
+    versioned = client.get(
+        f"{url}?height=1.8&v={main._custom_avatars.get('unisex', 1.8, 0.6, 0.3).version}")
+    assert versioned.headers["cache-control"] == main.ASSET_IMMUTABLE_CACHE
+
+
+@pytest.mark.parametrize("params", [{"gender": "robo"}, {"height": 5}, {"depth": 0.01}])
+def test_invalid_measures_are_400(client, params):
+    assert client.get(URL, params=params).status_code == 400
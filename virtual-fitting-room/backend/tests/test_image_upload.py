@@ -0,0 +1,42 @@
+import io
+
+from PIL import Image
+
+
+def _post(client, data: bytes, content_type="image/png", **fields):
+    return client.post(
+        "/process-image",
+        files={"file": ("foto.png", data, content_type)}, data=fields)
+
+
+def test_remove_background(client, image_bytes):
+    response = _post(client, image_bytes(), remove_background="true")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    result = Image.open(io.BytesIO(response.content))
+    assert result.mode == "RGBA" and result.getpixel((0, 0))[3] == 0
+
+
+def test_rejects_non_image_and_empty(client):
+    assert _post(client, b"isto nao e imagem" * 100).status_code == 415
+    assert _post(client, b"").status_code == 400
+
+
+def test_truncated_image_is_415(client, image_bytes):
+    data = image_bytes(size=(400, 300), fmt="JPEG")
+    response = _post(client, data[: len(data) // 2], "image/jpeg", remove_background="true")
+    assert response.status_code == 415
+
+
+def test_oversized_upload_rejected_while_reading(client, main, monkeypatch):
+    monkeypatch.setattr(main, "MAX_FILE_SIZE_BYTES", 100 * 1024)
+    response = _post(client, b"\x89PNG" + b"\0" * (200 * 1024))
+    assert response.status_code == 413
+
+
+def test_request_body_limit(client, main):
+    body = b"x" * (main.MAX_REQUEST_BODY_BYTES + 1)
+    response = client.post(
+        "/process-image", content=body,
+        headers={"content-type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
@@ -0,0 +1,46 @@
+import io
+
+import pytest
+import trimesh
+
+
+def _triangles(data: bytes) -> int:
+    scene = trimesh.load(io.BytesIO(data), file_type="glb", force="scene")
+    return sum(len(g.faces) for g in scene.geometry.values())
+
+
+@pytest.fixture
+def globe(ingest):
+    return ingest("avatars", "globe_lod", trimesh.creation.icosphere(subdivisions=4))
+
+
+def test_listing_exposes_levels(client, globe):
+    listing = client.get("/models/avatar").json()["avatars"]
+    entry = next(a for a in listing if a["id"] == "globe_lod")
+    assert entry["triangles"] == 5120
+    assert [level["level"] for level in entry["lods"]] == [1, 2]
+    assert all(level["triangles"] <= budget
+               for level, budget in zip(entry["lods"], (1000, 200)))
+    assert client.get(entry["lods"][0]["url"]).status_code == 200
+
+
+@pytest.mark.parametrize("query,expected_level", [
+    ("", 0),
+    ("?lod=1", 1),
+    ("?lod=9", 2),
+    ("?max_triangles=100000", 0),
+    ("?max_triangles=1000", 1),
+    ("?max_triangles=1", 2),
+])
+def test_client_hint_picks_level(client, globe, query, expected_level):
+    response = client.get(f"/models/avatar/globe_lod{query}",
+                          headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    level = (globe, *globe.lods)[expected_level]
+    assert response.headers["etag"] == level.etag()
+    assert _triangles(response.content) == level.triangles
+
+
+@pytest.mark.parametrize("query", ["?lod=-1", "?max_triangles=0"])
+def test_invalid_hint_is_400(client, globe, query):
+    assert client.get(f"/models/avatar/globe_lod{query}").status_code == 400
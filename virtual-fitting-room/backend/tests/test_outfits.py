@@ -0,0 +1,56 @@
+import os
+
+
+def _apply(client, clothes=("shirt_001",)):
+    response = client.post(
+        "/apply-clothes", json={"avatar_id": "female_avatar", "clothing_items": list(clothes)})
+    assert response.status_code == 200
+    return response.json()["avatar_config"]["outfit_url"]
+
+
+def test_outfit_is_built_and_served(client):
+    url = _apply(client)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "model/gltf-binary"
+    assert response.content[:4] == b"glTF"
+
+
+def test_evicted_outfit_is_rebuilt_on_get(client, main, monkeypatch):
+    url = _apply(client)
+    outfit_id = url.split("?")[0].rsplit("/", 1)[1]
+    # Outra montagem despeja a primeira antes do download
+    monkeypatch.setattr(main._outfit_cache, "max_bytes", 1)
+    _apply(client, clothes=())
+    assert main._outfit_cache.peek(outfit_id) is None
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content[:4] == b"glTF"
+    assert client.get("/outfits/" + "0" * 64).status_code == 404
+
+
+def test_open_uses_sidecar_without_reading_glbs(client, main, monkeypatch):
+    _apply(client)
+    directory = main._outfit_cache.directory
+    legacy = os.path.join(directory, "legado.glb")
+    with open(legacy, "wb") as f:
+        f.write(b"glTF antigo")
+
+    reopened = main._OutfitCache(directory, main.OUTFIT_CACHE_MAX_BYTES)
+    read_paths = []
+    real_open = open
+
+    def tracking_open(path, *args, **kwargs):
+        read_paths.append(str(path))
+        return real_open(path, *args, **kwargs)
+
+    with monkeypatch.context() as patched:
+        patched.setattr("builtins.open", tracking_open)
+        reopened.open()
+
+    assert not any(path.endswith(".glb") for path in read_paths)
+    assert not os.path.exists(legacy)
+    assert reopened.stats()["entries"] >= 1
+    for key, asset in reopened._entries.items():
+        assert asset.sha256 == main._outfit_cache.peek(key).sha256
@@ -1,30 +1,19 @@
-import React, { useState, useEffect } from 'react'
-import { getClothingCatalog, applyClothingToAvatar } from '../services/api'
+import React, { useState } from 'react'
+import { useClothingCatalog } from '../hooks/useClothing'
 import './ClothingCatalog.css'
 
 function ClothingCatalog({ selectedClothes, onClothingChange, selectedAvatar }) {
-  const [clothes, setClothes] = useState([])
-  const [loading, setLoading] = useState(true)
-  const [error, setError] = useState(null)
   const [selectedCategory, setSelectedCategory] = useState('all')
   const [selectedGender, setSelectedGender] = useState('all')
-
-  useEffect(() => {
-    loadClothingCatalog()
-  }, [])
-
-  const loadClothingCatalog = async () => {
-    try {
-      setLoading(true)
-      const data = await getClothingCatalog()
-      setClothes(data.clothes || [])
-    } catch (err) {
-      setError('Erro ao carregar catálogo')
-      console.error('Erro ao carregar catálogo:', err)
-    } finally {
-      setLoading(false)
-    }
-  }
+  const {
+    clothes,
+    loading,
+    loadingMore,
+    error,
+    hasMore,
+    reload: loadClothingCatalog,
+    loadMore,
+  } = useClothingCatalog({ category: selectedCategory, gender: selectedGender })
 
   const handleClothingSelect = (clothing) => {
     if (!selectedAvatar) {
@@ -45,12 +34,6 @@ function ClothingCatalog({ selectedClothes, onClothingChange, selectedAvatar })
     }
   }
 
-  const filteredClothes = clothes.filter(item => {
-    const categoryMatch = selectedCategory === 'all' || item.category === selectedCategory
-    const genderMatch = selectedGender === 'all' || item.gender === selectedGender || item.gender === 'unisex'
-    return categoryMatch && genderMatch
-  })
-
   const categories = ['all', 'tops', 'bottoms', 'dresses', 'shoes', 'accessories']
   const genders = ['all', 'male', 'female', 'unisex']
 
@@ -120,13 +103,13 @@ function ClothingCatalog({ selectedClothes, onClothingChange, selectedAvatar })
         </div>
       </div>
 
-      {filteredClothes.length === 0 ? (
+      {clothes.length === 0 ? (
         <div className="no-clothes">
           <p>Nenhuma roupa encontrada para os filtros selecionados</p>
         </div>
       ) : (
         <div className="clothing-grid">
-          {filteredClothes.map((item) => {
+          {clothes.map((item) => {
             const isSelected = selectedClothes.some(selected => selected.id === item.id)
 
             return (
@@ -160,6 +143,14 @@ function ClothingCatalog({ selectedClothes, onClothingChange, selectedAvatar })
         </div>
       )}
 
+      {hasMore && (
+        <div className="load-more">
+          <button onClick={loadMore} className="retry-btn" disabled={loadingMore}>
+            {loadingMore ? 'Carregando...' : 'Carregar mais'}
+          </button>
+        </div>
+      )}
+
       {selectedClothes.length > 0 && (
         <div className="selected-summary">
           <h4>Roupas Selecionadas ({selectedClothes.length})</h4>
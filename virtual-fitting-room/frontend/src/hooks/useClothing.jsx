@@ -1,4 +1,5 @@
-import React, { createContext, useContext, useState, useCallback } from 'react'
+import React, { createContext, useContext, useState, useCallback, useEffect, useRef } from 'react'
+import { getClothingCatalog } from '../services/api'
 
 const ClothingContext = createContext()
 
@@ -10,6 +11,76 @@ export const useClothing = () => {
   return context
 }
 
+const CATALOG_PAGE_SIZE = 50
+
+// Catálogo paginado: filtros aplicados no servidor, páginas seguintes sob demanda
+export const useClothingCatalog = ({ category = 'all', gender = 'all' } = {}) => {
+  const [clothes, setClothes] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loading, setLoading] = useState(true)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const [error, setError] = useState(null)
+  // Descarta respostas de filtros que já foram trocados
+  const requestId = useRef(0)
+
+  const buildParams = useCallback((cursor) => {
+    const params = { limit: CATALOG_PAGE_SIZE }
+    if (category !== 'all') params.category = category
+    // Peças unissex aparecem em qualquer filtro de gênero
+    if (gender !== 'all') params.gender = gender === 'unisex' ? 'unisex' : `${gender},unisex`
+    if (cursor) params.cursor = cursor
+    return params
+  }, [category, gender])
+
+  const reload = useCallback(async () => {
+    const id = ++requestId.current
+    try {
+      setLoading(true)
+      setError(null)
+      const data = await getClothingCatalog(buildParams())
+      if (id !== requestId.current) return
+      setClothes(data.clothes || [])
+      setNextCursor(data.next_cursor || null)
+    } catch (err) {
+      if (id !== requestId.current) return
+      setError('Erro ao carregar catálogo')
+      console.error('Erro ao carregar catálogo:', err)
+    } finally {
+      if (id === requestId.current) setLoading(false)
+    }
+  }, [buildParams])
+
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMore) return
+    const id = requestId.current
+    try {
+      setLoadingMore(true)
+      const data = await getClothingCatalog(buildParams(nextCursor))
+      if (id !== requestId.current) return
+      setClothes(prev => [...prev, ...(data.clothes || [])])
+      setNextCursor(data.next_cursor || null)
+    } catch (err) {
+      console.error('Erro ao carregar mais roupas:', err)
+    } finally {
+      setLoadingMore(false)
+    }
+  }, [buildParams, nextCursor, loadingMore])
+
+  useEffect(() => {
+    reload()
+  }, [reload])
+
+  return {
+    clothes,
+    loading,
+    loadingMore,
+    error,
+    hasMore: nextCursor !== null,
+    reload,
+    loadMore,
+  }
+}
+
 export const ClothingProvider = ({ children }) => {
   const [selectedClothes, setSelectedClothes] = useState([])
   const [clothingHistory, setClothingHistory] = useState([])
@@ -51,9 +51,11 @@ export const getAvatarModel = async (avatarId) => {
 }
 
 // Serviços para Roupas
-export const getClothingCatalog = async () => {
+// Filtros e paginação no servidor: { category, gender, size, min_price,
+// max_price, sort, limit, cursor } (listas separadas por vírgula)
+export const getClothingCatalog = async (params = {}) => {
   try {
-    const response = await api.get('/models/clothes')
+    const response = await api.get('/models/clothes', { params })
     return response.data
   } catch (error) {
     console.error('Erro ao buscar catálogo:', error)